@@ -0,0 +1,815 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter
+import lexer as l
+import eval as e
+import Parser as p
+import resolver as r
+import typechecking as t
+import bytecode as b
+import cache
+import bytecodefile as bf
+import fold as f
+import closures as c
+import hoisting as h
+import buffering as sb
+import tailcalls as tc
+import purity as pu
+import registers as rg
+import profiler as pr
+import pickle
+import tempfile
+
+
+tester_directory = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "tester")
+
+
+def tester_programs():
+    # every program in tester/, wrapped in braces the same way loader.main does
+    programs = []
+    for filename in sorted(os.listdir(tester_directory)):
+        if not filename.endswith(".txt"):
+            continue
+        with open(os.path.join(tester_directory, filename)) as f:
+            programs.append((filename, '{' + f.read() + '}'))
+    return programs
+
+
+def best_time(repeat, function, *args):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def parse(source):
+    tokens = l.bufferedLexer.lexerFromStream(l.Stream.streamFromString(source))
+    return p.Parser.parse_expr(p.Parser.call_parser(tokens))
+
+
+def tester_program(name, **replace):
+    # a tester program with some of its constants swapped for smaller ones,
+    # so the long running ones finish in a reasonable time
+    with open(os.path.join(tester_directory, name + ".txt")) as f:
+        source = '{' + f.read() + '}'
+    for old, new in replace.items():
+        source = source.replace(old, str(new))
+    return source
+
+
+def quietly(function, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+def lex_all(lexer_class, source):
+    tokens = lexer_class.lexerFromStream(l.Stream.streamFromString(source))
+    out = []
+    while True:
+        token = tokens.peek_token()
+        tokens.advance()
+        out.append(token)
+        if isinstance(token, l.EndOfLine):
+            return out
+
+
+def lexer_benchmark(repeat=5, scale=20):
+    # the tester programs are small, so they are lexed as one source repeated
+    # `scale` times to get measurable times
+    source = '{' + "\n".join(s for _, s in tester_programs()) * scale + '}'
+    print(f"lexing tester/ x{scale} ({len(source)} characters)")
+    for lexer_class in (l.lexer, l.bufferedLexer):
+        elapsed, tokens = best_time(repeat, lex_all, lexer_class, source)
+        tokens = None
+        tracemalloc.start()
+        tokens = lex_all(lexer_class, source)
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{lexer_class.__name__:<15} {len(tokens):>8} tokens "
+              f"{elapsed * 1000:>9.1f} ms "
+              f"{len(tokens) / elapsed / 1000:>8.0f} ktokens/s "
+              f"{retained / 1024:>8.0f} KiB retained")
+
+
+def vm_benchmark(repeat=3, limit=20000):
+    # euler7 and euler10 run their main loop up to 2000000; that is cut down
+    # to `limit`
+    for name in ("euler7", "euler10"):
+        source = tester_program(name, **{"2000000": limit})
+        code = b.compile(r.resolve(parse(source)))
+        vm = b.VM()
+        vm.load(code)
+        counts = Counter()
+        quietly(vm.execute_traced, counts)
+        executed = sum(counts.values())
+
+        def run():
+            vm.restart()
+            return vm.execute()
+        elapsed, _ = best_time(repeat, quietly, run)
+        print(f"{name:<8} {executed:>10} instructions "
+              f"{elapsed * 1000:>9.1f} ms "
+              f"{executed / elapsed / 1e6:>6.2f} Minstr/s")
+        kinds = list(b.opcodes)
+        print("         " + ", ".join(
+            f"{kinds[op].__name__} {n}" for op, n in counts.most_common(10)))
+
+
+def nested_arithmetic(depth):
+    # a chain of `depth` operations, each one nesting the rest of the chain
+    # in one of its operands
+    tree = e.numeric_literal(1)
+    for i in range(depth):
+        op = "+*/-"[i % 4]
+        k = e.numeric_literal(i + 2)
+        if op == "/":
+            tree = e.binary_operation(op, k, tree)
+        else:
+            tree = e.binary_operation(op, tree, k)
+    return tree
+
+
+def arithmetic_benchmark(repeat=3, depths=(8, 16, 24, 32)):
+    # evaluating an operand more than once makes these grow exponentially
+    # with depth; evaluated once each, the cost is linear in the depth
+    for depth in depths:
+        tree = nested_arithmetic(depth)
+        elapsed, _ = best_time(repeat, e.eval_ast, tree)
+        print(f"depth {depth:>3} {elapsed * 1e6:>12.1f} us")
+
+
+def cache_benchmark(repeat=5):
+    # compiling every tester program against loading them from a warm cache
+    programs = tester_programs()
+
+    def compile_all(load):
+        for name, source in programs:
+            load(name, source)
+
+    def compile_source(name, source):
+        return b.compile(r.resolve(parse(source)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        def from_cache(name, source):
+            return cache.cached(os.path.join(directory, name), source,
+                                "bytecode", lambda: compile_source(name, source))
+        cold, _ = best_time(repeat, compile_all, compile_source)
+        compile_all(from_cache)
+        warm, _ = best_time(repeat, compile_all, from_cache)
+    print(f"lex+parse+resolve+codegen {cold * 1000:>9.1f} ms")
+    print(f"warm cache                {warm * 1000:>9.1f} ms")
+
+
+def bytecodefile_benchmark(repeat=5, statements=20000):
+    # loading a large compiled program into the VM from a pickled ByteCode
+    # against from the binary format
+    source = '{' + "".join(
+        f"var x{i} = {i}; x{i} = x{i} * 2 + 1; print x{i}, \"x\";"
+        for i in range(statements)) + '}'
+    code = b.compile(r.resolve(parse(source)))
+    with tempfile.TemporaryDirectory() as directory:
+        pickled = os.path.join(directory, "program.pickle")
+        binary = os.path.join(directory, "program" + bf.extension)
+        with open(pickled, "wb") as f:
+            pickle.dump(code, f, protocol=pickle.HIGHEST_PROTOCOL)
+        bf.write(code, binary)
+
+        def from_pickle():
+            with open(pickled, "rb") as f:
+                b.VM().load(pickle.load(f))
+
+        def from_binary():
+            b.VM().load_lowered(*bf.read(binary))
+        for name, load, filename in (("pickle", from_pickle, pickled),
+                                     ("binary", from_binary, binary)):
+            elapsed, _ = best_time(repeat, load)
+            print(f"{name:<7} {len(code.insns):>8} instructions "
+                  f"{os.path.getsize(filename) // 1024:>6} KiB "
+                  f"{elapsed * 1000:>8.1f} ms")
+
+
+def peephole_benchmark(repeat=3, limit=20000):
+    # instructions in every tester program with and without the peephole
+    # optimizer, then instructions executed and time for euler7 and euler10
+    total = Counter()
+    for filename, source in tester_programs():
+        code = b.codegen(r.resolve(parse(source)))
+        optimized = b.peephole(code)
+        total["before"] += len(code.insns)
+        total["after"] += len(optimized.insns)
+        print(f"{filename:<12} {len(code.insns):>6} -> {len(optimized.insns):>6}")
+    print(f"{'total':<12} {total['before']:>6} -> {total['after']:>6}")
+    for name in ("euler7", "euler10"):
+        source = tester_program(name, **{"2000000": limit})
+        for optimize in (False, True):
+            vm = b.VM()
+            vm.load(b.compile(r.resolve(parse(source)), optimize))
+            counts = Counter()
+            quietly(vm.execute_traced, counts)
+
+            def run():
+                vm.restart()
+                return vm.execute()
+            elapsed, _ = best_time(repeat, quietly, run)
+            print(f"{name:<8} {'optimized' if optimize else 'plain':<10}"
+                  f"{sum(counts.values()):>10} instructions "
+                  f"{elapsed * 1000:>9.1f} ms")
+
+
+def superinstructions_benchmark(repeat=5, limit=20000):
+    # the commonest pairs of instructions executed by the peephole optimized
+    # code (what fuse() is built around), then instructions executed and
+    # time without and with the superinstructions
+    kinds = list(b.opcodes)
+    for name in ("euler7", "euler10"):
+        source = tester_program(name, **{"2000000": limit})
+        code = b.peephole(b.codegen(r.resolve(parse(source))))
+        vm = b.VM()
+        vm.load(code)
+        counts = Counter()
+        pairs = Counter()
+        quietly(vm.execute_traced, counts, pairs)
+        executed = sum(counts.values())
+        print(f"{name}: pairs of {executed} instructions")
+        for (first, second), n in pairs.most_common(12):
+            if first is not None:
+                print(f"    {kinds[first].__name__:>14} {kinds[second].__name__:<14}"
+                      f"{n:>9} {100 * n / executed:>5.1f}%")
+        for label, program in (("plain", code), ("fused", b.fuse(code))):
+            vm = b.VM()
+            vm.load(program)
+            counts = Counter()
+            quietly(vm.execute_traced, counts)
+
+            def run():
+                vm.restart()
+                return vm.execute()
+            elapsed, _ = best_time(repeat, quietly, run)
+            print(f"{name:<8} {label:<6}{sum(counts.values()):>10} instructions "
+                  f"{elapsed * 1000:>9.1f} ms")
+
+
+def nodes(program) -> int:
+    # AST nodes in program
+    if isinstance(program, list | tuple):
+        return sum(nodes(item) for item in program)
+    if not hasattr(program, "__dataclass_fields__") or isinstance(program, e.identifier):
+        return 0
+    return 1 + sum(nodes(getattr(program, name))
+                   for name in program.__dataclass_fields__ if name != "type")
+
+
+def fold_benchmark(repeat=3, limit=2000):
+    # size of the resolved trees of tester/ before and after constant
+    # folding, then euler10 on the tree-walker and the closure compiler
+    # without and with it
+    before = after = 0
+    for filename, source in tester_programs():
+        program = r.resolve(parse(source))
+        before += nodes(program)
+        after += nodes(f.fold(program))
+    print(f"tester/  {before:>6} -> {after:>6} nodes")
+    source = tester_program("euler10", **{"2000000": limit})
+    for label, program in (("plain", r.resolve(parse(source))),
+                           ("folded", f.fold(r.resolve(parse(source))))):
+        elapsed, _ = best_time(repeat, quietly, e.eval_ast,
+                               program, None, e.frame_environment())
+        compiled = c.compile(program)
+        closure_elapsed, _ = best_time(repeat, quietly, compiled.run)
+        print(f"euler10  {label:<7}eval {elapsed * 1000:>8.1f} ms"
+              f"   closures {closure_elapsed * 1000:>7.1f} ms")
+
+
+def for_benchmark(repeat=3):
+    # the VM on loop heavy programs with for loops compiled the long way
+    # (compare, branch, and the update as an ordinary assignment) and as
+    # counted loops
+    programs = {"euler1": tester_program("euler1", **{"1001": 200001}),
+                "euler4": tester_program("euler4")}
+    counted = b.counted
+    for name, source in programs.items():
+        program = f.fold(r.resolve(parse(source)))
+        for label, shape in (("plain", lambda loop: False), ("counted", counted)):
+            b.counted = shape
+            try:
+                code = b.compile(program)
+            finally:
+                b.counted = counted
+            vm = b.VM()
+            vm.load(code)
+            counts = Counter()
+            quietly(vm.execute_traced, counts)
+
+            def run():
+                vm.restart()
+                return vm.execute()
+            elapsed, _ = best_time(repeat, quietly, run)
+            print(f"{name:<8} {label:<8}{sum(counts.values()):>10} instructions "
+                  f"{elapsed * 1000:>9.1f} ms")
+
+
+def registers_benchmark(repeat=3):
+    # the stack VM against the register VM on the Euler programs, the long
+    # running ones cut down
+    programs = {"euler1": tester_program("euler1", **{"1001": 200001}),
+                "euler2": tester_program("euler2"),
+                "euler3": tester_program("euler3"),
+                "euler4": tester_program("euler4"),
+                "euler6": tester_program("euler6"),
+                "euler7": tester_program("euler7", **{"2000000": 20000}),
+                "euler10": tester_program("euler10", **{"2000000": 20000}),
+                "euler14": tester_program("euler14", **{"1000000": 3000})}
+    for name, source in programs.items():
+        program = f.fold(r.resolve(parse(source)))
+        for label, vm, code in (("stack", b.VM(), b.compile(program)),
+                                ("register", rg.RegisterVM(), rg.compile(program))):
+            vm.load(code)
+            counts = Counter()
+            quietly(vm.execute_traced, counts)
+
+            def run():
+                vm.restart()
+                return vm.execute()
+            elapsed, _ = best_time(repeat, quietly, run)
+            print(f"{name:<8} {label:<9}{sum(counts.values()):>10} instructions "
+                  f"{elapsed * 1000:>9.1f} ms")
+
+
+def tailcalls_benchmark(repeat=3, depth=100, times=200):
+    # a tail recursive function `depth` calls deep, called `times` times, on
+    # the tree-walker and the VM without and with tail calls
+    source = """{
+        def total(n, acc) {
+            var ans = acc;
+            if (n > 0) {
+                var m = n - 1;
+                var s = acc + n;
+                ans = total(m, s);
+            }
+            return ans;
+        }
+        var i = 0;
+        var t = 0;
+        while (i < %d) {
+            t = total(%d, 0);
+            i = i + 1;
+        }
+        print t;
+    }""" % (times, depth)
+    for label, program in (("calls", f.fold(r.resolve(parse(source)))),
+                           ("tail", tc.tail_calls(f.fold(r.resolve(parse(source)))))):
+        elapsed, _ = best_time(repeat, quietly, e.eval_ast,
+                               program, None, e.frame_environment())
+        vm = b.VM()
+        vm.load(b.compile(program))
+
+        def run():
+            vm.restart()
+            return vm.execute()
+        vm_elapsed, _ = best_time(repeat, quietly, run)
+        print(f"{label:<6}eval {elapsed * 1000:>8.1f} ms   vm {vm_elapsed * 1000:>8.1f} ms")
+
+
+def memo_benchmark(repeat=3, n=18, maxsize=1024):
+    # a doubly recursive fib, and euler7 (whose isprime is pure but never
+    # called twice with the same argument), on the tree-walker and the VM
+    # without and with a Memo
+    fib = """{
+        def fib(n) {
+            var ans = n;
+            if (n > 1) {
+                var a = fib(n - 1);
+                var b = fib(n - 2);
+                ans = a + b;
+            }
+            return ans;
+        }
+        var x = fib(%d);
+        print x;
+    }""" % n
+    programs = {"fib": fib,
+                "euler7": tester_program("euler7", **{"2000000": 2000})}
+    for name, source in programs.items():
+        program = pu.mark_pure(f.fold(r.resolve(parse(source))))
+        for label, memoize in (("plain", False), ("memo", True)):
+            def run_eval():
+                memo = pu.Memo(maxsize) if memoize else None
+                return e.eval_ast(program, None, e.frame_environment(memo))
+            elapsed, _ = best_time(repeat, quietly, run_eval)
+            vm = b.VM()
+            vm.load(b.compile(program))
+
+            def run_vm():
+                vm.restart()
+                vm.memo = pu.Memo(maxsize) if memoize else None
+                return vm.execute()
+            vm_elapsed, _ = best_time(repeat, quietly, run_vm)
+            stats = "" if not memoize else (
+                f"   {vm.memo.hits} hits {vm.memo.misses} misses "
+                f"{vm.memo.evictions} evictions")
+            print(f"{name:<7} {label:<6}eval {elapsed * 1000:>8.1f} ms"
+                  f"   vm {vm_elapsed * 1000:>8.1f} ms{stats}")
+
+
+def hoisting_benchmark(repeat=3, limit=5000):
+    # euler7 and euler10, whose isprime works out n^(1/2)+1 on every
+    # iteration, without and with loop-invariant hoisting, on the
+    # tree-walker, the closure compiler and the VM
+    programs = {"euler7": tester_program("euler7", **{"2000000": limit}),
+                "euler10": tester_program("euler10", **{"2000000": limit})}
+    for name, source in programs.items():
+        for label, program in (("plain", f.fold(r.resolve(parse(source)))),
+                               ("hoisted", h.hoist(f.fold(r.resolve(parse(source)))))):
+            elapsed, _ = best_time(repeat, quietly, e.eval_ast,
+                                   program, None, e.frame_environment())
+            compiled = c.compile(program)
+            closure_elapsed, _ = best_time(repeat, quietly, compiled.run)
+            vm = b.VM()
+            vm.load(b.compile(program))
+
+            def run():
+                vm.restart()
+                return vm.execute()
+            vm_elapsed, _ = best_time(repeat, quietly, run)
+            print(f"{name:<8} {label:<8}eval {elapsed * 1000:>8.1f} ms"
+                  f"   closure {closure_elapsed * 1000:>8.1f} ms"
+                  f"   vm {vm_elapsed * 1000:>8.1f} ms")
+
+
+def power_benchmark(repeat=3, times=100000, limit=20000):
+    # `^` on its own for the kinds of operands the tester programs use, then
+    # euler7 and euler10, which work out n^(1/2) for every n, on the VM
+    cases = {"int^int": (7, 3), "int^-int": (3, -2),
+             "square^(1/2)": (10**6, e.half), "int^(1/2)": (99991, e.half)}
+    for name, (x, y) in cases.items():
+        def run():
+            for _ in range(times):
+                e.power(x, y)
+        elapsed, _ = best_time(repeat, run)
+        print(f"{name:<13}{elapsed / times * 1e9:>8.0f} ns")
+    for name in ("euler7", "euler10"):
+        program = f.fold(r.resolve(parse(tester_program(name, **{"2000000": limit}))))
+        vm = b.VM()
+        vm.load(b.compile(program))
+
+        def run():
+            vm.restart()
+            return vm.execute()
+        elapsed, _ = best_time(repeat, quietly, run)
+        print(f"{name:<13}{elapsed * 1000:>8.1f} ms")
+
+
+def profiler_benchmark(repeat=3, limit=3000):
+    # euler7 on the tree-walker before, under and after the profiler: off,
+    # it leaves nothing behind to slow eval_ast down
+    program = f.fold(r.resolve(parse(tester_program("euler7", **{"2000000": limit}))))
+    before, _ = best_time(repeat, quietly, e.eval_ast,
+                          program, None, e.frame_environment())
+
+    def run_profiled():
+        profiler = pr.Profiler()
+        profiler.run(program, e.frame_environment())
+        return profiler
+    profiled, profiler = best_time(repeat, quietly, run_profiled)
+    after, _ = best_time(repeat, quietly, e.eval_ast,
+                         program, None, e.frame_environment())
+    print(f"off      {before * 1000:>8.1f} ms")
+    print(f"on       {profiled * 1000:>8.1f} ms")
+    print(f"off      {after * 1000:>8.1f} ms")
+    print(profiler.report(5))
+
+
+def lists_benchmark(repeat=3, sizes=(1000, 2000, 4000)):
+    # builds a list of n items with cons, then walks it with head and tail,
+    # on the tree-walker, the closure compiler and the VM: both are O(n) in
+    # all, so doubling n doubles the time
+    for n in sizes:
+        program = f.fold(r.resolve(parse("""{
+            var l = [0];
+            var i = 1;
+            while (i < %d) {
+                l.cons(i);
+                i = i + 1;
+            }
+            var s = 0;
+            var n = l.length;
+            while (n > 0) {
+                var x = l.head;
+                s = s + x;
+                l = l.tail;
+                n = l.length;
+            }
+            print s;
+        }""" % n)))
+        elapsed, _ = best_time(repeat, quietly, e.eval_ast,
+                               program, None, e.frame_environment())
+        compiled = c.compile(program)
+        closure_elapsed, _ = best_time(repeat, quietly, compiled.run)
+        vm = b.VM()
+        vm.load(b.compile(program))
+
+        def run():
+            vm.restart()
+            return vm.execute()
+        vm_elapsed, _ = best_time(repeat, quietly, run)
+        print(f"n = {n:<6}eval {elapsed * 1000:>8.1f} ms"
+              f"   closure {closure_elapsed * 1000:>8.1f} ms"
+              f"   vm {vm_elapsed * 1000:>8.1f} ms")
+
+
+def packed_benchmark(repeat=3, n=200000):
+    # a sieve of Eratosthenes over list(n, 0), which is packed, and over
+    # list(n, 1/2), which is a Python list, on the VM: its time and the most
+    # memory it had allocated at once
+    for label, initial in (("packed", "0"), ("list", "1/2")):
+        program = f.fold(r.resolve(parse("""{
+            var blank = %s;
+            var composite = list(%d, blank);
+            var count = 0;
+            var i = 2;
+            while (i < %d) {
+                var c = composite[i];
+                if (c == blank) {
+                    count = count + 1;
+                    var j = i * i;
+                    while (j < %d) {
+                        composite[j] = j;
+                        j = j + i;
+                    }
+                }
+                i = i + 1;
+            }
+            print count;
+        }""" % (initial, n, n, n))))
+        code = b.compile(program)
+
+        def prepare():
+            vm = b.VM()
+            vm.load(code)
+            return vm
+        elapsed, _ = best_time(repeat, quietly, lambda: prepare().execute())
+        peak = peak_memory(prepare, lambda vm: vm.execute())
+        print(f"{label:<8}{elapsed * 1000:>8.1f} ms{peak / 2**20:>8.1f} MiB")
+
+
+def buffering_benchmark(repeat=3, sizes=(2000, 8000, 32000)):
+    # builds a string of n characters with +, then overwrites it a character
+    # at a time with put, without and with string buffering, on the
+    # tree-walker, the closure compiler and the VM
+    for n in sizes:
+        source = """{
+            var s = "";
+            var i = 0;
+            while (i < %d) {
+                s = s + "a";
+                i = i + 1;
+            }
+            var j = 0;
+            while (j < %d) {
+                s[j] = "b";
+                j = j + 1;
+            }
+            var m = s.length;
+            print m;
+        }""" % (n, n)
+        for label, program in (("plain", f.fold(r.resolve(parse(source)))),
+                               ("buffered", sb.buffer_strings(f.fold(r.resolve(parse(source)))))):
+            elapsed, _ = best_time(repeat, quietly, e.eval_ast,
+                                   program, None, e.frame_environment())
+            compiled = c.compile(program)
+            closure_elapsed, _ = best_time(repeat, quietly, compiled.run)
+            vm = b.VM()
+            vm.load(b.compile(program))
+
+            def run():
+                vm.restart()
+                return vm.execute()
+            vm_elapsed, _ = best_time(repeat, quietly, run)
+            print(f"n = {n:<6} {label:<9}eval {elapsed * 1000:>8.1f} ms"
+                  f"   closure {closure_elapsed * 1000:>8.1f} ms"
+                  f"   vm {vm_elapsed * 1000:>8.1f} ms")
+
+
+def views_benchmark(repeat=3, n=100000, times=1000):
+    # the length of the keys of a dict of n entries, as a view and as the
+    # list it used to be, then a program that builds such a dict and takes
+    # the length of its keys, values and items, on the VM: its time and the
+    # most memory it had allocated at once
+    d = e.Dictionary((i, i) for i in range(n))
+    for label, keys in (("view", lambda: e.dict_view(d, "keys")),
+                        ("list", lambda: list(d.keys()))):
+        def run():
+            for _ in range(times):
+                len(keys())
+        elapsed, _ = best_time(repeat, run)
+        print(f"{label:<8}{elapsed / times * 1e6:>10.1f} us")
+    program = f.fold(r.resolve(parse("""{
+        var d = {0: 0};
+        var i = 1;
+        while (i < %d) {
+            d[i] = i;
+            i = i + 1;
+        }
+        var k = d.keys;
+        var v = d.values;
+        var it = d.items;
+        var a = k.length;
+        var b = v.length;
+        var c = it.length;
+        print a, b, c;
+    }""" % n)))
+    code = b.compile(program)
+
+    def prepare():
+        vm = b.VM()
+        vm.load(code)
+        return vm
+    elapsed, _ = best_time(repeat, quietly, lambda: prepare().execute())
+    peak = peak_memory(prepare, lambda vm: vm.execute())
+    print(f"program {elapsed * 1000:>8.1f} ms{peak / 2**20:>8.1f} MiB")
+
+
+# The suite: every tester program through each phase of the front end and
+# each engine, with statistics over repeated runs, peak memory, and a JSON
+# file of all of it to compare against the next version's.
+
+# the long running programs, cut down so the tree-walker gets through them
+suite_scaling = {"eu": {"UB = 999": "UB = 150"},
+                 "euler4": {"UB = 400": "UB = 150"},
+                 "euler7": {"2000000": 1000},
+                 "euler10": {"2000000": 1000},
+                 "euler14": {"1000000": 300}}
+
+
+def optimized(program):
+    # what loader.main does to a resolved program when optimizing
+    return pu.mark_pure(tc.tail_calls(sb.buffer_strings(h.hoist(f.fold(program)))))
+
+
+def front_end(source):
+    # everything loader.main does before handing a program to an engine
+    return optimized(r.resolve(parse(source)))
+
+
+def run_loaded(vm, code):
+    vm.load(code)
+    return vm.execute()
+
+
+# how each engine compiles an optimized, resolved program, and runs what
+# that gives
+engines = {
+    "eval": (lambda program: program,
+             lambda program: e.eval_ast(program, None, e.frame_environment())),
+    "closure": (c.compile, lambda compiled: compiled.run()),
+    "vm": (lambda program: b.compile(program, True),
+           lambda code: run_loaded(b.VM(), code)),
+    "registers": (rg.compile, lambda code: run_loaded(rg.RegisterVM(), code)),
+}
+
+
+def lexed(source):
+    return l.bufferedLexer.lexerFromStream(l.Stream.streamFromString(source))
+
+
+def parsed(tokens):
+    return p.Parser.parse_expr(p.Parser.call_parser(tokens))
+
+
+def measure(repeat, prepare, run) -> dict:
+    # min, median and standard deviation in seconds of `repeat` runs of
+    # run(prepare()), leaving prepare out of the times
+    times = []
+    for _ in range(repeat):
+        argument = prepare()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run(argument)
+            times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times),
+            "stddev": statistics.stdev(times) if repeat > 1 else 0.0}
+
+
+def peak_memory(prepare, run) -> int:
+    # the most memory, in bytes, allocated at once while run(prepare()) ran,
+    # less what prepare left allocated
+    argument = prepare()
+    tracemalloc.start()
+    try:
+        quietly(run, argument)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def failed(error: Exception) -> dict:
+    return {"error": f"{type(error).__name__}: {error}"}
+
+
+def suite_program(source, repeat) -> dict:
+    def prepared():
+        return front_end(source)
+    try:
+        typecheck = measure(repeat, lambda: parse(source), t.typecheck)
+    except Exception as error:  # the typechecker doesn't take every program
+        typecheck = failed(error)
+    phases = {
+        "lex": measure(repeat, lambda: source, lexed),
+        "parse": measure(repeat, lambda: lexed(source), parsed),
+        "typecheck": typecheck,
+        "resolve": measure(repeat, lambda: parse(source), r.resolve),
+        "optimize": measure(repeat, lambda: r.resolve(parse(source)), optimized),
+    }
+    result = {"phases": phases,
+              "front_end_peak_memory": peak_memory(lambda: source, front_end),
+              "engines": {}}
+    for name, (compile, execute) in engines.items():
+        try:
+            result["engines"][name] = {
+                "compile": measure(repeat, prepared, compile),
+                "execute": measure(repeat, lambda: compile(prepared()), execute),
+                "peak_memory": peak_memory(lambda: compile(prepared()), execute),
+            }
+        except Exception as error:
+            result["engines"][name] = failed(error)
+    return result
+
+
+def suite_benchmark(repeat=5, output=None):
+    # prints the median times, in ms, of each phase and of running each
+    # program on each engine; with output, writes every result to that file
+    # as JSON
+    results = {"interpreter_version": cache.interpreter_version(),
+               "python": platform.python_version(),
+               "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+               "repeat": repeat, "scaling": suite_scaling, "programs": {}}
+    phases = ("lex", "parse", "typecheck", "resolve", "optimize")
+    print(f"{'program':<12}" + "".join(f"{phase:>10}" for phase in phases)
+          + "".join(f"{name:>10}" for name in engines))
+    for filename, _ in tester_programs():
+        name = filename.rsplit(".", 1)[0]
+        result = suite_program(tester_program(name, **suite_scaling.get(name, {})),
+                               repeat)
+        results["programs"][name] = result
+        columns = [result["phases"][phase] for phase in phases]
+        columns += [engine.get("execute", engine) for engine in result["engines"].values()]
+        print(f"{name:<12}" + "".join(
+            f"{column['median'] * 1000:>10.2f}" if "median" in column else f"{'-':>10}"
+            for column in columns))
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {output}")
+    return results
+
+
+benchmarks = {
+    "lexer": lexer_benchmark,
+    "vm": vm_benchmark,
+    "arithmetic": arithmetic_benchmark,
+    "cache": cache_benchmark,
+    "bytecodefile": bytecodefile_benchmark,
+    "peephole": peephole_benchmark,
+    "superinstructions": superinstructions_benchmark,
+    "fold": fold_benchmark,
+    "for": for_benchmark,
+    "registers": registers_benchmark,
+    "tailcalls": tailcalls_benchmark,
+    "memo": memo_benchmark,
+    "hoisting": hoisting_benchmark,
+    "power": power_benchmark,
+    "profiler": profiler_benchmark,
+    "lists": lists_benchmark,
+    "packed": packed_benchmark,
+    "buffering": buffering_benchmark,
+    "views": views_benchmark,
+    "suite": suite_benchmark,
+}
+
+
+if __name__ == "__main__":
+    # python benchmark.py [name ...] [--json results.json], the JSON being
+    # the suite's
+    arguments = sys.argv[1:]
+    output = None
+    if "--json" in arguments:
+        i = arguments.index("--json")
+        output = arguments[i + 1]
+        del arguments[i:i + 2]
+    for name in arguments or benchmarks:
+        if name == "suite":
+            suite_benchmark(output=output)
+        else:
+            benchmarks[name]()
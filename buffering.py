@@ -0,0 +1,110 @@
+from typing import Set
+from eval import *
+from fold import subtrees, id_set
+
+
+# String buffering over a resolved AST (see resolver.resolve), run after
+# loop-invariant hoisting. Putting into a str makes a new str, and so does
+# adding to one, so a loop that builds a string a character at a time takes
+# time quadratic in its length. A variable such a loop builds holds a
+# StringBuffer while the loop runs instead:
+#
+#     s = buffer(s); loop; s = text(s)
+#
+# where buffer and text (u_string_operation) only change strs and
+# StringBuffers, so the variable may as well hold something else. A variable
+# is buffered when the loop puts into it or adds to it (s = s + x), doesn't
+# declare it, and only reads it through put, find, length, a slice or print,
+# which all take a StringBuffer as they would the str: nothing else ever
+# sees the buffer. Loops that call functions are left alone, as a function
+# could read the variable; a variable buffered by a loop isn't buffered
+# again by the loops inside it, and variables the program gives a number,
+# boolean, list or dict literal somewhere aren't buffered at all.
+
+
+def buffer_strings(program: AST) -> AST:
+    # buffers the strings the loops of program build, in place, and returns it
+    return do_buffer(program, not_strings(program))
+
+
+def not_strings(program: AST) -> Set[int]:
+    # the ids of the variables program gives a value that isn't a str
+    return {node.variable.id for node in subtrees(program)
+            if isinstance(node, declare | set) and isinstance(
+                node.value, numeric_literal | bool_literal | Lists | dict_literal
+                | list_initializer)}
+
+
+def do_buffer(program: AST, excluded: Set[int]) -> AST:
+    match program:
+        case block(exps):
+            program.exps = [do_buffer(e, excluded) for e in exps]
+        case if_statement(_, if_exp, else_exp):
+            program.if_exp = do_buffer(if_exp, excluded)
+            program.else_exp = do_buffer(else_exp, excluded)
+        case Function(_, _, body):
+            program.body = do_buffer(body, excluded)
+        case while_loop(_, body) | for_loop(_, _, _, _, body):
+            variables = built(program, excluded)
+            program.body = do_buffer(body, excluded | variables.keys())
+            if variables:
+                return block(
+                    [set(v, u_string_operation("buffer", get(v))) for v in variables.values()]
+                    + [program]
+                    + [set(v, u_string_operation("text", get(v))) for v in variables.values()])
+    return program
+
+
+def built(loop, excluded: Set[int]) -> dict:
+    # the variables, by id, that loop can build in a StringBuffer
+    if any(isinstance(node, FunctionCall) for node in subtrees(loop)):
+        return {}
+    variables = {}
+    for node in subtrees(loop):
+        match node:
+            case put(get(v), _, _):
+                variables[v.id] = v
+            case set(v, binary_operation("+", get(w), _)) if v.id == w.id:
+                variables[v.id] = v
+    ids = read(loop)
+    return {i: v for i, v in variables.items() if v.slot is not None
+            and i not in excluded and i not in ids}
+
+
+def read(program) -> Set[int]:
+    # the ids of the variables program declares, or reads other than through
+    # what a StringBuffer can do
+    ids = id_set()
+
+    def visit(e):
+        match e:
+            case list() | tuple():
+                for x in e:
+                    visit(x)
+            case get(v) | (identifier() as v):
+                ids.add(v.id)
+            case put(get(), key, value):
+                visit(key)
+                visit(value)
+            case find(get(), key):
+                visit(key)
+            case length(get()):
+                pass
+            case string_slice(get(), start, stop, hop):
+                visit([start, stop, hop])
+            case print_statement(exps):
+                visit([x for x in exps if not isinstance(x, get)])
+            case set(v, binary_operation("+", get(w), right)) if v.id == w.id:
+                visit(right)
+            case set(_, value):
+                visit(value)
+            case declare(v, value):
+                ids.add(v.id)
+                visit(value)
+            case _ if hasattr(e, "__dataclass_fields__"):
+                for name in e.__dataclass_fields__:
+                    visit(getattr(e, name))
+
+    visit(program)
+    return ids
+
@@ -0,0 +1,99 @@
+from eval import block, set, get, while_loop, u_string_operation, StringBuffer
+from fold import fold, subtrees
+from buffering import buffer_strings
+from testing import parse, run_all
+
+
+def buffered(program) -> list:
+    # the names of the variables the loops of program buffer
+    return [node.variable.name for node in subtrees(program)
+            if isinstance(node, set) and isinstance(node.value, u_string_operation)
+            and node.value.operator == "buffer"]
+
+
+def test1_buffering(capsys):
+    source = """{
+        var s = "";
+        var i = 0;
+        while (i < 20) {
+            s = s + "ab";
+            i = i + 1;
+        }
+        var t = s;
+        var c = "";
+        var m = 0;
+        var j = 0;
+        while (j < 20) {
+            s[j] = "x";
+            c = s[j + 1];
+            m = s.length;
+            j = j + 2;
+        }
+        var u = "";
+        for (k = 0; k < 3; k = k + 1) {
+            u = u + "q";
+            u[0] = "zz";
+            print u;
+        }
+        var same = s == t;
+        print s, t, c, m, same;
+    }"""
+    program = buffer_strings(fold(parse(source)))
+    assert buffered(program) == ["s", "s", "u"]
+    match program.exps[2]:
+        case block([set(v, u_string_operation("buffer", get(w))), while_loop(),
+                    set(x, u_string_operation("text", get(y)))]):
+            assert v.name == w.name == x.name == y.name == "s"
+        case other:
+            assert False, other
+    # t keeps the string s had before the second loop changed it
+    assert run_all(program, capsys).split() == [
+        "zz", "zzzq", "zzzzqq", "xbxbxbxbxbxbxbxbxbxbabababababababababab",
+        "abababababababababababababababababababab", "b", "40", "False"]
+
+
+def test2_notBuffered(capsys):
+    source = """{
+        def f(x) {
+            return x;
+        }
+        var s = "abc";
+        var i = 0;
+        while (i < 2) {
+            s[0] = "x";
+            var y = f(1);
+            i = i + 1;
+        }
+        var t = "abc";
+        var copies = [""];
+        var j = 0;
+        while (j < 2) {
+            t = t + "d";
+            copies.append(t);
+            j = j + 1;
+        }
+        var u = "abc";
+        var k = 0;
+        while (k < 2) {
+            var v = "x";
+            v = v + "y";
+            u[k] = "-";
+            var same = u == "-bc";
+            k = k + 1;
+        }
+        print s, t, copies, u;
+    }"""
+    # not s, as the loop calls a function, t, as the loop keeps it in a
+    # list, v, as the loop declares it, nor u, as the loop compares it
+    program = buffer_strings(fold(parse(source)))
+    assert buffered(program) == []
+    assert run_all(program, capsys).split() == [
+        "xbc", "abcdd", "['',", "'abcd',", "'abcdd']", "--c"]
+
+    # what the engines do with a StringBuffer: what they do with the string
+    buffer = StringBuffer("abc")
+    buffer[1] = "xy"
+    buffer = buffer + "d"
+    buffer[-1] = "e"
+    assert (str(buffer), buffer[0], buffer[1:3], len(buffer)) == (
+        "axyce" + "axycd", "a", "xy", 10)
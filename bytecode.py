@@ -1,7 +1,9 @@
-from dataclasses import dataclass
+import operator
+from dataclasses import dataclass, field
 from fractions import Fraction
-from typing import Union, MutableMapping, List, TypeVar, Optional
+from typing import Union, MutableMapping, List, TypeVar, Optional, Set
 from eval import *
+from fold import subtrees, assigned
 
 
 def ProgramNotSupported():
@@ -108,6 +110,22 @@ class I:
     class STORE:
         localID: int
 
+    @dataclass
+    class LOAD_LOCAL:
+        slot: int
+
+    @dataclass
+    class STORE_LOCAL:
+        slot: int
+
+    @dataclass
+    class LOAD_GLOBAL:
+        slot: int
+
+    @dataclass
+    class STORE_GLOBAL:
+        slot: int
+
     @dataclass
     class STRCAT:
         num_strings: int
@@ -116,6 +134,14 @@ class I:
     class STRSLICE:
         pass
 
+    @dataclass
+    class STRBUFFER:
+        pass
+
+    @dataclass
+    class STRTEXT:
+        pass
+
     @dataclass
     class HALT:
         pass
@@ -180,6 +206,10 @@ class I:
     class DICT_DELETE:
         pass
 
+    @dataclass
+    class DICT_CHECK:
+        pass
+
     @dataclass
     class PUT:
         pass
@@ -191,6 +221,9 @@ class I:
     @dataclass
     class PUSHFN:
         entry: Label
+        frame_size: int = 0
+        arity: int = 0
+        pure: bool = False
 
     @dataclass
     class CALL:
@@ -200,6 +233,50 @@ class I:
     class RETURN:
         pass
 
+    # Counted for loops: the bound is on top of the stack for the whole loop
+
+    @dataclass
+    class FOR_START:
+        # jump to label unless local slot < bound
+        slot: int
+        label: Label
+
+    @dataclass
+    class FOR_NEXT:
+        # add step to local slot, jump to label if it is still < bound
+        slot: int
+        step: int
+        label: Label
+
+    # Superinstructions, made by fuse() from the commonest sequences. op is
+    # the name of the binary instruction they stand for.
+
+    @dataclass
+    class INC_LOCAL:
+        # LOAD_LOCAL slot; PUSH amount; ADD; STORE_LOCAL slot
+        slot: int
+        amount: 'Value'
+
+    @dataclass
+    class CMP_JMP_IF_FALSE:
+        # op; JMP_IF_FALSE label, for a comparison op
+        op: str
+        label: Label
+
+    @dataclass
+    class BINOP_LOCALS:
+        # LOAD_LOCAL left; LOAD_LOCAL right; op
+        op: str
+        left: int
+        right: int
+
+    @dataclass
+    class BINOP_LOCAL_CONST:
+        # LOAD_LOCAL left; PUSH right; op
+        op: str
+        left: int
+        right: 'Value'
+
 
 Instruction = (
     I.PUSH
@@ -209,6 +286,7 @@ Instruction = (
     | I.DIV
     | I.QUOT
     | I.REM
+    | I.EXP
     | I.NOT
     | I.UMINUS
     | I.JMP
@@ -225,8 +303,14 @@ Instruction = (
     | I.GE
     | I.LOAD
     | I.STORE
+    | I.LOAD_LOCAL
+    | I.STORE_LOCAL
+    | I.LOAD_GLOBAL
+    | I.STORE_GLOBAL
     | I.STRCAT
     | I.STRSLICE
+    | I.STRBUFFER
+    | I.STRTEXT
     | I.PRINT
     | I.BUILD_LIST
     | I.LIST_HEAD
@@ -240,6 +324,7 @@ Instruction = (
     | I.DICT_VALUES
     | I.DICT_ITEMS
     | I.DICT_DELETE
+    | I.DICT_CHECK
     | I.PUT
     | I.LENGTH
     | I.FIND
@@ -247,6 +332,12 @@ Instruction = (
     | I.CALL
     | I.RETURN
     | I.PUSHFN
+    | I.FOR_START
+    | I.FOR_NEXT
+    | I.INC_LOCAL
+    | I.CMP_JMP_IF_FALSE
+    | I.BINOP_LOCALS
+    | I.BINOP_LOCAL_CONST
 
 )
 
@@ -254,9 +345,13 @@ Instruction = (
 @dataclass
 class ByteCode:
     insns: List[Instruction]
+    nlocals: int  # slots needed by the top level frame
+    entries: dict  # function id -> the Label of its code, for tail calls
 
     def __init__(self):
         self.insns = []
+        self.nlocals = 0
+        self.entries = {}
 
     def label(self):
         return Label(-1)
@@ -268,322 +363,795 @@ class ByteCode:
         label.target = len(self.insns)
 
 
-# class Frame:
-#     locals: List[Value]
-
-#     def __init__(self):
-#         MAX_LOCALS = 32
-#         self.locals = [None] * MAX_LOCALS
-
-#global environment
+#global environment, for identifiers the resolver hasn't given a slot
 global_environment: dict[int:'Value'] = {}
 
 
 @dataclass
 class Frame:
     retaddr: int = -1
+    locals: List[Value] = field(default_factory=list)
+    memo_key: Optional[tuple] = None  # to remember the result under
 
 
 @dataclass
 class beginFunction:
     entry: int
+    frame_size: int = 0
+    arity: int = 0
+    pure: bool = False  # see purity.mark_pure
+
+
+# Before running, the VM lowers the instruction objects into two parallel
+# lists: an integer opcode per instruction and its single operand (the value
+# to push, a slot or id, or a jump target already resolved to an index).
+
+opcodes = {kind: n for n, kind in enumerate(Instruction.__args__)}
+
+
+def quotient(left, right):
+    if left.denominator != 1 or right.denominator != 1:
+        raise ProgramNotSupported()
+    return int(left) // int(right)
+
+
+def remainder(left, right):
+    if left.denominator != 1 or right.denominator != 1:
+        raise ProgramNotSupported()
+    return int(left) % int(right)
+
+
+# what the binary instructions compute, for the superinstructions; the
+# results of ADD, SUB and MUL still have to go through number()
+binary_functions = {
+    "ADD": operator.add,
+    "SUB": operator.sub,
+    "MUL": operator.mul,
+    "DIV": divide,
+    "EXP": power,
+    "QUOT": quotient,
+    "REM": remainder,
+    "EQ": operator.eq,
+    "NEQ": operator.ne,
+    "LT": operator.lt,
+    "GT": operator.gt,
+    "LE": operator.le,
+    "GE": operator.ge,
+}
+comparisons = {"EQ", "NEQ", "LT", "GT", "LE", "GE"}
+
+
+def operand(insn: Instruction):
+    match insn:
+        case I.PUSH(what):
+            return what
+        case I.JMP(Label(target)) | I.JMP_IF_FALSE(Label(target)) | I.JMP_IF_TRUE(Label(target)):
+            return target
+        case I.LOAD(localID) | I.STORE(localID):
+            return localID
+        case I.LOAD_LOCAL(slot) | I.STORE_LOCAL(slot) | I.LOAD_GLOBAL(slot) | I.STORE_GLOBAL(slot):
+            return slot
+        case I.STRCAT(size):
+            return size
+        case I.INPUT(string):
+            return string
+        case I.PUSHFN(Label(offset), frame_size, arity, pure):
+            return beginFunction(offset, frame_size, arity, pure)
+        case I.FOR_START(slot, Label(target)):
+            return (slot, target)
+        case I.FOR_NEXT(slot, step, Label(target)):
+            return (slot, step, target)
+        case I.INC_LOCAL(slot, amount):
+            return (slot, amount)
+        case I.CMP_JMP_IF_FALSE(op, Label(target)):
+            return (binary_functions[op], target)
+        case I.BINOP_LOCALS(op, left, right) | I.BINOP_LOCAL_CONST(op, left, right):
+            return (binary_functions[op], left, right)
+    return None
+
+
+def lower(bytecode: ByteCode):
+    code = [opcodes[type(insn)] for insn in bytecode.insns]
+    operands = [operand(insn) for insn in bytecode.insns]
+    return code, operands
+
+
+# Handlers for every instruction that doesn't change the control flow. The
+# hot ones are also inlined in VM.execute; these are used for the rest and by
+# VM.execute_traced.
+
+def do_input(vm, string):
+    vm.data.append(input(string))
+
+
+def do_push(vm, val):
+    vm.data.append(val)
+
+
+def do_uminus(vm, _):
+    op = vm.data.pop()
+    vm.data.append(-op)
+
+
+def do_add(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    vm.data.append(number(left+right))
+
+
+def do_sub(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    vm.data.append(number(left-right))
+
+
+def do_mul(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    vm.data.append(number(left*right))
+
+
+def do_div(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    vm.data.append(divide(left, right))
+
+
+def do_exp(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    vm.data.append(power(left, right))
+
+
+def do_quot(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    if left.denominator != 1 or right.denominator != 1:
+        raise ProgramNotSupported()
+    vm.data.append(int(left) // int(right))
+
+
+def do_rem(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    if left.denominator != 1 or right.denominator != 1:
+        raise ProgramNotSupported()
+    vm.data.append(int(left) % int(right))
+
+
+def do_eq(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    vm.data.append(left == right)
+
+
+def do_neq(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    vm.data.append(left != right)
+
+
+def do_lt(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    vm.data.append(left < right)
+
+
+def do_gt(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    vm.data.append(left > right)
+
+
+def do_le(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    vm.data.append(left <= right)
+
+
+def do_ge(vm, _):
+    right = vm.data.pop()
+    left = vm.data.pop()
+    vm.data.append(left >= right)
+
+
+def do_not(vm, _):
+    op = vm.data.pop()
+    vm.data.append(not op)
+
+
+def do_dup(vm, _):
+    vm.data.append(vm.data[-1])
+
+
+def do_pop(vm, _):
+    vm.data.pop()
+
+
+def do_load_local(vm, slot):
+    vm.data.append(vm.currentFrame.locals[slot])
+
+
+def do_store_local(vm, slot):
+    vm.currentFrame.locals[slot] = vm.data.pop()
+
+
+def do_load_global(vm, slot):
+    vm.data.append(vm.frames[0].locals[slot])
+
+
+def do_store_global(vm, slot):
+    vm.frames[0].locals[slot] = vm.data.pop()
+
+
+def do_inc_local(vm, arg):
+    slot, amount = arg
+    locals = vm.currentFrame.locals
+    locals[slot] = number(locals[slot] + amount)
+
+
+def do_binop_locals(vm, arg):
+    function, left, right = arg
+    locals = vm.currentFrame.locals
+    vm.data.append(number(function(locals[left], locals[right])))
+
+
+def do_binop_local_const(vm, arg):
+    function, left, right = arg
+    vm.data.append(number(function(vm.currentFrame.locals[left], right)))
+
+
+def do_load(vm, localID):
+    if localID in global_environment:
+        vm.data.append(global_environment[localID])
+    else:
+        raise Exception("variable not found")
+
+
+def do_store(vm, localID):
+    global_environment[localID] = vm.data.pop()
+
+
+def do_print(vm, _):
+    print(vm.data.pop())
+
+
+def do_strcat(vm, size):
+    string = ""
+    for i in range(size):
+        string += vm.data.pop()
+    vm.data.append(string)
+
+
+def do_strslice(vm, _):
+    hop = int(vm.data.pop())
+    stop = int(vm.data.pop())
+    start = int(vm.data.pop())
+    string = vm.data.pop()
+    vm.data.append(string[start:stop:hop])
+
+
+def do_strbuffer(vm, _):
+    vm.data.append(buffered(vm.data.pop()))
+
+
+def do_strtext(vm, _):
+    vm.data.append(unbuffered(vm.data.pop()))
+
+
+def do_build_list(vm, _):
+    size = vm.data.pop()
+    our_list = []
+    for i in range(size):
+        our_list.append(vm.data.pop())
+    our_list = our_list[::-1]
+    vm.data.append(our_list)
+
+
+def do_init_list(vm, _):
+    val = vm.data.pop()
+    size = int(vm.data.pop())
+    vm.data.append(initial_list(size, val))
+
+
+def do_list_head(vm, _):
+    our_list = vm.data.pop()
+    if(len(our_list) == 0):
+        raise Exception("list is empty")
+    vm.data.append(our_list[0])
+
+
+def do_list_tail(vm, _):
+    our_list = vm.data.pop()
+    vm.data.append(list_tail(our_list))
+
+
+def do_list_empty(vm, _):
+    our_list = vm.data.pop()
+    vm.data.append(len(our_list) == 0)
+
+
+def do_list_cons(vm, _):
+    our_list = vm.data.pop()
+    val = vm.data.pop()
+    vm.data.append(list_cons(val, our_list))
+
+
+def do_list_append(vm, _):
+    our_list = vm.data.pop()
+    val = vm.data.pop()
+    our_list.append(val)
+    vm.data.append(our_list)
+
+
+def do_build_dict(vm, _):
+    size = vm.data.pop()
+    our_dict = {}
+    for i in range(size):
+        val = vm.data.pop()
+        key = vm.data.pop()
+        our_dict[key] = val
+    our_dict = Dictionary(reversed(our_dict.items()))
+    vm.data.append(our_dict)
+
+
+def do_dict_keys(vm, _):
+    our_dict = vm.data.pop()
+    vm.data.append(dict_view(our_dict, "keys"))
+
+
+def do_dict_values(vm, _):
+    our_dict = vm.data.pop()
+    vm.data.append(dict_view(our_dict, "values"))
+
+
+def do_dict_items(vm, _):
+    our_dict = vm.data.pop()
+    vm.data.append(dict_view(our_dict, "items"))
+
+
+def do_dict_delete(vm, _):
+    our_key = vm.data.pop()
+    our_dict = vm.data.pop()
+    if our_key in our_dict.keys():
+        del our_dict[our_key]
+        vm.data.append(our_dict)
+    else:
+        raise Exception("key not found")
+
+
+def do_dict_check(vm, _):
+    our_key = vm.data.pop()
+    our_dict = vm.data.pop()
+    vm.data.append(our_key in our_dict)
+
+
+def do_length(vm, _):
+    data_structure = vm.data.pop()
+    if isinstance(data_structure, list | ConsList | PackedList | DictView | StringBuffer | dict | str):
+        vm.data.append(len(data_structure))
+    else:
+        raise Exception("Invalid type for length")
+
+
+def do_find(vm, _):
+    data_structure = vm.data.pop()
+    if isinstance(data_structure, list | ConsList | PackedList | DictView | StringBuffer | str):
+        index = int(vm.data.pop())
+        if(index > len(data_structure)):
+            raise Exception("Index out of bounds")
+        vm.data.append(data_structure[index])
+    elif isinstance(data_structure, dict):
+        key = vm.data.pop()
+        vm.data.append(data_structure.get(key, -1))
+    else:
+        raise Exception("Invalid type for lookup")
+
+
+def do_put(vm, _):
+    data_structure = vm.data.pop()
+    if isinstance(data_structure, list | ConsList | PackedList | DictView | StringBuffer):
+        index = int(vm.data.pop())
+        if(index > len(data_structure)):
+            raise Exception("Index out of bounds")
+        data_structure[index] = vm.data.pop()
+        vm.data.append(data_structure)
+    elif isinstance(data_structure, dict):
+        key = vm.data.pop()
+        data_structure[key] = vm.data.pop()
+        vm.data.append(data_structure)
+    elif isinstance(data_structure, str):
+        index = int(vm.data.pop())
+        if(index > len(data_structure)):
+            raise Exception("Index out of bounds")
+        data_structure = data_structure[:index] + \
+            str(vm.data.pop()) + data_structure[index+1:]
+        vm.data.append(data_structure)
+    else:
+        raise Exception("Invalid type for lookup")
+
+
+handlers = [None] * len(opcodes)
+for kind, handler in {
+    I.INPUT: do_input,
+    I.PUSH: do_push,
+    I.PUSHFN: do_push,
+    I.UMINUS: do_uminus,
+    I.ADD: do_add,
+    I.SUB: do_sub,
+    I.MUL: do_mul,
+    I.DIV: do_div,
+    I.EXP: do_exp,
+    I.QUOT: do_quot,
+    I.REM: do_rem,
+    I.EQ: do_eq,
+    I.NEQ: do_neq,
+    I.LT: do_lt,
+    I.GT: do_gt,
+    I.LE: do_le,
+    I.GE: do_ge,
+    I.NOT: do_not,
+    I.DUP: do_dup,
+    I.POP: do_pop,
+    I.LOAD_LOCAL: do_load_local,
+    I.STORE_LOCAL: do_store_local,
+    I.LOAD_GLOBAL: do_load_global,
+    I.STORE_GLOBAL: do_store_global,
+    I.LOAD: do_load,
+    I.STORE: do_store,
+    I.PRINT: do_print,
+    I.STRCAT: do_strcat,
+    I.STRSLICE: do_strslice,
+    I.STRBUFFER: do_strbuffer,
+    I.STRTEXT: do_strtext,
+    I.BUILD_LIST: do_build_list,
+    I.INIT_LIST: do_init_list,
+    I.LIST_HEAD: do_list_head,
+    I.LIST_TAIL: do_list_tail,
+    I.LIST_EMPTY: do_list_empty,
+    I.LIST_CONS: do_list_cons,
+    I.LIST_APPEND: do_list_append,
+    I.BUILD_DICT: do_build_dict,
+    I.DICT_KEYS: do_dict_keys,
+    I.DICT_VALUES: do_dict_values,
+    I.DICT_ITEMS: do_dict_items,
+    I.DICT_DELETE: do_dict_delete,
+    I.DICT_CHECK: do_dict_check,
+    I.LENGTH: do_length,
+    I.FIND: do_find,
+    I.PUT: do_put,
+    I.INC_LOCAL: do_inc_local,
+    I.BINOP_LOCALS: do_binop_locals,
+    I.BINOP_LOCAL_CONST: do_binop_local_const,
+}.items():
+    handlers[opcodes[kind]] = handler
 
 
 class VM:
-    bytecode: ByteCode
+    bytecode: Optional[ByteCode]
+    code: List[int]
+    operands: List
+    nlocals: int
     ip: int
     data: List[Value]
+    frames: List[Frame]
     currentFrame: Frame
+    memo = None  # a purity.Memo, to remember the calls of pure functions
 
     def load(self, bytecode):
         self.bytecode = bytecode
+        code, operands = lower(bytecode)
+        self.load_lowered(code, operands, bytecode.nlocals)
+        self.bytecode = bytecode
+
+    def load_lowered(self, code, operands, nlocals):
+        # code and operands as made by lower, e.g. read from a file
+        self.bytecode = None
+        self.code = code
+        self.operands = operands
+        self.nlocals = nlocals
         self.restart()
 
     def restart(self):
         self.ip = 0
         self.data = []
-        self.currentFrame = Frame()
+        self.currentFrame = Frame(locals=[None] * self.nlocals)
+        self.frames = [self.currentFrame]
+
+    def call(self, bf: beginFunction):
+        key = None
+        if bf.pure and self.memo is not None:
+            arguments = self.data[len(self.data) - bf.arity:]
+            # the program has one beginFunction for each declaration
+            key = self.memo.key(bf, arguments)
+            value = self.memo.get(key)
+            if value is not self.memo.missing:
+                del self.data[len(self.data) - bf.arity:]
+                self.data.append(value)
+                self.ip += 1
+                return
+        self.currentFrame = Frame(
+            retaddr=self.ip + 1,
+            locals=[None] * bf.frame_size,
+            memo_key=key
+        )
+        self.frames.append(self.currentFrame)
+        self.ip = bf.entry
+
+    def ret(self):
+        frame = self.frames.pop()
+        if frame.memo_key is not None:
+            self.memo.put(frame.memo_key, self.data[-1])
+        self.ip = frame.retaddr
+        self.currentFrame = self.frames[-1]
 
     def execute(self) -> Value:
+        # the instructions are tested roughly in order of how often they run
+        # (see benchmark.py vm), everything else goes through the handlers
+        LOAD_LOCAL = opcodes[I.LOAD_LOCAL]
+        PUSH = opcodes[I.PUSH]
+        STORE_LOCAL = opcodes[I.STORE_LOCAL]
+        JMP_IF_FALSE = opcodes[I.JMP_IF_FALSE]
+        EQ = opcodes[I.EQ]
+        JMP = opcodes[I.JMP]
+        ADD = opcodes[I.ADD]
+        LT = opcodes[I.LT]
+        CALL = opcodes[I.CALL]
+        RETURN = opcodes[I.RETURN]
+        GT = opcodes[I.GT]
+        LOAD_GLOBAL = opcodes[I.LOAD_GLOBAL]
+        STORE_GLOBAL = opcodes[I.STORE_GLOBAL]
+        REM = opcodes[I.REM]
+        JMP_IF_TRUE = opcodes[I.JMP_IF_TRUE]
+        INC_LOCAL = opcodes[I.INC_LOCAL]
+        CMP_JMP_IF_FALSE = opcodes[I.CMP_JMP_IF_FALSE]
+        FOR_NEXT = opcodes[I.FOR_NEXT]
+        FOR_START = opcodes[I.FOR_START]
+        BINOP_LOCALS = opcodes[I.BINOP_LOCALS]
+        BINOP_LOCAL_CONST = opcodes[I.BINOP_LOCAL_CONST]
+        DUP = opcodes[I.DUP]
+        POP = opcodes[I.POP]
+        HALT = opcodes[I.HALT]
+
+        code = self.code
+        operands = self.operands
+        stack = self.data
+        push = stack.append
+        pop = stack.pop
+        frames = self.frames
+        local = self.currentFrame.locals
+        root = frames[0].locals
+        ip = self.ip
         while True:
-            assert self.ip < len(self.bytecode.insns)
-            match self.bytecode.insns[self.ip]:
-                case I.INPUT(string):
-                    self.data.append(input(string))
-                    self.ip += 1
-                case I.PUSH(val):
-                    self.data.append(val)
-                    self.ip += 1
-                case I.PUSHFN(Label(offset)):
-                    self.data.append(beginFunction(offset))
-                    self.ip += 1
-                case I.CALL():
-                    bf = self.data.pop()
-                    self.currentFrame = Frame(
-                        retaddr=self.ip + 1,
-                    )
-                    self.ip = bf.entry
-                case I.RETURN():
-                    self.ip = self.currentFrame.retaddr
-                case I.UMINUS():
-                    op = self.data.pop()
-                    self.data.append(-op)
-                    self.ip += 1
-                case I.ADD():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left+right)
-                    self.ip += 1
-                case I.SUB():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left-right)
-                    self.ip += 1
-                case I.MUL():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left*right)
-                    self.ip += 1
-                case I.DIV():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left/right)
-                    self.ip += 1
-                case I.EXP():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left**right)
-                    self.ip += 1
-                case I.QUOT():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    if left.denominator != 1 or right.denominator != 1:
-                        raise ProgramNotSupported()
-                    left, right = int(left), int(right)
-                    self.data.append(Fraction(left // right, 1))
-                    self.ip += 1
-                case I.REM():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    if left.denominator != 1 or right.denominator != 1:
-                        raise ProgramNotSupported()
-                    left, right = int(left), int(right)
-                    self.data.append(Fraction(left % right, 1))
-                    self.ip += 1
-                case I.EQ():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left == right)
-                    self.ip += 1
-                case I.NEQ():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left != right)
-                    self.ip += 1
-                case I.LT():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left < right)
-                    self.ip += 1
-                case I.GT():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left > right)
-                    self.ip += 1
-                case I.LE():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left <= right)
-                    self.ip += 1
-                case I.GE():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left >= right)
-                    self.ip += 1
-                case I.JMP(label):
-                    self.ip = label.target
-                case I.JMP_IF_FALSE(label):
-                    op = self.data.pop()
-                    if not op:
-                        self.ip = label.target
-                    else:
-                        self.ip += 1
-                case I.JMP_IF_TRUE(label):
-                    op = self.data.pop()
-                    if op:
-                        self.ip = label.target
-                    else:
-                        self.ip += 1
-                case I.NOT():
-                    op = self.data.pop()
-                    self.data.append(not op)
-                    self.ip += 1
-                case I.DUP():
-                    op = self.data.pop()
-                    self.data.append(op)
-                    self.data.append(op)
-                    self.ip += 1
-                case I.POP():
-                    self.data.pop()
-                    self.ip += 1
-                case I.LOAD(localID):
-                    # the data would be loaded from the current frame
-                    # if none then error
-                    # if(self.currentFrame.locals[localID] == None):
-                    #     raise Exception("variable not found")
-                    # self.data.append(self.currentFrame.locals[localID])
-                    if localID in global_environment.keys():
-                        self.data.append(global_environment[localID])
-                    else:
-                        raise Exception("variable not found")
-                    self.ip += 1
-                case I.STORE(localID):
-                    v = self.data.pop()
-                    global_environment[localID] = v
-                    #self.currentFrame.locals[localID] = v
-                    self.ip += 1
-                case I.PRINT():
-                    print(self.data.pop())
-                    self.ip += 1
-                case I.STRCAT(size):
-                    string = ""
-                    for i in range(size):
-                        string += self.data.pop()
-                    self.data.append(string)
-                    self.ip += 1
-
-                case I.STRSLICE():
-                    hop = int(self.data.pop())
-                    stop = int(self.data.pop())
-                    start = int(self.data.pop())
-                    string = self.data.pop()
-                    self.data.append(string[start:stop:hop])
-                    self.ip += 1
-
-                case I.BUILD_LIST():
-                    size = self.data.pop()
-                    our_list = []
-                    for i in range(size):
-                        our_list.append(self.data.pop())
-                    our_list = our_list[::-1]
-                    self.data.append(our_list)
-                    self.ip += 1
-                case I.INIT_LIST():
-                    val = self.data.pop()
-                    size = int(self.data.pop())
-                    our_list = []
-                    for i in range(size):
-                        our_list.append(val)
-                    self.data.append(our_list)
-                    self.ip += 1
-                case I.LIST_HEAD():
-                    our_list = self.data.pop()
-                    if(len(our_list) == 0):
-                        raise Exception("list is empty")
-                    self.data.append(our_list[0])
-                    self.ip += 1
-                case I.LIST_TAIL():
-                    our_list = self.data.pop()
-                    self.data.append(our_list[1:])
-                    self.ip += 1
-                case I.LIST_EMPTY():
-                    our_list = self.data.pop()
-                    self.data.append(len(our_list) == 0)
-                    self.ip += 1
-                case I.LIST_CONS():
-                    our_list = self.data.pop()
-                    val = self.data.pop()
-                    our_list.insert(0, val)
-                    self.data.append(our_list)
-                    self.ip += 1
-                case I.LIST_APPEND():
-                    our_list = self.data.pop()
-                    val = self.data.pop()
-                    our_list.append(val)
-                    self.data.append(our_list)
-                    self.ip += 1
-
-                case I.BUILD_DICT():
-                    size = self.data.pop()
-                    our_dict = {}
-                    for i in range(size):
-                        val = self.data.pop()
-                        key = self.data.pop()
-                        our_dict[key] = val
-                    our_dict = {k: v for k, v in reversed(our_dict.items())}
-                    self.data.append(our_dict)
-                    self.ip += 1
-                case I.DICT_KEYS():
-                    our_dict = self.data.pop()
-                    self.data.append(list(our_dict.keys()))
+            op = code[ip]
+            if op == LOAD_LOCAL:
+                push(local[operands[ip]])
+            elif op == PUSH:
+                push(operands[ip])
+            elif op == STORE_LOCAL:
+                local[operands[ip]] = pop()
+            elif op == JMP_IF_FALSE:
+                if not pop():
+                    ip = operands[ip]
+                    continue
+            elif op == FOR_NEXT:
+                slot, step, target = operands[ip]
+                value = local[slot] + step
+                local[slot] = value
+                if value < stack[-1]:
+                    ip = target
+                    continue
+            elif op == BINOP_LOCAL_CONST:
+                function, left, right = operands[ip]
+                value = function(local[left], right)
+                push(value if type(value) is not Fraction else number(value))
+            elif op == BINOP_LOCALS:
+                function, left, right = operands[ip]
+                value = function(local[left], local[right])
+                push(value if type(value) is not Fraction else number(value))
+            elif op == INC_LOCAL:
+                slot, amount = operands[ip]
+                value = local[slot] + amount
+                local[slot] = value if type(value) is int else number(value)
+            elif op == CMP_JMP_IF_FALSE:
+                function, target = operands[ip]
+                right = pop()
+                if not function(pop(), right):
+                    ip = target
+                    continue
+            elif op == EQ:
+                right = pop()
+                stack[-1] = stack[-1] == right
+            elif op == JMP:
+                ip = operands[ip]
+                continue
+            elif op == ADD:
+                right = pop()
+                value = stack[-1] + right
+                stack[-1] = value if type(value) is int else number(value)
+            elif op == LT:
+                right = pop()
+                stack[-1] = stack[-1] < right
+            elif op == CALL:
+                self.ip = ip
+                self.call(pop())
+                local = self.currentFrame.locals
+                ip = self.ip
+                continue
+            elif op == RETURN:
+                self.ret()
+                local = self.currentFrame.locals
+                ip = self.ip
+                continue
+            elif op == GT:
+                right = pop()
+                stack[-1] = stack[-1] > right
+            elif op == LOAD_GLOBAL:
+                push(root[operands[ip]])
+            elif op == STORE_GLOBAL:
+                root[operands[ip]] = pop()
+            elif op == REM:
+                right = pop()
+                left = pop()
+                if left.denominator != 1 or right.denominator != 1:
+                    raise ProgramNotSupported()
+                push(int(left) % int(right))
+            elif op == JMP_IF_TRUE:
+                if pop():
+                    ip = operands[ip]
+                    continue
+            elif op == FOR_START:
+                slot, target = operands[ip]
+                if not local[slot] < stack[-1]:
+                    ip = target
+                    continue
+            elif op == DUP:
+                push(stack[-1])
+            elif op == POP:
+                pop()
+            elif op == HALT:
+                self.ip = ip
+                if(len(stack) == 0):
+                    return None
+                return pop()
+            else:
+                handlers[op](self, operands[ip])
+            ip += 1
+
+    def execute_traced(self, counts, pairs=None) -> Value:
+        # same as execute, one instruction at a time through the handler
+        # table, counting how many times each opcode runs and, given pairs,
+        # how many times each (opcode, next opcode) pair runs
+        jumps = {opcodes[I.JMP], opcodes[I.JMP_IF_FALSE],
+                 opcodes[I.JMP_IF_TRUE]}
+        CALL = opcodes[I.CALL]
+        RETURN = opcodes[I.RETURN]
+        HALT = opcodes[I.HALT]
+        CMP_JMP_IF_FALSE = opcodes[I.CMP_JMP_IF_FALSE]
+        FOR_START = opcodes[I.FOR_START]
+        FOR_NEXT = opcodes[I.FOR_NEXT]
+        previous = None
+        while True:
+            op = self.code[self.ip]
+            counts[op] += 1
+            if pairs is not None:
+                pairs[previous, op] += 1
+                previous = op
+            arg = self.operands[self.ip]
+            if op in jumps:
+                if op == opcodes[I.JMP] or (
+                        bool(self.data.pop()) == (op == opcodes[I.JMP_IF_TRUE])):
+                    self.ip = arg
+                else:
                     self.ip += 1
-                case I.DICT_VALUES():
-                    our_dict = self.data.pop()
-                    self.data.append(list(our_dict.values()))
+            elif op == CMP_JMP_IF_FALSE:
+                function, target = arg
+                right = self.data.pop()
+                if function(self.data.pop(), right):
                     self.ip += 1
-                case I.DICT_ITEMS():
-                    our_dict = self.data.pop()
-                    self.data.append(list(our_dict.items()))
+                else:
+                    self.ip = target
+            elif op == FOR_START:
+                slot, target = arg
+                if self.currentFrame.locals[slot] < self.data[-1]:
                     self.ip += 1
-                case I.DICT_DELETE():
-                    our_key = self.data.pop()
-                    our_dict = self.data.pop()
-                    if our_key in our_dict.keys():
-                        del our_dict[our_key]
-                        self.data.append(our_dict)
-                    else:
-                        raise Exception("key not found")
+                else:
+                    self.ip = target
+            elif op == FOR_NEXT:
+                slot, step, target = arg
+                locals = self.currentFrame.locals
+                locals[slot] += step
+                if locals[slot] < self.data[-1]:
+                    self.ip = target
+                else:
                     self.ip += 1
+            elif op == CALL:
+                self.call(self.data.pop())
+            elif op == RETURN:
+                self.ret()
+            elif op == HALT:
+                if(len(self.data) == 0):
+                    return None
+                return self.data.pop()
+            else:
+                handlers[op](self, arg)
+                self.ip += 1
+
+
+def emit_load(code: ByteCode, i, level: int) -> None:
+    # variables of the function being generated live in the current frame,
+    # top level variables in the root frame; nested functions don't capture
+    # their enclosing function's locals
+    if i.slot is None:
+        code.emit(I.LOAD(i.id))
+    elif i.level == level:
+        code.emit(I.LOAD_LOCAL(i.slot))
+    elif i.level == 0:
+        code.emit(I.LOAD_GLOBAL(i.slot))
+    else:
+        ProgramNotSupported()
+    if i.slot is not None and i.level == 0:
+        code.nlocals = max(code.nlocals, i.slot + 1)
+
+
+def emit_store(code: ByteCode, i, level: int) -> None:
+    if i.slot is None:
+        code.emit(I.STORE(i.id))
+    elif i.level == level:
+        code.emit(I.STORE_LOCAL(i.slot))
+    elif i.level == 0:
+        code.emit(I.STORE_GLOBAL(i.slot))
+    else:
+        ProgramNotSupported()
+    if i.slot is not None and i.level == 0:
+        code.nlocals = max(code.nlocals, i.slot + 1)
+
+
+def counted(loop: for_loop) -> bool:
+    # whether loop is for(i = a; i < b; i = i + c) with an integer c, i not
+    # assigned in the body, and b the same every time round: made of
+    # literals and variables the loop can't change
+    match loop:
+        case for_loop(i, _, binary_operation("<", get(j), bound),
+                      set(k, binary_operation("+", get(l), numeric_literal(step))), body):
+            if not (i.id == j.id == k.id == l.id and i.slot is not None
+                    and type(step) is int):
+                return False
+        case _:
+            return False
+    changed = assigned(body)
+    if i.id in changed:
+        return False
+    calls = any(isinstance(node, FunctionCall) for node in subtrees(body))
+    for node in subtrees(bound):
+        match node:
+            case get(v) | (identifier() as v):
+                # globals can also be changed by the functions the body calls
+                if v.id in changed or v.slot is None or (v.level == 0 and calls):
+                    return False
+            case binary_operation(op) if op in ("+", "-", "*", "/", "^", "%", "//"):
+                pass
+            case unary_operation("-") | numeric_literal() | NumType():
+                pass
+            case _:
+                return False
+    return True
 
-                case I.LENGTH():
-                    data_structure = self.data.pop()
-                    if isinstance(data_structure, list | dict | str):
-                        self.data.append(len(data_structure))
-                    else:
-                        raise Exception("Invalid type for length")
-                    self.ip += 1
-                case I.FIND():
-                    data_structure = self.data.pop()
-                    if isinstance(data_structure, list | str):
-                        index = int(self.data.pop())
-                        if(index > len(data_structure)):
-                            raise Exception("Index out of bounds")
-                        self.data.append(data_structure[index])
-                    elif isinstance(data_structure, dict):
-                        key = self.data.pop()
-                        # if key not in data_structure.keys():
-                        #     raise Exception("Key not found")
-                        self.data.append(data_structure.get(key, -1))
-                    else:
-                        raise Exception("Invalid type for lookup")
-                    self.ip += 1
-                case I.PUT():
-                    data_structure = self.data.pop()
-                    if isinstance(data_structure, list):
-                        index = int(self.data.pop())
-                        if(index > len(data_structure)):
-                            raise Exception("Index out of bounds")
-                        data_structure[index] = self.data.pop()
-                        self.data.append(data_structure)
-                    elif isinstance(data_structure, dict):
-                        key = self.data.pop()
-                        data_structure[key] = self.data.pop()
-                        self.data.append(data_structure)
-                    elif isinstance(data_structure, str):
-                        index = int(self.data.pop())
-                        if(index > len(data_structure)):
-                            raise Exception("Index out of bounds")
-                        data_structure = data_structure[:index] + \
-                            self.data.pop() + data_structure[index+1:]
-                        self.data.append(data_structure)
-                    else:
-                        raise Exception("Invalid type for lookup")
-                    self.ip += 1
 
-                case I.HALT():
-                    if(len(self.data) == 0):
-                        return None
-                    return self.data.pop()
+def leaves_value(program: AST) -> bool:
+    # whether the code generated for program leaves a value on the stack
+    match program:
+        case declare() | set() | print_statement() | while_loop() | for_loop() | Function() | block() | Null():
+            return False
+        case TailCall():
+            return False
+        case if_statement(_, iftrue, _):
+            return leaves_value(iftrue)
+        case put(x, _, _):
+            return not isinstance(x, get)
+        case b_dict_operation("delete", _, _):
+            return False
+    return True
 
 
 def codegen(program: AST) -> ByteCode:
@@ -595,10 +1163,11 @@ def codegen(program: AST) -> ByteCode:
 
 def do_codegen(
         program: AST,
-        code: ByteCode
+        code: ByteCode,
+        level: int = 0
 ) -> None:
     def codegen_(program):
-        do_codegen(program, code)
+        do_codegen(program, code, level)
 
     simple_ops = {
         "+": I.ADD(),
@@ -635,7 +1204,7 @@ def do_codegen(
             code.emit(I.BUILD_DICT())
         case update_string(e, what):
             code.emit(I.PUSH(what))
-            code.emit(I.STORE(e.variable.name))
+            emit_store(code, e.variable, level)
         # case UnitLiteral():
         #     code.emit(I.PUSH(None))
         case binary_operation(op, left, right) if op in simple_ops:
@@ -667,6 +1236,9 @@ def do_codegen(
         case block(things):
             for thing in things:
                 codegen_(thing)
+                if leaves_value(thing):
+                    # an expression used as a statement
+                    code.emit(I.POP())
         case if_statement(cond, iftrue, iffalse):
             E = code.label()
             F = code.label()
@@ -686,6 +1258,31 @@ def do_codegen(
             codegen_(body)
             code.emit(I.JMP(B))
             code.emit_label(E)
+        case for_loop(iterator, initial_value, cond, updation, body) if counted(program):
+            # the bound is computed once and stays on the stack
+            B = code.label()
+            E = code.label()
+            codegen_(initial_value)
+            emit_store(code, iterator, level)
+            codegen_(cond.right)
+            code.emit(I.FOR_START(iterator.slot, E))
+            code.emit_label(B)
+            codegen_(body)
+            code.emit(I.FOR_NEXT(iterator.slot, updation.value.right.value, B))
+            code.emit_label(E)
+            code.emit(I.POP())
+        case for_loop(iterator, initial_value, cond, updation, body):
+            B = code.label()
+            E = code.label()
+            codegen_(initial_value)
+            emit_store(code, iterator, level)
+            code.emit_label(B)
+            codegen_(cond)
+            code.emit(I.JMP_IF_FALSE(E))
+            codegen_(body)
+            codegen_(updation)
+            code.emit(I.JMP(B))
+            code.emit_label(E)
         case string_concat(string_list):
             for i in range(len(string_list) - 1, -1, -1):
                 codegen_(string_list[i])
@@ -696,6 +1293,12 @@ def do_codegen(
             codegen_(stop)
             codegen_(hop)
             code.emit(I.STRSLICE())
+        case u_string_operation("buffer", string):
+            codegen_(string)
+            code.emit(I.STRBUFFER())
+        case u_string_operation("text", string):
+            codegen_(string)
+            code.emit(I.STRTEXT())
 
         # case identifier(name) as i:
         #     code.emit(I.LOAD(i.id))
@@ -709,15 +1312,15 @@ def do_codegen(
         #     codegen_(e2)
 
         case get(identifier as i):
-            code.emit(I.LOAD(i.id))
+            emit_load(code, i, level)
 
         case set(identifier as i, e):
             codegen_(e)
-            code.emit(I.STORE(i.id))
+            emit_store(code, i, level)
 
         case declare(identifier as i, e):
             codegen_(e)
-            code.emit(I.STORE(i.id))
+            emit_store(code, i, level)
 
         case print_statement() as i:
             for exp in i.exps:
@@ -745,25 +1348,36 @@ def do_codegen(
             codegen_(e)
             codegen_(l)
             code.emit(I.LIST_CONS())
+            match l:
+                case get(v):
+                    # the variable holding the list now holds the longer one
+                    code.emit(I.DUP())
+                    emit_store(code, v, level)
         case b_list_operation("append", e, l):
             codegen_(e)
             codegen_(l)
             code.emit(I.LIST_APPEND())
 
         case u_dict_operation("keys", dict):
-            codegen_(get(dict))
+            codegen_(dict if isinstance(dict, get) else get(dict))
             code.emit(I.DICT_KEYS())
         case u_dict_operation("values", dict):
-            codegen_(get(dict))
+            codegen_(dict if isinstance(dict, get) else get(dict))
             code.emit(I.DICT_VALUES())
         case u_dict_operation("items", dict):
-            codegen_(get(dict))
+            codegen_(dict if isinstance(dict, get) else get(dict))
             code.emit(I.DICT_ITEMS())
         case b_dict_operation("delete", dict, key):
-            codegen_(get(dict))
+            if not isinstance(dict, get):
+                dict = get(dict)
+            codegen_(dict)
             codegen_(key)
             code.emit(I.DICT_DELETE())
-            code.emit(I.STORE(dict.id))
+            emit_store(code, dict.variable, level)
+        case b_dict_operation("check", dict, key):
+            codegen_(dict if isinstance(dict, get) else get(dict))
+            codegen_(key)
+            code.emit(I.DICT_CHECK())
 
         case length(x):
             codegen_(x)
@@ -778,7 +1392,7 @@ def do_codegen(
             codegen_(x)
             code.emit(I.PUT())
             if(isinstance(x, get)):
-               code.emit(I.STORE(x.variable.id))
+                emit_store(code, x.variable, level)
             ## This does not make sense as we only execute our AST once, so
             ## we won't have the value of x in the global environment
             # if(isinstance(x, get) and isinstance(global_environment[x.variable.id], str)):
@@ -795,29 +1409,312 @@ def do_codegen(
         #     codegen_(e2)
         # case TypeAssertion(expr, _):
         #     codegen_(expr)
-        case Function(fv, parameters, body, return_exp):
+        case Function(fv, parameters, body, return_exp, _, frame_size):
             codebegin = code.label()
             fnbegin = code.label()
+            code.entries[fv.id] = fnbegin
             code.emit(I.JMP(codebegin))
             code.emit_label(fnbegin)
             for param in reversed(parameters):
-                code.emit(I.STORE(param.id))
-            codegen_(body)
-            codegen_(return_exp)
+                emit_store(code, param, level + 1)
+            do_codegen(body, code, level + 1)
+            do_codegen(return_exp, code, level + 1)
             code.emit(I.RETURN())
             code.emit_label(codebegin)
-            code.emit(I.PUSHFN(fnbegin))
-            code.emit(I.STORE(fv.id))
+            code.emit(I.PUSHFN(fnbegin, frame_size, len(parameters), program.pure))
+            emit_store(code, fv, level)
 
         case FunctionCall(fn, args):
             for arg in args:
                 codegen_(arg)
-            code.emit(I.LOAD(fn.id))
+            emit_load(code, fn, level)
             code.emit(I.CALL())
+        case TailCall(FunctionCall(fn, args)):
+            # the arguments are left where a call leaves them, so jumping to
+            # the function's code stores them in the frame already there
+            for arg in args:
+                codegen_(arg)
+            code.emit(I.JMP(code.entries[fn.id]))
+
+
+def compile(program, optimize=True):
+    code = codegen(program)
+    if optimize:
+        code = fuse(peephole(code))
+    return code
 
 
-def compile(program):
-    return codegen(program)
+# Peephole optimizer. Works on a copy of the instructions in which every
+# jump has a Label of its own, deleting instructions by setting them to None
+# and then compacting, until none of the rewrites applies any more.
+
+def label_of(insn) -> Optional[Label]:
+    match insn:
+        case I.JMP(label) | I.JMP_IF_FALSE(label) | I.JMP_IF_TRUE(label):
+            return label
+        case I.CMP_JMP_IF_FALSE(_, label) | I.FOR_START(_, label) | I.FOR_NEXT(_, _, label):
+            return label
+        case I.PUSHFN(label, _):
+            return label
+    return None
+
+
+def with_label(insn, target: int):
+    match insn:
+        case I.JMP() | I.JMP_IF_FALSE() | I.JMP_IF_TRUE():
+            return type(insn)(Label(target))
+        case I.CMP_JMP_IF_FALSE(op, _):
+            return I.CMP_JMP_IF_FALSE(op, Label(target))
+        case I.FOR_START(slot, _):
+            return I.FOR_START(slot, Label(target))
+        case I.FOR_NEXT(slot, step, _):
+            return I.FOR_NEXT(slot, step, Label(target))
+        case I.PUSHFN(_, frame_size, arity, pure):
+            return I.PUSHFN(Label(target), frame_size, arity, pure)
+    return insn
+
+
+def jump_targets(insns) -> Set[int]:
+    return {label_of(insn).target for insn in insns if label_of(insn) is not None}
+
+
+def compact(insns):
+    # drops the deleted instructions; a jump to one goes to the next one kept
+    new_index = []
+    kept = 0
+    for insn in insns:
+        new_index.append(kept)
+        if insn is not None:
+            kept += 1
+    new_index.append(kept)
+    out = [insn for insn in insns if insn is not None]
+    for insn in out:
+        label = label_of(insn)
+        if label is not None:
+            label.target = new_index[label.target]
+    return out
+
+
+def thread_jumps(insns) -> bool:
+    changed = False
+    targets = jump_targets(insns)
+    for i, insn in enumerate(insns):
+        label = label_of(insn)
+        if label is None or isinstance(insn, I.PUSHFN):
+            continue
+        # follow chains of unconditional jumps
+        seen = {i}
+        target = label.target
+        while isinstance(insns[target], I.JMP) and target not in seen:
+            seen.add(target)
+            target = insns[target].label.target
+        if target != label.target:
+            label.target = target
+            changed = True
+        if isinstance(insn, I.JMP) and isinstance(insns[target], I.RETURN | I.HALT):
+            insns[i] = type(insns[target])()
+            changed = True
+        elif isinstance(insn, I.JMP) and target == i + 1:
+            insns[i] = None
+            changed = True
+        elif (i >= 1 and isinstance(insns[i - 1], I.DUP) and i - 1 not in targets
+              and i + 1 < len(insns) and isinstance(insns[i + 1], I.POP)
+              and i not in targets and i + 1 not in targets
+              and isinstance(insn, I.JMP_IF_FALSE | I.JMP_IF_TRUE)):
+            # and/or feeding a branch: DUP; JMP_IF_x E; POP ... E: JMP_IF_y F
+            # the value at E is known, so go where the second branch would
+            then = insns[target]
+            if isinstance(then, I.JMP_IF_FALSE | I.JMP_IF_TRUE):
+                if type(then) == type(insn):
+                    jump = type(insn)(Label(then.label.target))
+                else:
+                    jump = type(insn)(Label(target + 1))
+                insns[i - 1] = None
+                insns[i] = jump
+                insns[i + 1] = None
+                changed = True
+    return changed
+
+
+def fold_branches(insns) -> bool:
+    changed = False
+    targets = jump_targets(insns)
+    for i in range(len(insns) - 1):
+        first, second = insns[i], insns[i + 1]
+        if i + 1 in targets or first is None or second is None:
+            continue
+        if isinstance(first, I.PUSH) and isinstance(second, I.JMP_IF_FALSE | I.JMP_IF_TRUE):
+            # a branch on a constant is either always or never taken
+            if bool(first.what) == isinstance(second, I.JMP_IF_TRUE):
+                insns[i] = I.JMP(second.label)
+            else:
+                insns[i] = None
+            insns[i + 1] = None
+            changed = True
+        elif isinstance(first, I.NOT) and isinstance(second, I.JMP_IF_FALSE | I.JMP_IF_TRUE):
+            flipped = I.JMP_IF_TRUE if isinstance(
+                second, I.JMP_IF_FALSE) else I.JMP_IF_FALSE
+            insns[i] = flipped(second.label)
+            insns[i + 1] = None
+            changed = True
+    return changed
+
+
+def remove_unreachable(insns) -> bool:
+    # everything not reachable from the start or a function entry
+    reachable = [False] * len(insns)
+    work = [0] + [insn.entry.target for insn in insns
+                  if isinstance(insn, I.PUSHFN)]
+    while work:
+        i = work.pop()
+        if i >= len(insns) or reachable[i]:
+            continue
+        reachable[i] = True
+        match insns[i]:
+            case I.JMP(label):
+                work.append(label.target)
+            case I.JMP_IF_FALSE(label) | I.JMP_IF_TRUE(label) | I.CMP_JMP_IF_FALSE(_, label):
+                work.append(label.target)
+                work.append(i + 1)
+            case I.FOR_START(_, label) | I.FOR_NEXT(_, _, label):
+                work.append(label.target)
+                work.append(i + 1)
+            case I.RETURN() | I.HALT():
+                pass
+            case _:
+                work.append(i + 1)
+    changed = False
+    for i, insn in enumerate(insns):
+        if not reachable[i]:
+            insns[i] = None
+            changed = True
+    return changed
+
+
+def cancel_push_pop(insns) -> bool:
+    changed = False
+    targets = jump_targets(insns)
+    pushes = I.PUSH | I.PUSHFN | I.DUP | I.LOAD_LOCAL | I.LOAD_GLOBAL
+    for i in range(len(insns) - 1):
+        if (isinstance(insns[i], pushes) and isinstance(insns[i + 1], I.POP)
+                and i + 1 not in targets):
+            insns[i] = insns[i + 1] = None
+            changed = True
+    return changed
+
+
+def same_variable(load, store) -> bool:
+    match load, store:
+        case (I.LOAD_LOCAL(a), I.STORE_LOCAL(b)) | (I.LOAD_GLOBAL(a), I.STORE_GLOBAL(b)) | (I.LOAD(a), I.STORE(b)):
+            return a == b
+    return False
+
+
+def remove_redundant_stores(insns) -> bool:
+    changed = False
+    targets = jump_targets(insns)
+    for i in range(len(insns) - 1):
+        first, second = insns[i], insns[i + 1]
+        if i + 1 in targets or first is None or second is None:
+            continue
+        if same_variable(first, second) and not isinstance(first, I.LOAD):
+            # x = x
+            insns[i] = insns[i + 1] = None
+            changed = True
+        elif same_variable(second, first):
+            # storing x and reading it straight back
+            insns[i] = I.DUP()
+            insns[i + 1] = first
+            changed = True
+        elif (isinstance(first, I.DUP) and i + 2 < len(insns)
+              and isinstance(second, I.STORE_LOCAL | I.STORE_GLOBAL | I.STORE)
+              and isinstance(insns[i + 2], I.POP) and i + 2 not in targets):
+            insns[i] = insns[i + 2] = None
+            changed = True
+    return changed
+
+
+def copy_insns(code: ByteCode):
+    return [with_label(insn, label_of(insn).target) if label_of(insn) is not None
+            else insn for insn in code.insns]
+
+
+def peephole(code: ByteCode) -> ByteCode:
+    insns = copy_insns(code)
+    passes = [thread_jumps, fold_branches, remove_unreachable,
+              cancel_push_pop, remove_redundant_stores]
+    changed = True
+    while changed:
+        changed = False
+        for optimization in passes:
+            if optimization(insns):
+                changed = True
+            insns = compact(insns)
+    optimized = ByteCode()
+    optimized.insns = insns
+    optimized.nlocals = code.nlocals
+    return optimized
+
+
+# Superinstructions. The sequences fused are the commonest pairs and runs in
+# loops (see benchmark.py superinstructions), each now one dispatch:
+#
+#   LOAD_LOCAL n; PUSH c; ADD; STORE_LOCAL n   INC_LOCAL n c
+#   LOAD_LOCAL a; LOAD_LOCAL b; op             BINOP_LOCALS op a b
+#   LOAD_LOCAL a; PUSH c; op                   BINOP_LOCAL_CONST op a c
+#   comparison; JMP_IF_FALSE L                 CMP_JMP_IF_FALSE comparison L
+#
+# None of the instructions folded into another may be a jump target.
+
+def binary_name(insn) -> Optional[str]:
+    name = type(insn).__name__
+    return name if name in binary_functions else None
+
+
+def is_number(value) -> bool:
+    return isinstance(value, int | Fraction) and not isinstance(value, bool)
+
+
+def fuse(code: ByteCode) -> ByteCode:
+    insns = copy_insns(code)
+    targets = jump_targets(insns)
+
+    def run(i, n):
+        # the n instructions from i, if control can only enter at the first
+        if i + n > len(insns) or any(j in targets for j in range(i + 1, i + n)):
+            return None
+        return insns[i:i + n]
+
+    i = 0
+    while i < len(insns):
+        match run(i, 4):
+            case [I.LOAD_LOCAL(slot), I.PUSH(amount), I.ADD(), I.STORE_LOCAL(stored)] \
+                    if slot == stored and is_number(amount):
+                insns[i:i + 4] = [I.INC_LOCAL(slot, amount), None, None, None]
+                i += 4
+                continue
+        match run(i, 3):
+            case [I.LOAD_LOCAL(left), I.LOAD_LOCAL(right), binary] if binary_name(binary):
+                insns[i:i + 3] = [
+                    I.BINOP_LOCALS(binary_name(binary), left, right), None, None]
+                i += 3
+                continue
+            case [I.LOAD_LOCAL(left), I.PUSH(right), binary] if binary_name(binary):
+                insns[i:i + 3] = [
+                    I.BINOP_LOCAL_CONST(binary_name(binary), left, right), None, None]
+                i += 3
+                continue
+        match run(i, 2):
+            case [compare, I.JMP_IF_FALSE(label)] if binary_name(compare) in comparisons:
+                insns[i:i + 2] = [
+                    I.CMP_JMP_IF_FALSE(binary_name(compare), label), None]
+                i += 2
+                continue
+        i += 1
+    fused = ByteCode()
+    fused.insns = compact(insns)
+    fused.nlocals = code.nlocals
+    return fused
 
 
 def print_bytecode(code: ByteCode):
@@ -827,9 +1724,22 @@ def print_bytecode(code: ByteCode):
                 print(f"{i:=4} {op.__class__.__name__:<15} {offset}")
             case I.LOAD(localID) | I.STORE(localID):
                 print(f"{i:=4} {op.__class__.__name__:<15} {localID}")
+            case I.LOAD_LOCAL(slot) | I.STORE_LOCAL(slot) | I.LOAD_GLOBAL(slot) | I.STORE_GLOBAL(slot):
+                print(f"{i:=4} {op.__class__.__name__:<15} {slot}")
             case I.PUSH(value):
                 print(f"{i:=4} {'PUSH':<15} {value}")
-            case I.PUSHFN(Label(offset)):
-                print(f"{i:=4} {'PUSHFN':<15} {offset}")
+            case I.PUSHFN(Label(offset), frame_size, _, pure):
+                print(f"{i:=4} {'PUSHFN':<15} {offset} ({frame_size} locals)"
+                      + (" pure" if pure else ""))
+            case I.INC_LOCAL(slot, amount):
+                print(f"{i:=4} {'INC_LOCAL':<15} {slot} {amount}")
+            case I.FOR_START(slot, Label(offset)):
+                print(f"{i:=4} {'FOR_START':<15} {slot} {offset}")
+            case I.FOR_NEXT(slot, step, Label(offset)):
+                print(f"{i:=4} {'FOR_NEXT':<15} {slot} {step} {offset}")
+            case I.CMP_JMP_IF_FALSE(name, Label(offset)):
+                print(f"{i:=4} {'CMP_JMP_IF_FALSE':<15} {name} {offset}")
+            case I.BINOP_LOCALS(name, left, right) | I.BINOP_LOCAL_CONST(name, left, right):
+                print(f"{i:=4} {op.__class__.__name__:<15} {name} {left} {right}")
             case _:
                 print(f"{i:=4} {op.__class__.__name__:<15}")
@@ -1,6 +1,9 @@
 from bytecode import *
 from eval import *
 from resolver import *
+from lexer import bufferedLexer, Stream
+from Parser import Parser
+from collections import Counter
 
 
 def test():
@@ -428,6 +431,205 @@ def test8_dictOps():
     v.load(compile(e4))
     assert (v.execute() == {"z": 0, "y": 25})
 
+
+def compile_source(source, optimize=True):
+    tokens = bufferedLexer.lexerFromStream(Stream.streamFromString(source))
+    return compile(resolve(Parser.parse_expr(Parser.call_parser(tokens))), optimize)
+
+
+def test9_callFrames(capsys):
+    # every call gets its own frame, so locals survive recursive calls
+    v = VM()
+    v.load(compile_source("""{
+        def fib(n){
+            var ans = n;
+            if (n > 1) {
+                var a = fib(n - 1);
+                var b = fib(n - 2);
+                ans = a + b;
+            }
+            return ans;
+        }
+        print fib(15);
+    }"""))
+    v.execute()
+    assert capsys.readouterr().out == "610\n"
+    assert len(v.frames) == 1
+
+    # top level variables are reachable from inside functions
+    v.load(compile_source("""{
+        var total = 0;
+        def add(x){
+            total = total + x;
+            return total;
+        }
+        var a = add(4);
+        var b = add(5);
+        print total;
+    }"""))
+    v.execute()
+    assert capsys.readouterr().out == "9\n"
+
+
+def test10_tracedExecution():
+    # the traced loop runs the same program the same way, and counts it
+    code = compile_source("""{
+        var i = 0;
+        var total = 0;
+        while (i < 10) {
+            total = total + i;
+            i = i + 1;
+        }
+        var s = "done";
+    }""")
+    v = VM()
+    v.load(code)
+    assert v.execute() is None
+    fast = list(v.frames[0].locals)
+    counts = Counter()
+    v.restart()
+    assert v.execute_traced(counts) is None
+    assert v.frames[0].locals == fast == [10, 45, "done"]
+    assert counts[opcodes[I.JMP]] == 10
+    assert counts[opcodes[I.HALT]] == 1
+
+def test11_bytecodeFile(tmp_path, capsys):
+    import bytecodefile
+    code = compile_source("""{
+        def half(n){
+            return n / 2;
+        }
+        var s = "a";
+        var big = 123456789012345678901234567890;
+        print half(3), half(-8), s, big, 1 == 1, 2 / 3;
+    }""")
+    filename = str(tmp_path / ("program" + bytecodefile.extension))
+    bytecodefile.write(code, filename)
+    v = VM()
+    v.load_lowered(*bytecodefile.read(filename))
+    v.execute()
+    v.load(code)
+    v.execute()
+    out = capsys.readouterr().out.split()
+    assert out[:6] == out[6:] == ["3/2", "-4", "a",
+                                  "123456789012345678901234567890", "True", "2/3"]
+
+    # a damaged file is refused rather than run
+    with open(filename, "rb") as f:
+        data = bytearray(f.read())
+    data[-1] ^= 1
+    try:
+        bytecodefile.loads(bytes(data))
+        assert False
+    except bytecodefile.BadBytecodeFile:
+        pass
+
+def test12_peephole(capsys):
+    source = """{
+        var x = 0;
+        var y = 0;
+        var i = 0;
+        while (i < 10 and i != 7) {
+            x = x;
+            if (True) { y = y + i; }
+            if (i > 2 or i == 1) { x = x + 1; }
+            i = i + 1;
+        }
+        print x, y;
+    }"""
+    plain = compile_source(source, optimize=False)
+    code = peephole(plain)
+    for program in (plain, code):
+        v = VM()
+        v.load(program)
+        v.execute()
+        assert capsys.readouterr().out == "5\n21\n"
+    kinds = Counter(type(insn) for insn in code.insns)
+    # x = x and the constant condition are gone, `and` and `or` branch
+    # straight to where their result goes, and no jump leads to another jump
+    assert kinds[I.DUP] == kinds[I.POP] == 0
+    assert len(code.insns) == 40
+    for insn in code.insns:
+        if isinstance(insn, I.JMP | I.JMP_IF_FALSE | I.JMP_IF_TRUE):
+            assert not isinstance(code.insns[insn.label.target], I.JMP)
+
+
+def test13_superinstructions(capsys, tmp_path):
+    import bytecodefile
+    source = """{
+        def isprime(n){
+            var prime = n > 1;
+            var d = 2;
+            while (d * d < n + 1) {
+                if (n % d == 0) { prime = 0; }
+                d = d + 1;
+            }
+            return prime;
+        }
+        var count = 0;
+        var total = 0;
+        var i = 0;
+        while (i < 60) {
+            var p = isprime(i);
+            if (p) { count = count + 1; total = total + i; }
+            i = i + 1;
+        }
+        print count, total, total / 4;
+    }"""
+    plain = compile_source(source, optimize=False)
+    code = compile_source(source)
+    kinds = Counter(type(insn) for insn in code.insns)
+    assert kinds[I.INC_LOCAL] == 3
+    assert kinds[I.BINOP_LOCALS] and kinds[I.BINOP_LOCAL_CONST]
+    assert kinds[I.CMP_JMP_IF_FALSE]
+
+    filename = str(tmp_path / ("program" + bytecodefile.extension))
+    bytecodefile.write(code, filename)
+    for program in (plain, code):
+        v = VM()
+        v.load(program)
+        v.execute()
+        assert capsys.readouterr().out == "17\n440\n110\n"
+        counts = Counter()
+        v.restart()
+        v.execute_traced(counts)
+        assert capsys.readouterr().out == "17\n440\n110\n"
+    v = VM()
+    v.load_lowered(*bytecodefile.read(filename))
+    v.execute()
+    assert capsys.readouterr().out == "17\n440\n110\n"
+
+
+def test14_forLoops(capsys):
+    source = """{
+        var total = 0;
+        var n = 10;
+        for (i = 0; i < n; i = i + 1) {
+            for (j = i; j < n * 2 - i; j = j + 3) {
+                total = total + j;
+            }
+        }
+        for (i = 1/2; i < 4; i = i + 1) { total = total + i; }
+        for (i = 0; i < 100; i = i + 1) {
+            if (i == 5) { i = 100; }
+            total = total + i;
+        }
+        for (i = 0; i < n; i = i * 2 + 1) { total = total + i; }
+        print total;
+    }"""
+    code = compile_source(source)
+    kinds = Counter(type(insn) for insn in code.insns)
+    # the loops assigning to i in the body or not stepping by a constant
+    # are compiled the long way
+    assert kinds[I.FOR_NEXT] == 3
+    for optimize in (False, True):
+        v = VM()
+        v.load(compile_source(source, optimize))
+        v.execute()
+        assert capsys.readouterr().out == "489\n"
+        assert v.data == []
+
+
 # test1_binOps()
 # test2_stringOps()
 # test3_unaryOps()
@@ -0,0 +1,208 @@
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from fractions import Fraction
+from bytecode import *
+
+
+# Binary format for compiled programs, so they can be shipped precompiled
+# and loaded straight into the VM's lowered instruction arrays:
+#
+#   header     magic, format version, crc32 of the opcode numbering, number
+#              of top level slots, instruction and constant counts, and the
+#              crc32 of everything after the header
+#   opcodes    one byte per instruction
+#   operands   one little endian int32 per instruction: the jump target,
+#              slot, id or count, or for PUSH, INPUT, PUSHFN, the counted
+#              loop instructions and the superinstructions an index into
+#              the constant pool
+#   constants  tagged values: ints, Fractions, bools, strings, functions
+#              (entry point, frame size, arity and purity), tuples, and the
+#              binary operations of superinstructions (by instruction name)
+
+extension = ".npbc"
+magic = b"NPBC"
+format_version = 2
+header = struct.Struct("<4sHHIIIII")
+
+# a file is only valid for the opcode numbering it was written with
+opcode_version = zlib.crc32(
+    ",".join(kind.__name__ for kind in opcodes).encode())
+
+pooled = {opcodes[kind] for kind in (
+    I.PUSH, I.INPUT, I.PUSHFN, I.FOR_START, I.FOR_NEXT, I.INC_LOCAL, I.CMP_JMP_IF_FALSE,
+    I.BINOP_LOCALS, I.BINOP_LOCAL_CONST)}
+binary_names = {function: name for name, function in binary_functions.items()}
+
+int_header = struct.Struct("<cI")
+function_constant = struct.Struct("<ciii?")
+
+
+class BadBytecodeFile(Exception):
+    pass
+
+
+def encode_int(value: int) -> bytes:
+    data = value.to_bytes((value.bit_length() + 8) // 8, "little", signed=True)
+    return int_header.pack(b"i", len(data)) + data
+
+
+def encode_constant(value) -> bytes:
+    match value:
+        case bool():
+            return b"t" if value else b"f"
+        case int():
+            return encode_int(value)
+        case Fraction():
+            return b"q" + encode_int(value.numerator) + encode_int(value.denominator)
+        case str():
+            data = value.encode()
+            return int_header.pack(b"s", len(data)) + data
+        case beginFunction(entry, frame_size, arity, pure):
+            return function_constant.pack(b"F", entry, frame_size, arity, pure)
+        case tuple():
+            return int_header.pack(b"T", len(value)) + b"".join(
+                encode_constant(item) for item in value)
+        case _ if value in binary_names:
+            data = binary_names[value].encode()
+            return int_header.pack(b"o", len(data)) + data
+    raise BadBytecodeFile(f"Can't store constant {value!r}")
+
+
+def decode_constant(data, offset):
+    # the constant at offset, and the offset just after it
+    tag = data[offset:offset + 1]
+    match tag:
+        case b"t":
+            return True, offset + 1
+        case b"f":
+            return False, offset + 1
+        case b"i" | b"s" | b"o":
+            _, size = int_header.unpack_from(data, offset)
+            start = offset + int_header.size
+            raw = data[start:start + size]
+            if tag == b"s":
+                return raw.decode(), start + size
+            if tag == b"o":
+                name = bytes(raw).decode()
+                if name not in binary_functions:
+                    raise BadBytecodeFile(f"Unknown operation {name!r}")
+                return binary_functions[name], start + size
+            return int.from_bytes(raw, "little", signed=True), start + size
+        case b"q":
+            numerator, offset = decode_constant(data, offset + 1)
+            denominator, offset = decode_constant(data, offset)
+            return Fraction(numerator, denominator), offset
+        case b"F":
+            _, entry, frame_size, arity, pure = function_constant.unpack_from(data, offset)
+            return beginFunction(entry, frame_size, arity, pure), offset + function_constant.size
+        case b"T":
+            _, size = int_header.unpack_from(data, offset)
+            offset += int_header.size
+            items = []
+            for i in range(size):
+                item, offset = decode_constant(data, offset)
+                items.append(item)
+            return tuple(items), offset
+    raise BadBytecodeFile(f"Unknown constant tag {tag!r}")
+
+
+def pool_key(value):
+    # keyed by type too, so True and 1 get separate entries
+    match value:
+        case beginFunction(entry, frame_size, arity, pure):
+            return (beginFunction, entry, frame_size, arity, pure)
+        case tuple():
+            return (tuple, tuple(pool_key(item) for item in value))
+    return (type(value), value)
+
+
+def dumps(bytecode: ByteCode) -> bytes:
+    code, operands = lower(bytecode)
+    pool = {}
+    constants = []
+    arguments = array("i")
+    for op, arg in zip(code, operands):
+        if op in pooled:
+            key = pool_key(arg)
+            if key not in pool:
+                pool[key] = len(constants)
+                constants.append(encode_constant(arg))
+            arg = pool[key]
+        arguments.append(0 if arg is None else arg)
+    if sys.byteorder == "big":
+        arguments.byteswap()
+    body = bytes(code) + arguments.tobytes() + b"".join(constants)
+    return header.pack(magic, format_version, 0, opcode_version,
+                       bytecode.nlocals, len(code), len(constants),
+                       zlib.crc32(body)) + body
+
+
+def loads(data):
+    # (code, operands, nlocals) for VM.load_lowered, from the contents of a
+    # bytecode file
+    if len(data) < header.size:
+        raise BadBytecodeFile("Truncated header")
+    (file_magic, version, _, opcode_crc, nlocals, size, nconstants,
+     checksum) = header.unpack_from(data, 0)
+    if file_magic != magic:
+        raise BadBytecodeFile("Not a bytecode file")
+    if version != format_version or opcode_crc != opcode_version:
+        raise BadBytecodeFile("Bytecode file is for another interpreter version")
+    if len(data) < header.size + 5 * size:
+        raise BadBytecodeFile("Bytecode file is truncated")
+    with memoryview(data) as view, view[header.size:] as body:
+        if zlib.crc32(body) != checksum:
+            raise BadBytecodeFile("Bytecode file is corrupt")
+        code = bytes(body[:size])
+        arguments = array("i")
+        arguments.frombytes(body[size:size + 4 * size])
+    if sys.byteorder == "big":
+        arguments.byteswap()
+    constants = []
+    offset = header.size + 5 * size
+    for i in range(nconstants):
+        value, offset = decode_constant(data, offset)
+        constants.append(value)
+
+    operands = arguments.tolist()
+    for ip in [ip for ip, op in enumerate(code) if op in pooled]:
+        operands[ip] = constants[operands[ip]]
+    return code, operands, nlocals
+
+
+def write(bytecode: ByteCode, filename: str) -> None:
+    with open(filename, "wb") as f:
+        f.write(dumps(bytecode))
+
+
+def read(filename: str):
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise BadBytecodeFile("Truncated header")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return loads(data)
+
+
+if __name__ == "__main__":
+    # bytecodefile.py program.txt [program.npbc] compiles a program
+    import lexer as l
+    import Parser as p
+    import resolver as r
+    import fold as f
+    import hoisting as h
+    import buffering as sb
+    import tailcalls as tc
+    import purity
+    source = sys.argv[1]
+    target = sys.argv[2] if len(sys.argv) > 2 else source.rsplit(
+        ".", 1)[0] + extension
+    with open(source) as program:
+        code = '{' + program.read() + '}'
+    tokens = l.bufferedLexer.lexerFromStream(l.Stream.streamFromString(code))
+    ast = p.Parser.parse_expr(p.Parser.call_parser(tokens))
+    write(compile(purity.mark_pure(tc.tail_calls(
+        sb.buffer_strings(h.hoist(f.fold(r.resolve(ast))))))), target)
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+
+# On-disk cache of compiled programs, the Notpy version of __pycache__.
+# Next to every program that has been run there is a __notpycache__
+# directory with one file per program and kind of compiled object ("ast" for
+# the resolved AST, "bytecode" for the VM's ByteCode). Each file holds the
+# key it was built for: a hash of the interpreter version and the source.
+# An entry is only used if that key matches, so a changed program or
+# interpreter simply gets recompiled and overwrites it. Unreadable or corrupt
+# entries are treated as missing.
+#
+# Entries are pickles, so like __pycache__ the directory must only be
+# writable by people trusted to run code.
+
+cache_directory = "__notpycache__"
+
+# the modules whose code decides what a compiled program looks like
+interpreter_modules = ["lexer.py", "Parser.py",
+                       "eval.py", "resolver.py", "fold.py", "hoisting.py",
+                       "buffering.py", "tailcalls.py", "purity.py", "bytecode.py"]
+
+interpreter_hash = None
+
+
+def interpreter_version() -> str:
+    global interpreter_hash
+    if interpreter_hash is None:
+        h = hashlib.sha256(sys.version.encode())
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in interpreter_modules:
+            with open(os.path.join(here, name), "rb") as f:
+                h.update(f.read())
+        interpreter_hash = h.hexdigest()
+    return interpreter_hash
+
+
+def cache_key(source: str, kind: str) -> str:
+    h = hashlib.sha256(interpreter_version().encode())
+    h.update(kind.encode())
+    h.update(source.encode())
+    return h.hexdigest()
+
+
+def cache_path(filename: str, kind: str) -> str:
+    directory = os.path.join(os.path.dirname(
+        os.path.abspath(filename)), cache_directory)
+    return os.path.join(directory, f"{os.path.basename(filename)}.{kind}.notpyc")
+
+
+def load(path: str, key: str):
+    # the cached object, or None if there is no usable entry
+    try:
+        with open(path, "rb") as f:
+            stored_key, value = pickle.load(f)
+    except Exception:
+        return None
+    if stored_key != key:
+        return None
+    return value
+
+
+def store(path: str, key: str, value) -> None:
+    # written to a temporary file and renamed over the entry, so readers
+    # never see a half written one; failing to write just means no caching
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+    except (OSError, pickle.PicklingError, RecursionError):
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+
+def cached(filename: str, source: str, kind: str, build):
+    # the compiled `kind` of the program in filename, whose text is source;
+    # build() makes it when the cache doesn't have it
+    path = cache_path(filename, kind)
+    key = cache_key(source, kind)
+    value = load(path, key)
+    if value is None:
+        value = build()
+        store(path, key, value)
+    return value
@@ -0,0 +1,47 @@
+import os
+import cache
+
+
+def test1_cached(tmp_path):
+    filename = str(tmp_path / "program.txt")
+    builds = []
+
+    def build(value):
+        def build_():
+            builds.append(value)
+            return value
+        return build_
+
+    assert cache.cached(filename, "{print 1;}", "ast", build([1])) == [1]
+    # warm: nothing is rebuilt
+    assert cache.cached(filename, "{print 1;}", "ast", build([2])) == [1]
+    assert builds == [[1]]
+    assert os.path.exists(cache.cache_path(filename, "ast"))
+
+    # another kind, or changed source, is built again
+    assert cache.cached(filename, "{print 1;}", "bytecode", build([3])) == [3]
+    assert cache.cached(filename, "{print 2;}", "ast", build([4])) == [4]
+    assert cache.cached(filename, "{print 2;}", "ast", build([5])) == [4]
+    assert builds == [[1], [3], [4]]
+
+
+def test2_invalidation(tmp_path):
+    filename = str(tmp_path / "program.txt")
+    path = cache.cache_path(filename, "ast")
+    cache.cached(filename, "{}", "ast", lambda: "old")
+
+    # a corrupt entry is ignored and replaced
+    with open(path, "wb") as f:
+        f.write(b"not a pickle")
+    assert cache.cached(filename, "{}", "ast", lambda: "new") == "new"
+    assert cache.cached(filename, "{}", "ast", lambda: "newer") == "new"
+
+    # so is one built by another interpreter version
+    version = cache.interpreter_hash
+    try:
+        cache.interpreter_hash = "something else"
+        assert cache.cached(filename, "{}", "ast", lambda: "rebuilt") == "rebuilt"
+    finally:
+        cache.interpreter_hash = version
+    assert cache.cached(filename, "{}", "ast", lambda: "again") == "again"
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
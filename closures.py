@@ -0,0 +1,477 @@
+from dataclasses import dataclass
+from typing import Callable, List
+from eval import *
+
+
+# Closure compiler: walks a resolved AST once and turns every node into a
+# Python closure with its children already compiled, so running a program is
+# just calling closures. Every closure takes the frame (a list of slots, as
+# laid out by the resolver) of the function it runs in; top level variables
+# live in the root frame.
+
+Closure = Callable[[List[Value]], Value]
+
+
+@dataclass
+class CompiledFunction:
+    slots: List[int]  # parameter slots
+    frame_size: int
+    body: Closure
+    return_exp: Closure
+
+
+class Restart(Exception):
+    # raised by a tail call, for the call it replaces to start over
+    pass
+
+
+@dataclass
+class Program:
+    root: List[Value]
+    code: Closure
+
+    def run(self) -> Value:
+        self.root[:] = [None] * len(self.root)
+        return self.code(self.root)
+
+
+def compile(program: AST) -> Program:
+    root = []
+    code = do_compile(program, root, 0)
+    return Program(root, code)
+
+
+def do_compile(program: AST, root: List[Value], level: int) -> Closure:
+    def compile_(program):
+        return do_compile(program, root, level)
+
+    def load(v) -> Closure:
+        slot = v.slot
+        if v.level == level:
+            return lambda frame: frame[slot]
+        if v.level == 0:
+            return lambda frame: root[slot]
+        return unsupported
+
+    def store(v) -> Callable[[List[Value], Value], None]:
+        slot = v.slot
+        if v.level == 0 and len(root) <= slot:
+            root.extend([None] * (slot + 1 - len(root)))
+        if v.level == level:
+            def store_local(frame, value):
+                frame[slot] = value
+            return store_local
+        if v.level == 0:
+            def store_global(frame, value):
+                root[slot] = value
+            return store_global
+        return lambda frame, value: ProgramNotSupported()
+
+    match program:
+        case Null():
+            return lambda frame: 0
+        case input_statement(string):
+            return lambda frame: input(string)
+
+        case let_var() as v:
+            # let variables are bound while their body runs, saving whatever
+            # an enclosing run of the same let had bound
+            cell = let_cells.get(v.id)
+            if cell is None:
+                return unsupported
+            return lambda frame: cell[0]
+        case let(variable, e1, e2):
+            value = compile_(e1)
+            cell = let_cells.setdefault(variable.id, [None])
+            body = compile_(e2)
+
+            def run_let(frame):
+                temp = value(frame)
+                saved = cell[0]
+                cell[0] = temp
+                try:
+                    return body(frame)
+                finally:
+                    cell[0] = saved
+            return run_let
+
+        case declare(variable, value) | set(variable, value):
+            value = compile_(value)
+            store_ = store(variable)
+
+            def run_store(frame):
+                store_(frame, value(frame))
+                return 0
+            return run_store
+
+        case list_initializer(size, value):
+            size = compile_(size)
+            value = compile_(value)
+
+            def run_list_initializer(frame):
+                return initial_list(int(size(frame)), value(frame))
+            return run_list_initializer
+
+        case identifier() as v:
+            return load(v)
+        case get(variable):
+            return load(variable)
+
+        # Literals
+        case numeric_literal(value) | bool_literal(value) | string_literal(value):
+            return lambda frame: value
+        case Lists(value):
+            items = [compile_(e) for e in value]
+            return lambda frame: [item(frame) for item in items]
+        case dict_literal(value):
+            pairs = [(compile_(k), compile_(v)) for k, v in value]
+
+            def run_dict_literal(frame):
+                output_dict = Dictionary()
+                for k, v in pairs:
+                    output_dict[k(frame)] = v(frame)
+                return output_dict
+            return run_dict_literal
+
+        case binary_operation(op, left, right) if op in arithmetic:
+            return arithmetic[op](compile_(left), compile_(right))
+        case binary_operation(op, left, right) if op in comparison:
+            return comparison[op](compile_(left), compile_(right))
+        case binary_operation("&&" | "and", left, right):
+            a = compile_(left)
+            b = compile_(right)
+            return lambda frame: bool(a(frame) and b(frame))
+        case binary_operation("||" | "or", left, right):
+            a = compile_(left)
+            b = compile_(right)
+            return lambda frame: bool(a(frame) or b(frame))
+
+        case if_statement(condition, if_exp, else_exp):
+            condition = compile_(condition)
+            if_exp = compile_(if_exp)
+            else_exp = compile_(else_exp)
+
+            def run_if(frame):
+                if condition(frame):
+                    return if_exp(frame)
+                return else_exp(frame)
+            return run_if
+
+        case while_loop(condition, body):
+            condition = compile_(condition)
+            body = compile_(body)
+
+            def run_while(frame):
+                while condition(frame):
+                    body(frame)
+                return 0
+            return run_while
+
+        case block(exps):
+            exps = tuple(compile_(e) for e in exps)
+
+            def run_block(frame):
+                for exp in exps:
+                    exp(frame)
+                return 0
+            return run_block
+
+        case unary_operation("!", operand):
+            operand = compile_(operand)
+            return lambda frame: not operand(frame)
+        case unary_operation("-", operand):
+            operand = compile_(operand)
+            return lambda frame: -operand(frame)
+
+        case string_concat(string_list):
+            strings = [compile_(e) for e in string_list]
+
+            def run_string_concat(frame):
+                final_string = ""
+                for s in strings:
+                    final_string += s(frame)
+                return str(final_string)
+            return run_string_concat
+        case string_slice(string, start, stop, hop):
+            string = compile_(string)
+            start = compile_(start)
+            stop = compile_(stop)
+            hop = compile_(hop)
+
+            def run_string_slice(frame):
+                begin = int(start(frame))
+                end = int(stop(frame))
+                step = int(hop(frame))
+                final_string = string(frame)
+                if (end == -1):
+                    return str(final_string[begin::step])
+                return str(final_string[begin:end:step])
+            return run_string_slice
+        case u_string_operation("buffer", string):
+            string = compile_(string)
+            return lambda frame: buffered(string(frame))
+        case u_string_operation("text", string):
+            string = compile_(string)
+            return lambda frame: unbuffered(string(frame))
+
+        case for_loop(iterator, initial_value, condition, updation, body):
+            initial_value = compile_(initial_value)
+            store_ = store(iterator)
+            condition = compile_(condition)
+            updation = compile_(updation)
+            body = compile_(body)
+
+            def run_for(frame):
+                store_(frame, initial_value(frame))
+                while condition(frame):
+                    body(frame)
+                    updation(frame)
+                return 0
+            return run_for
+
+        case print_statement(expr_list):
+            exps = [compile_(e) for e in expr_list]
+
+            def run_print(frame):
+                return_val = ""
+                for exp in exps:
+                    value = exp(frame)
+                    return_val += str(value)
+                    print(value, end=" ")
+                print("")
+                return return_val
+            return run_print
+
+        # Functions
+        case Function(name, parameters, body, return_exp, _, frame_size):
+            function = CompiledFunction(
+                [p.slot for p in parameters],
+                frame_size,
+                do_compile(body, root, level + 1),
+                do_compile(return_exp, root, level + 1))
+            store_ = store(name)
+
+            def run_function(frame):
+                store_(frame, function)
+                return 0
+            return run_function
+
+        case FunctionCall(fn, arguments):
+            fn = load(fn)
+            arguments = [compile_(arg) for arg in arguments]
+
+            def run_call(frame):
+                function = fn(frame)
+                callee = [None] * function.frame_size
+                for slot, arg in zip(function.slots, arguments):
+                    callee[slot] = arg(frame)
+                while True:
+                    try:
+                        function.body(callee)
+                        return function.return_exp(callee)
+                    except Restart:
+                        # the call ended in a tail call, which has put its
+                        # arguments in callee
+                        pass
+            return run_call
+
+        case TailCall(FunctionCall(fn, arguments)):
+            fn = load(fn)
+            arguments = [compile_(arg) for arg in arguments]
+
+            def run_tail_call(frame):
+                values = [arg(frame) for arg in arguments]
+                for slot, value in zip(fn(frame).slots, values):
+                    frame[slot] = value
+                raise Restart()
+            return run_tail_call
+
+        case u_list_operation("self", left):
+            return compile_(left)
+        case u_list_operation("head", l):
+            l = compile_(l)
+
+            def run_head(frame):
+                our_list = l(frame)
+                if (len(our_list) == 0):
+                    return Null
+                return our_list[0]
+            return run_head
+        case u_list_operation("tail", l):
+            l = compile_(l)
+            return lambda frame: list_tail(l(frame))
+        case u_list_operation("is_empty", l):
+            l = compile_(l)
+            return lambda frame: len(l(frame)) == 0
+
+        case b_list_operation("cons", left, l):
+            value = compile_(left)
+            our_list = compile_(l)
+            if isinstance(l, get):
+                # the variable holding the list now holds the longer one
+                store_ = store(l.variable)
+            else:
+                store_ = store(l) if isinstance(l, identifier) else None
+
+            def run_cons(frame):
+                rest = our_list(frame)
+                output_list = list_cons(value(frame), rest)
+                if store_ is not None:
+                    store_(frame, output_list)
+                return output_list
+            return run_cons
+        case b_list_operation("append", right, l):
+            our_list = compile_(l)
+            value = compile_(right)
+
+            def run_append(frame):
+                output_list = our_list(frame)
+                output_list.append(value(frame))
+                return output_list
+            return run_append
+
+        case u_dict_operation("keys" | "values" | "items" as kind, d):
+            d = compile_(d)
+            return lambda frame: dict_view(d(frame), kind)
+        case b_dict_operation("delete", d, key):
+            d = compile_(d)
+            key = compile_(key)
+
+            def run_delete(frame):
+                our_dict = d(frame)
+                del our_dict[key(frame)]
+                return our_dict
+            return run_delete
+        case b_dict_operation("check", d, key):
+            d = compile_(d)
+            key = compile_(key)
+
+            def run_check(frame):
+                our_dict = d(frame)
+                return key(frame) in our_dict
+            return run_check
+
+        case length(first):
+            first = compile_(first)
+
+            def run_length(frame):
+                data_structure = first(frame)
+                if isinstance(data_structure, list | ConsList | PackedList | DictView | StringBuffer | dict | str):
+                    return len(data_structure)
+                raise Exception("Invalid type for length")
+            return run_length
+        case find(first, second):
+            first = compile_(first)
+            second = compile_(second)
+
+            def run_find(frame):
+                data_structure = first(frame)
+                index = second(frame)
+                if isinstance(data_structure, list | ConsList | PackedList | DictView | StringBuffer | str):
+                    index = int(index)
+                    if (index >= len(data_structure)):
+                        raise Exception("Index out of bounds")
+                    return data_structure[index]
+                elif isinstance(data_structure, dict):
+                    return data_structure.get(index, -1)
+                raise Exception("Type does not support lookup")
+            return run_find
+        case put(first, second, third):
+            store_ = store(first.variable) if isinstance(first, get) else None
+            first = compile_(first)
+            second = compile_(second)
+            third = compile_(third)
+
+            def run_put(frame):
+                data_structure = first(frame)
+                index = second(frame)
+                value = third(frame)
+                if isinstance(data_structure, list | ConsList | PackedList | DictView | StringBuffer):
+                    index = int(index)
+                    if (index >= len(data_structure)):
+                        raise Exception("Index out of bounds")
+                    data_structure[index] = value
+                    return data_structure
+                elif isinstance(data_structure, dict):
+                    data_structure[index] = value
+                    return data_structure
+                elif isinstance(data_structure, str):
+                    index = int(index)
+                    if (index >= len(data_structure)):
+                        raise Exception("Index out of bounds")
+                    data_structure = data_structure[:index] + \
+                        str(value) + data_structure[index+1:]
+                    if store_ is not None:
+                        store_(frame, data_structure)
+                    return data_structure
+                raise Exception("Type does not support lookup")
+            return run_put
+
+    # like eval_ast, only complain if the program actually gets here
+    return unsupported
+
+
+def unsupported(frame):
+    ProgramNotSupported()
+
+
+# let variables, by id, to the cell holding their current value
+let_cells: dict[int, list] = {}
+
+
+def add(a, b):
+    def run(frame):
+        x = a(frame)
+        y = b(frame)
+        if isinstance(x, str):
+            return x+y
+        return number(x + y)
+    return run
+
+
+def sub(a, b):
+    return lambda frame: number(a(frame) - b(frame))
+
+
+def mul(a, b):
+    return lambda frame: number(a(frame) * b(frame))
+
+
+def div(a, b):
+    def run(frame):
+        x = a(frame)
+        y = b(frame)
+        if y == 0:
+            raise Exception("Division by zero")
+        return divide(x, y)
+    return run
+
+
+def exp(a, b):
+    return lambda frame: power(a(frame), b(frame))
+
+
+def rem(a, b):
+    return lambda frame: number(a(frame) % b(frame))
+
+
+def quot(a, b):
+    return lambda frame: a(frame) // b(frame)
+
+
+arithmetic = {
+    "+": add,
+    "-": sub,
+    "*": mul,
+    "/": div,
+    "^": exp,
+    "%": rem,
+    "//": quot,
+}
+
+comparison = {
+    "==": lambda a, b: lambda frame: bool(a(frame) == b(frame)),
+    "!=": lambda a, b: lambda frame: bool(a(frame) != b(frame)),
+    "<": lambda a, b: lambda frame: bool(a(frame) < b(frame)),
+    ">": lambda a, b: lambda frame: bool(a(frame) > b(frame)),
+}
@@ -0,0 +1,97 @@
+from eval import eval_ast, frame_environment
+import closures
+from testing import parse
+
+
+def run_both(source, capsys):
+    # runs the program on eval_ast, by name and by resolved slots, and on the
+    # closure compiler, checking they all print the same thing
+    eval_ast(parse(source, resolved=False))
+    expected = capsys.readouterr().out
+    eval_ast(parse(source), None, frame_environment())
+    assert capsys.readouterr().out == expected
+    closures.compile(parse(source)).run()
+    assert capsys.readouterr().out == expected
+    return expected
+
+
+def test1_loops(capsys):
+    assert run_both("""{
+        var total = 0;
+        var i = 0;
+        while (i < 10) {
+            if (i % 2 == 0) { total = total + i; }
+            else { total = total - 1; }
+            i = i + 1;
+        }
+        for (j = 0; j < 3; j = j + 1) { total = total * 2; }
+        print total, 7 / 2;
+    }""", capsys) == "120 7/2 \n"
+
+
+def test2_recursion(capsys):
+    assert run_both("""{
+        def fib(n){
+            var ans = n;
+            if (n > 1) {
+                var a = fib(n - 1);
+                var b = fib(n - 2);
+                ans = a + b;
+            }
+            return ans;
+        }
+        var total = 0;
+        def add(x){
+            total = total + x;
+            return total;
+        }
+        var a = add(fib(15));
+        print total;
+    }""", capsys) == "610 \n"
+
+
+def test3_data(capsys):
+    assert run_both("""{
+        var l = [1, 2, 3];
+        var d = {"a": 1};
+        var s = "hello";
+        l[1] = 5;
+        s[0] = "j";
+        var n = l.length;
+        print l[1], s, d["a"], n;
+    }""", capsys) == "5 jello 1 3 \n"
+
+
+def test4_rerun(capsys):
+    # a compiled program starts from fresh variables every time it runs
+    program = closures.compile(parse("""{
+        var x = 1;
+        x = x + 1;
+        print x;
+    }"""))
+    program.run()
+    program.run()
+    assert capsys.readouterr().out == "2 \n2 \n"
+
+
+def test5_frameEnvironment(capsys):
+    # a nested function sees the frame of the running call of the function
+    # it is declared in, and blocks share their function's frame
+    name_space = frame_environment()
+    eval_ast(parse("""{
+        def outer(n){
+            var scale = n * 10;
+            def inner(x){
+                return x + scale;
+            }
+            var r = 0;
+            if (n > 0) {
+                var below = outer(n - 1);
+                r = inner(below);
+            }
+            return r;
+        }
+        print outer(3);
+    }"""), None, name_space)
+    assert capsys.readouterr().out == "60 \n"
+    assert len(name_space.display[0]) == 1
@@ -0,0 +1,45 @@
+from eval import Dictionary, DictView, dict_view
+from testing import parse, run_all
+
+
+def test1_dictViews(capsys):
+    source = """{
+        var d = {"a": 1, "b": 2, "c": 3};
+        var k = d.keys;
+        var v = d.values;
+        var i = d.items;
+        print k, v, i;
+        print k[1], v[0], i[2], k.length;
+        d["d"] = 4;
+        d["a"] = 5;
+        d.delete("b");
+        print k, v, i, k.length, d.keys, d.values;
+        var k2 = d.keys;
+        k2[0] = "z";
+        k2.append("y");
+        var same = k == k2;
+        print k2, d.keys, same;
+    }"""
+    # views print and index like lists, and keep what the dict held when
+    # they were taken however it changes after
+    assert run_all(parse(source), capsys).split() == [
+        "['a',", "'b',", "'c']", "[1,", "2,", "3]",
+        "[('a',", "1),", "('b',", "2),", "('c',", "3)]",
+        "b", "1", "('c',", "3)", "3",
+        "['a',", "'b',", "'c']", "[1,", "2,", "3]",
+        "[('a',", "1),", "('b',", "2),", "('c',", "3)]", "3",
+        "['a',", "'c',", "'d']", "[5,", "3,", "4]",
+        "['z',", "'c',", "'d',", "'y']", "['a',", "'c',", "'d']", "False"]
+
+
+def test2_viewCopies():
+    # a view reads the dict until either of them changes
+    d = Dictionary({"a": 1})
+    keys = dict_view(d, "keys")
+    assert type(keys) is DictView and keys.array is None
+    assert keys == ["a"] and len(keys) == 1 and keys.array is None
+    d["b"] = 2
+    assert keys.array == ["a"] and keys == ["a"]
+    values = dict_view(d, "values")
+    values[0] = 7
+    assert values == [7, 2] and d == {"a": 1, "b": 2}
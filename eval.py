@@ -1,5 +1,8 @@
 from typing import List
 from dataclasses import dataclass
+import math
+import weakref
+from array import array
 from fractions import Fraction
 from typing import Union, Optional, NewType
 
@@ -53,16 +56,399 @@ class Null():
     type: NoneType = NoneType()
     pass
 
+# Numbers
+# Numbers are exact rationals, but kept as plain ints while they are
+# integral; only a non-exact division or a fractional power makes a Fraction.
+
+Number = int | Fraction
+
+
+def number(value) -> Number:
+    # demotes integral Fractions back to int, leaves anything else alone
+    if isinstance(value, Fraction) and value.denominator == 1:
+        return value.numerator
+    return value
+
+
+def divide(a, b) -> Number:
+    if isinstance(a, int) and isinstance(b, int):
+        if a % b == 0:
+            return a // b
+        return Fraction(a, b)
+    return number(Fraction(a) / b)
+
+
+half = Fraction(1, 2)
+
+
+def power(a, b) -> Number:
+    if type(b) is int:
+        if b >= 0:
+            # int ** int is exact, and the most common case
+            return a ** b if type(a) is int else number(a ** b)
+        return number(Fraction(a) ** b)
+    if b == half:
+        root = square_root(a)
+        if root is not None:
+            return root
+    result = a ** b
+    if isinstance(result, float):
+        # fractional exponents are computed in floating point
+        result = Fraction(result)
+    return number(result)
+
+
+def square_root(a) -> Optional[Number]:
+    # the exact square root of a, if a is the square of a rational; else
+    # the nearest float, as a ** (1/2) would be, or the root rounded down if
+    # a is too large for a float. None if a is negative
+    if a < 0:
+        return None
+    if type(a) is int:
+        root = math.isqrt(a)
+        if root * root == a:
+            return root
+    else:
+        numerator, denominator = math.isqrt(a.numerator), math.isqrt(a.denominator)
+        if numerator * numerator == a.numerator and denominator * denominator == a.denominator:
+            return number(Fraction(numerator, denominator))
+    try:
+        return Fraction(float(a) ** 0.5)
+    except OverflowError:
+        return math.isqrt(math.floor(a))
+
+# Lists
+# Lists are Python lists, except what cons and tail make: a ConsList, which
+# keeps its items either in a Python list or as a chain of immutable
+# (item, rest) pairs ending in None. cons and tail share the chain of the
+# list they are given, so they take O(1) time once it is a chain; indexing,
+# put and append turn it back into a Python list. Either way a ConsList is
+# one list, and whoever holds it sees the changes made to it.
+
+
+def cells_of(items, start: int = 0):
+    # items[start:] as (item, rest) pairs
+    cells = None
+    for i in range(len(items) - 1, start - 1, -1):
+        cells = (items[i], cells)
+    return cells
+
+
+class ConsList:
+    __slots__ = ("array", "cells", "size")
+    __hash__ = None  # like a Python list
+
+    def __init__(self, cells, size: int):
+        self.array = None
+        self.cells = cells
+        self.size = size
+
+    def chained(self):
+        # the items as a chain, which cons and tail can share
+        if self.array is not None:
+            self.cells = cells_of(self.array)
+            self.size = len(self.array)
+            self.array = None
+        return self.cells
+
+    def items(self) -> list:
+        # the items as a Python list, to index and change
+        if self.array is None:
+            array = []
+            cells = self.cells
+            while cells is not None:
+                array.append(cells[0])
+                cells = cells[1]
+            self.array = array
+            self.cells = None
+        return self.array
+
+    def __len__(self):
+        return self.size if self.array is None else len(self.array)
+
+    def __getitem__(self, index):
+        if index == 0 and self.array is None and self.cells is not None:
+            return self.cells[0]  # head
+        return self.items()[index]
+
+    def __setitem__(self, index, value):
+        self.items()[index] = value
+
+    def append(self, value):
+        self.items().append(value)
+
+    def __iter__(self):
+        if self.array is not None:
+            return iter(self.array)
+        return self.iterate()
+
+    def iterate(self):
+        cells = self.cells
+        while cells is not None:
+            yield cells[0]
+            cells = cells[1]
+
+    def __eq__(self, other):
+        if isinstance(other, ConsList | list):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def list_cons(value, items) -> ConsList:
+    # value, then the items of the list items
+    if type(items) is ConsList:
+        return ConsList((value, items.chained()), len(items) + 1)
+    return ConsList((value, cells_of(items)), len(items) + 1)
+
+
+def list_tail(items):
+    # the items of the list items after the first, or the characters of a
+    # string after the first as a string
+    if isinstance(items, str):
+        return items[1:]
+    if type(items) is ConsList:
+        cells = items.chained()
+        if cells is None:
+            return ConsList(None, 0)
+        return ConsList(cells[1], len(items) - 1)
+    return ConsList(cells_of(items, 1), max(len(items) - 1, 0))
+
+
+# list(size, value) of an integer or a boolean is a PackedList, which keeps
+# its items in an array('q') of 64-bit integers or in a bytearray: 8 bytes
+# or 1 an item, where a Python list takes 8 for the reference and 28 or more
+# for each integer put in it. Putting or appending anything else (a
+# fraction, a larger integer, an integer in a list of booleans) turns its
+# items into a Python list for good.
+
+smallest, largest = -2**63, 2**63 - 1  # what array('q') can hold
+
+
+class PackedList:
+    __slots__ = ("items", "kind")
+    __hash__ = None  # like a Python list
+
+    def __init__(self, items, kind):
+        self.items = items
+        self.kind = kind  # int, bool, or None once the items are a list
+
+    def holds(self, value) -> bool:
+        # whether value can go in the items as they are
+        kind = self.kind
+        return kind is None or (type(value) is kind and
+                                (kind is bool or smallest <= value <= largest))
+
+    def unpack(self):
+        self.items = list(self)
+        self.kind = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        if self.kind is bool:
+            return self.items[index] == 1
+        return self.items[index]
+
+    def __setitem__(self, index, value):
+        if not self.holds(value):
+            self.unpack()
+        self.items[index] = value
+
+    def append(self, value):
+        if not self.holds(value):
+            self.unpack()
+        self.items.append(value)
+
+    def __iter__(self):
+        if self.kind is bool:
+            return map(bool, self.items)
+        return iter(self.items)
+
+    def __eq__(self, other):
+        if isinstance(other, PackedList | ConsList | list):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def initial_list(size: int, value):
+    # list(size, value), packed when value is an integer or a boolean
+    if type(value) is bool:
+        return PackedList(bytearray([value]) * size, bool)
+    if type(value) is int and smallest <= value <= largest:
+        return PackedList(array("q", [value]) * size, int)
+    return [value] * size
+
+
+# Dicts are Dictionaries, and keys, values and items of one are DictViews:
+# lists of what the dict held when they were taken, which read the dict
+# itself until it changes. Until then length is O(1) and nothing is copied;
+# indexing or changing a view copies it into a list, and so does changing
+# the dict, for every view of it still alive, just before the change.
+
+
+class Dictionary(dict):
+    # the DictViews reading it, by id, once there are any; like lists, views
+    # can't be hashed to go in a WeakSet
+    views = None
+
+    def taken(self, view):
+        if self.views is None:
+            self.views = weakref.WeakValueDictionary()
+        self.views[id(view)] = view
+
+    def changing(self):
+        for view in list(self.views.values()):
+            view.items()
+        self.views = None
+
+    def __setitem__(self, key, value):
+        if self.views:
+            self.changing()
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if self.views:
+            self.changing()
+        dict.__delitem__(self, key)
+
+
+class DictView:
+    __slots__ = ("source", "kind", "array", "__weakref__")
+    __hash__ = None  # like a Python list
+
+    def __init__(self, source: Dictionary, kind: str):
+        self.source = source
+        self.kind = kind  # "keys", "values" or "items"
+        self.array = None
+
+    def items(self) -> list:
+        # the view as a list of its own, to index and change
+        if self.array is None:
+            self.array = list(getattr(self.source, self.kind)())
+            self.source = None
+        return self.array
+
+    def __len__(self):
+        return len(self.source) if self.array is None else len(self.array)
+
+    def __getitem__(self, index):
+        return self.items()[index]
+
+    def __setitem__(self, index, value):
+        self.items()[index] = value
+
+    def append(self, value):
+        self.items().append(value)
+
+    def __iter__(self):
+        if self.array is not None:
+            return iter(self.array)
+        return iter(getattr(self.source, self.kind)())
+
+    def __eq__(self, other):
+        if isinstance(other, DictView | PackedList | ConsList | list):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def dict_view(d, kind: str):
+    # d.keys, d.values or d.items, as a view if d keeps track of its views
+    if type(d) is Dictionary:
+        view = DictView(d, kind)
+        d.taken(view)
+        return view
+    return list(getattr(d, kind)())
+
+
+# Strings are Python strs, except inside a loop that buffering.py has found
+# builds one: there the variable holds a StringBuffer, a list of one-character
+# strings that put and + change in place, which the loop turns back into a
+# str when it ends. find, length, slicing and print read it as they would the
+# str.
+
+
+class StringBuffer:
+    __slots__ = ("chars",)
+    __hash__ = None
+
+    def __init__(self, text: str):
+        self.chars = list(text)
+
+    def __len__(self):
+        return len(self.chars)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return "".join(self.chars[index])
+        return self.chars[index]
+
+    def __setitem__(self, index, value):
+        text = str(value)
+        if len(text) == 1 and index >= 0:
+            self.chars[index] = text
+        else:
+            # as put does to a str
+            whole = str(self)
+            self.chars = list(whole[:index] + text + whole[index+1:])
+
+    def __add__(self, other):
+        if type(other) is not str:
+            return NotImplemented
+        self.chars.extend(other)
+        return self
+
+    def __str__(self):
+        return "".join(self.chars)
+
+
+def buffered(value):
+    # value, as a StringBuffer if it is a str
+    return StringBuffer(value) if type(value) is str else value
+
+
+def unbuffered(value):
+    # value, as a str if it is a StringBuffer
+    return str(value) if type(value) is StringBuffer else value
+
+
 # Literals
 
 
 @dataclass
 class numeric_literal:
-    value: Fraction
+    value: Number
     type: NumType = NumType()
 
     def __init__(self, numerator, denominator=1):
-        self.value = Fraction(numerator, denominator)
+        self.value = number(Fraction(numerator, denominator))
 
 
 @dataclass
@@ -184,6 +570,13 @@ class string_slice:
     type: StringType = StringType()
 
 
+@dataclass
+class u_string_operation:
+    operator: str  # "buffer" or "text", see StringBuffer
+    first: "AST"
+    type: Optional[Union[NumType, BoolType, StringType, NoneType]] = None
+
+
 # Let Expressions
 @dataclass
 class let_var:
@@ -210,6 +603,10 @@ class identifier:
     name: str
     id: int
     type: Optional[Union[NumType, BoolType, StringType, NoneType]] = None
+    # filled in by the resolver: the function nesting level the variable is
+    # declared at (0 for the top level) and its slot in that level's frame
+    level: Optional[int] = None
+    slot: Optional[int] = None
 
     def make(name):
         return identifier(name, fresh())
@@ -311,8 +708,10 @@ class print_statement:
 class environment:
     scopes: list[dict]
 
-    def __init__(self):
+    def __init__(self, memo=None):
         self.scopes = [{}]
+        self.tail_call = None
+        self.memo = memo  # a purity.Memo for the calls of pure functions
 
     def start_scope(self):
         self.scopes.append({})
@@ -339,6 +738,82 @@ class environment:
                 return
         raise Exception("Variable not defined")
 
+    # what eval_ast uses: variables by name, a scope per block and per call
+
+    def bind(self, variable, value):
+        self.add_to_scope(variable.name, value)
+
+    def lookup(self, variable):
+        return self.get_from_scope(variable.name)
+
+    def assign(self, variable, value):
+        self.update_scope(variable.name, value)
+
+    def start_block(self):
+        self.start_scope()
+
+    def end_block(self):
+        self.end_scope()
+
+    def start_call(self, function):
+        self.start_scope()
+
+    def restart_call(self, function):
+        self.end_scope()
+        self.start_scope()
+
+    def end_call(self, function, saved):
+        self.end_scope()
+
+
+@dataclass
+class frame_environment:
+    # for resolved programs: every variable is read and written at the
+    # (level, slot) the resolver gave it. display[level] is the frame of the
+    # innermost running function at that nesting level, display[0] the top
+    # level one. Blocks don't need scopes of their own.
+    display: list[list]
+
+    def __init__(self, memo=None):
+        self.display = [[]]
+        # the arguments of a tail call the running function has just made
+        self.tail_call = None
+        self.memo = memo  # a purity.Memo for the calls of pure functions
+
+    def bind(self, variable, value):
+        frame = self.display[variable.level]
+        if variable.slot >= len(frame):
+            # the top level frame grows as declarations run
+            frame.extend([None] * (variable.slot + 1 - len(frame)))
+        frame[variable.slot] = value
+
+    def lookup(self, variable):
+        return self.display[variable.level][variable.slot]
+
+    def assign(self, variable, value):
+        self.display[variable.level][variable.slot] = value
+
+    def start_block(self):
+        pass
+
+    def end_block(self):
+        pass
+
+    def start_call(self, function):
+        level = function.level
+        if level == len(self.display):
+            self.display.append(None)
+        saved = self.display[level]
+        self.display[level] = [None] * function.frame_size
+        return saved
+
+    def restart_call(self, function):
+        # a tail call reuses the frame of the call it replaces
+        pass
+
+    def end_call(self, function, saved):
+        self.display[function.level] = saved
+
 # Functions
 
 
@@ -350,6 +825,8 @@ class Function:
     return_exp: 'AST'
     type: Optional[Union[NumType, BoolType,
                          StringType, NoneType, FunctionType]] = None
+    frame_size: int = 0  # number of local slots, set by the resolver
+    pure: bool = False  # set by purity.mark_pure
 
 
 @dataclass
@@ -359,16 +836,30 @@ class FunctionCall:
     type: Optional[Union[NumType, BoolType, StringType, NoneType]] = None
 
 
+@dataclass
+class TailCall:
+    # a call a function makes to itself as the last thing it does, found by
+    # tailcalls.tail_calls: the engines run it by starting the running call
+    # over with the new arguments. variable is where the function stored the
+    # result of the call before returning it, None if it returns the call
+    call: FunctionCall
+    variable: Optional[identifier] = None
+    type: Optional[Union[NumType, BoolType, StringType, NoneType]] = None
+
+
 @dataclass  # to keep track of the function name and its parameters in our environment
 class FunctionObject:
     parameters: List['AST']
     body: 'AST'
     return_exp: 'AST'
+    frame_size: int = 0  # the resolver's frame size and nesting level
+    level: int = 1
+    pure: bool = False
 
 
-AST = put | find | length | b_dict_operation | u_dict_operation | update_dict | dict_literal | update_list | list_initializer | b_list_operation | u_list_operation | Lists | print_statement | for_loop | unary_operation | numeric_literal | string_literal | string_concat | string_slice | binary_operation | let | let_var | bool_literal | if_statement | while_loop | block | identifier | get | set | declare | Function | FunctionCall | Null
+AST = put | find | length | b_dict_operation | u_dict_operation | update_dict | dict_literal | update_list | list_initializer | b_list_operation | u_list_operation | Lists | print_statement | for_loop | unary_operation | numeric_literal | string_literal | string_concat | string_slice | u_string_operation | binary_operation | let | let_var | bool_literal | if_statement | while_loop | block | identifier | get | set | declare | Function | FunctionCall | TailCall | Null
 
-Value = Fraction | bool | str
+Value = int | Fraction | bool | str
 
 
 def ProgramNotSupported():
@@ -401,49 +892,46 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
             return eval_ast(e2, lexical_scope | {variable.name: temp}, name_space)
 
         case declare(variable, value):
-            name_space.add_to_scope(variable.name, eval_ast(
+            name_space.bind(variable, eval_ast(
                 value, lexical_scope, name_space))
             return 0
 
         case list_initializer(size, value):
             size = int(eval_ast(size, lexical_scope, name_space))
             value = eval_ast(value, lexical_scope, name_space)
-            l = []
-            for i in range(size):
-                l.append(value)
-            return l
+            return initial_list(size, value)
 
         # eval_ast might never get this node as we are using get, however, it is still here for completeness
-        case identifier(name):
-            return name_space.get_from_scope(name)
+        case identifier() as variable:
+            return name_space.lookup(variable)
             # if name in name_space:
             #     return name_space[name]
             # else:
             #     raise Exception("Variable not defined")
 
         case get(variable):
-            return name_space.get_from_scope(variable.name)
+            return name_space.lookup(variable)
             # if variable.name in name_space:
             #     return name_space[variable.name]
             # else:
             #     raise Exception("Variable not defined")
 
         case set(variable, value):
-            name_space.update_scope(variable.name, eval_ast(
+            name_space.assign(variable, eval_ast(
                 value, lexical_scope, name_space))
             # temp = eval_ast(value, lexical_scope, name_space)
             # name_space[variable.name] = temp
-            return Fraction(0)  # return value of set is always 0
+            return 0  # return value of set is always 0
 
         case update_list(variable, value):
-            name_space.update_scope(variable.name, value)
-            return Fraction(0)
+            name_space.assign(variable, value)
+            return 0
         case update_dict(variable, value):
-            name_space.update_scope(variable.name, value)
-            return Fraction(0)
+            name_space.assign(variable, value)
+            return 0
         case update_string(e, value):
-            name_space.update_scope(e.variable.name, value)
-            return Fraction(0)
+            name_space.assign(e.variable, value)
+            return 0
 
         # Literals
         case numeric_literal(value):
@@ -459,44 +947,65 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
                     eval_ast(value[i], lexical_scope, name_space))
             return output_list
         case dict_literal(value):
-            output_dict = {}
+            output_dict = Dictionary()
             for i in range(len(value)):
                 output_dict[eval_ast(value[i][0], lexical_scope, name_space)] = eval_ast(
                     value[i][1], lexical_scope, name_space)
             return output_dict
 
         # Arithmetic Operations
+        # each operand is evaluated exactly once, left to right
         case binary_operation("+", left, right):
             a = eval_ast(left, lexical_scope, name_space)
             b = eval_ast(right, lexical_scope, name_space)
             if isinstance(a, str):
                 return a+b
             else:
-                return Fraction(eval_ast(left, lexical_scope, name_space) + eval_ast(right, lexical_scope, name_space))
+                return number(a + b)
         case binary_operation("-", left, right):
-            return Fraction(eval_ast(left, lexical_scope, name_space) - eval_ast(right, lexical_scope, name_space))
+            a = eval_ast(left, lexical_scope, name_space)
+            b = eval_ast(right, lexical_scope, name_space)
+            return number(a - b)
         case binary_operation("*", left, right):
-            return Fraction(eval_ast(left, lexical_scope, name_space) * eval_ast(right, lexical_scope, name_space))
+            a = eval_ast(left, lexical_scope, name_space)
+            b = eval_ast(right, lexical_scope, name_space)
+            return number(a * b)
         case binary_operation("/", left, right):
-            if eval_ast(right, lexical_scope, name_space) == 0:
+            a = eval_ast(left, lexical_scope, name_space)
+            b = eval_ast(right, lexical_scope, name_space)
+            if b == 0:
                 raise Exception("Division by zero")
-            return Fraction(eval_ast(left, lexical_scope, name_space) / eval_ast(right, lexical_scope, name_space))
+            return divide(a, b)
         case binary_operation("^", left, right):
-            return Fraction(eval_ast(left, lexical_scope, name_space) ** eval_ast(right, lexical_scope, name_space))
+            a = eval_ast(left, lexical_scope, name_space)
+            b = eval_ast(right, lexical_scope, name_space)
+            return power(a, b)
         case binary_operation("%", left, right):
-            return Fraction(eval_ast(left, lexical_scope, name_space) % eval_ast(right, lexical_scope, name_space))
+            a = eval_ast(left, lexical_scope, name_space)
+            b = eval_ast(right, lexical_scope, name_space)
+            return number(a % b)
         case binary_operation("//", left, right):
-            return Fraction(eval_ast(left, lexical_scope, name_space) // eval_ast(right, lexical_scope, name_space))
+            a = eval_ast(left, lexical_scope, name_space)
+            b = eval_ast(right, lexical_scope, name_space)
+            return a // b
 
         # Boolean Operations
         case binary_operation("==", left, right):
-            return bool(eval_ast(left, lexical_scope, name_space) == eval_ast(right, lexical_scope, name_space))
+            a = eval_ast(left, lexical_scope, name_space)
+            b = eval_ast(right, lexical_scope, name_space)
+            return bool(a == b)
         case binary_operation("!=", left, right):
-            return bool(eval_ast(left, lexical_scope, name_space) != eval_ast(right, lexical_scope, name_space))
+            a = eval_ast(left, lexical_scope, name_space)
+            b = eval_ast(right, lexical_scope, name_space)
+            return bool(a != b)
         case binary_operation("<", left, right):
-            return bool(eval_ast(left, lexical_scope, name_space) < eval_ast(right, lexical_scope, name_space))
+            a = eval_ast(left, lexical_scope, name_space)
+            b = eval_ast(right, lexical_scope, name_space)
+            return bool(a < b)
         case binary_operation(">", left, right):
-            return bool(eval_ast(left, lexical_scope, name_space) > eval_ast(right, lexical_scope, name_space))
+            a = eval_ast(left, lexical_scope, name_space)
+            b = eval_ast(right, lexical_scope, name_space)
+            return bool(a > b)
         case binary_operation("&&", left, right):
             return bool(eval_ast(left, lexical_scope, name_space) and eval_ast(right, lexical_scope, name_space))
         case binary_operation("||", left, right):
@@ -517,18 +1026,18 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
         case while_loop(condition, body):
             while eval_ast(condition, lexical_scope, name_space):
                 eval_ast(body, lexical_scope, name_space)
-            return Fraction(0)  # return value of while loop is always 0
+            return 0  # return value of while loop is always 0
 
         # Blocks
         # using scoping as used in c++, inside loops.
         case block(exps):
             # if value of declared variables is changed inside the block, it will be changed outside the block
             # if new variables are declared inside the block, they will not be accessible outside the block
-            name_space.start_scope()
+            name_space.start_block()
             for exp in exps:
                 eval_ast(exp, lexical_scope, name_space)
-            name_space.end_scope()
-            return Fraction(0)  # return value of block is always 0
+            name_space.end_block()
+            return 0  # return value of block is always 0
 
         # Unary Operations
         case unary_operation("!", condition):
@@ -557,17 +1066,21 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
             if (end == -1):
                 return str(final_string[begin::step])
             return str(final_string[begin:end:step])
+        case u_string_operation("buffer", string):
+            return buffered(eval_ast(string, lexical_scope, name_space))
+        case u_string_operation("text", string):
+            return unbuffered(eval_ast(string, lexical_scope, name_space))
 
         # For loops
         case for_loop(iterator, initial_value, condition, updation, body):
-            name_space.start_scope()
+            name_space.start_block()
             eval_ast(declare(iterator, initial_value),
                      lexical_scope, name_space)
             while eval_ast(condition, lexical_scope, name_space):
                 eval_ast(body, lexical_scope, name_space)
                 eval_ast(updation, lexical_scope, name_space)
-            name_space.end_scope()
-            return Fraction(0)
+            name_space.end_block()
+            return 0
 
         # Print statements
         case print_statement(expr_list):
@@ -580,26 +1093,51 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
             return return_val
 
         # Functions
-        case Function(identifier(name), parameters, body, return_exp):
-            name_space.add_to_scope(
-                name, FunctionObject(parameters, body, return_exp))
+        case Function(identifier() as name, parameters, body, return_exp, _, frame_size, pure):
+            level = 1 if name.level is None else name.level + 1
+            name_space.bind(name, FunctionObject(
+                parameters, body, return_exp, frame_size, level, pure))
             return 0
 
-        case FunctionCall(identifier(name), arguments):
-            function = name_space.get_from_scope(name)
+        case FunctionCall(identifier() as name, arguments):
+            function = name_space.lookup(name)
             argv = []
             for arg in arguments:
                 argv.append(eval_ast(arg, lexical_scope, name_space))
-            name_space.start_scope()
-            for parameter, arg in zip(function.parameters, argv):
-                name_space.add_to_scope(parameter.name, arg)
-            for exp in function.body.exps:
-                eval_ast(exp, lexical_scope, name_space)
-            return_value = eval_ast(
-                function.return_exp, lexical_scope, name_space)
-            name_space.end_scope()
+            memo = name_space.memo if function.pure else None
+            if memo is not None:
+                # every declaration of a pure function computes the same
+                # thing, so its body stands for it
+                key = memo.key(function.body, argv)
+                return_value = memo.get(key)
+                if return_value is not memo.missing:
+                    return return_value
+            saved = name_space.start_call(function)
+            while True:
+                for parameter, arg in zip(function.parameters, argv):
+                    name_space.bind(parameter, arg)
+                for exp in function.body.exps:
+                    eval_ast(exp, lexical_scope, name_space)
+                return_value = eval_ast(
+                    function.return_exp, lexical_scope, name_space)
+                if name_space.tail_call is None:
+                    break
+                # the call ended in a tail call: go round again in the same
+                # frame instead of recursing
+                argv = name_space.tail_call
+                name_space.tail_call = None
+                name_space.restart_call(function)
+            name_space.end_call(function, saved)
+            if memo is not None:
+                memo.put(key, return_value)
             return return_value
 
+        case TailCall(FunctionCall(_, arguments)):
+            # the arguments are all evaluated before any parameter changes
+            name_space.tail_call = [eval_ast(arg, lexical_scope, name_space)
+                                    for arg in arguments]
+            return 0
+
         case u_list_operation("self", left):
             return eval_ast(left, lexical_scope, name_space)
         case u_list_operation("head", l):
@@ -609,7 +1147,7 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
             return our_list[0]
         case u_list_operation("tail", l):
             our_list = eval_ast(l, lexical_scope, name_space)
-            return our_list[1:]
+            return list_tail(our_list)
         case u_list_operation("is_empty", l):
             our_list = eval_ast(l, lexical_scope, name_space)
             if (len(our_list) == 0):
@@ -618,12 +1156,11 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
 
         case b_list_operation("cons", left, l):
             our_list = eval_ast(l, lexical_scope, name_space)
-            output_list = []
             value = eval_ast(left, lexical_scope, name_space)
-            output_list.append(value)
-            for i in range(len(our_list)):
-                output_list.append(our_list[i])
-            # Might not be necessary as lists are mutable in python
+            output_list = list_cons(value, our_list)
+            # the variable holding the list now holds the longer one
+            if (isinstance(l, get)):
+                l = l.variable
             if (isinstance(l, identifier)):
                 eval_ast(update_list(l, output_list),
                          lexical_scope, name_space)
@@ -636,15 +1173,9 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
             # eval_ast(update_list(l, our_list), lexical_scope, name_space)
             return our_list
 
-        case u_dict_operation("keys", d):
+        case u_dict_operation("keys" | "values" | "items" as kind, d):
             our_dict = eval_ast(d, lexical_scope, name_space)
-            return list(our_dict.keys())
-        case u_dict_operation("values", d):
-            our_dict = eval_ast(d, lexical_scope, name_space)
-            return list(our_dict.values())
-        case u_dict_operation("items", d):
-            our_dict = eval_ast(d, lexical_scope, name_space)
-            return list(our_dict.items())
+            return dict_view(our_dict, kind)
         case b_dict_operation("delete", d, key):
             our_dict = eval_ast(d, lexical_scope, name_space)
             key = eval_ast(key, lexical_scope, name_space)
@@ -660,7 +1191,7 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
 
         case length(first):
             data_structure = eval_ast(first, lexical_scope, name_space)
-            if isinstance(data_structure, list | dict | str):
+            if isinstance(data_structure, list | ConsList | PackedList | DictView | StringBuffer | dict | str):
                 return len(data_structure)
             else:
                 raise Exception("Invalid type for length")
@@ -668,7 +1199,7 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
             data_structure = eval_ast(first, lexical_scope, name_space)
             index = eval_ast(second, lexical_scope, name_space)
             # Checking type of the datastructure
-            if isinstance(data_structure, list | str):
+            if isinstance(data_structure, list | ConsList | PackedList | DictView | StringBuffer | str):
                 index = int(index)
                 if (index >= len(data_structure)):
                     raise Exception("Index out of bounds")
@@ -684,27 +1215,23 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
             index = eval_ast(second, lexical_scope, name_space)
             value = eval_ast(third, lexical_scope, name_space)
             # Checking type of the datastructure
-            if isinstance(data_structure, list):
-                index = int(eval_ast(second, lexical_scope, name_space))
+            if isinstance(data_structure, list | ConsList | PackedList | DictView | StringBuffer):
+                index = int(index)
                 if (index >= len(data_structure)):
                     raise Exception("Index out of bounds")
-                value = eval_ast(third, lexical_scope, name_space)
                 data_structure[index] = value
                 # Might not be necessary
                 # eval_ast(update_list(first, data_structure), lexical_scope, name_space)
                 return data_structure
             elif isinstance(data_structure, dict):
-                index = eval_ast(second, lexical_scope, name_space)
-                value = eval_ast(third, lexical_scope, name_space)
                 data_structure[index] = value
                 # Might not be necessary
                 # eval_ast(update_dict(first, data_structure), lexical_scope, name_space)
                 return data_structure
             elif isinstance(data_structure, str):
-                index = int(eval_ast(second, lexical_scope, name_space))
+                index = int(index)
                 if (index >= len(data_structure)):
                     raise Exception("Index out of bounds")
-                value = eval_ast(third, lexical_scope, name_space)
                 data_structure = data_structure[:index] + \
                     str(value) + data_structure[index+1:]
                 if (isinstance(first, get)):
@@ -716,7 +1243,7 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
 
     # print(subprogram)
     ProgramNotSupported()
-    return Fraction(0)
+    return 0
 
 # Tests
 
@@ -804,6 +1331,33 @@ def test_dict():
 test_dict()
 
 
+def test_dict_view():
+    # keys, values and items read the dict until it changes
+    name_space = environment()
+    d = identifier.make("d")
+    eval_ast(declare(d, dict_literal([(string_literal("a"), numeric_literal(1)),
+                                      (string_literal("b"), numeric_literal(2))])),
+             None, name_space)
+    keys = eval_ast(u_dict_operation("keys", get(d)), None, name_space)
+    items = eval_ast(u_dict_operation("items", get(d)), None, name_space)
+    assert (type(keys) is DictView and keys.array is None)
+    assert (eval_ast(length(u_dict_operation("values", get(d))), None, name_space) == 2)
+    assert (keys == ["a", "b"] and keys.array is None)
+    eval_ast(put(get(d), string_literal("c"), numeric_literal(3)), None, name_space)
+    assert (keys.array == ["a", "b"] and len(keys) == 2)
+    assert (items == [("a", 1), ("b", 2)])
+    # indexing a view, or changing it, gives it its own list
+    values = eval_ast(u_dict_operation("values", get(d)), None, name_space)
+    assert (eval_ast(find(u_dict_operation("keys", get(d)), numeric_literal(2)),
+                     None, name_space) == "c")
+    values[0] = 10
+    assert (values == [10, 2, 3] and eval_ast(get(d), None, name_space)["a"] == 1)
+    eval_ast(b_dict_operation("delete", get(d), string_literal("a")), None, name_space)
+    assert (keys == ["a", "b"] and repr(values) == "[10, 2, 3]")
+    assert (eval_ast(u_dict_operation("keys", get(d)), None, name_space) == ["b", "c"])
+    assert (dict_view({"x": 1}, "items") == [("x", 1)])
+
+
 def test_list():
     name_space = environment()
     e1 = identifier.make("x")
@@ -846,6 +1400,107 @@ def test_list():
 test_list()
 
 
+def test_cons_list():
+    # cons and tail share the items of the list they are given
+    name_space = environment()
+    x = identifier.make("x")
+    eval_ast(declare(x, Lists([numeric_literal(1), numeric_literal(2)])),
+             None, name_space)
+    y = identifier.make("y")
+    eval_ast(declare(y, u_list_operation("tail", get(x))), None, name_space)
+    for i in range(3, 6):
+        eval_ast(b_list_operation("cons", numeric_literal(i), get(x)),
+                 None, name_space)
+    items = eval_ast(get(x), None, name_space)
+    assert (type(items) is ConsList and items.array is None)
+    assert (items == [5, 4, 3, 1, 2] and len(items) == 5)
+    assert (eval_ast(get(y), None, name_space) == [2])
+    tail = list_tail(items)
+    assert (tail.cells is items.cells[1] and tail == [4, 3, 1, 2])
+    assert (eval_ast(u_list_operation("head", get(x)), None, name_space) == 5)
+    # indexing and changing a list give it its own items again
+    eval_ast(put(get(x), numeric_literal(1), numeric_literal(0)), None, name_space)
+    assert (items.cells is None and items == [5, 0, 3, 1, 2])
+    assert (tail == [4, 3, 1, 2])
+    assert (eval_ast(find(get(x), numeric_literal(4)), None, name_space) == 2)
+    assert (len(list_tail(list_tail([1]))) == 0)
+    assert (list_tail([]) == [] and str(list_cons(1, [])) == "[1]")
+
+
+def test_packed_list():
+    # list(size, value) of integers and booleans packs its items
+    name_space = environment()
+    x = identifier.make("x")
+    eval_ast(declare(x, list_initializer(numeric_literal(4), numeric_literal(0))),
+             None, name_space)
+    items = eval_ast(get(x), None, name_space)
+    assert (type(items) is PackedList and type(items.items) is array)
+    eval_ast(put(get(x), numeric_literal(1), numeric_literal(7)), None, name_space)
+    assert (eval_ast(find(get(x), numeric_literal(1)), None, name_space) == 7)
+    assert (eval_ast(length(get(x)), None, name_space) == 4)
+    assert (items == [0, 7, 0, 0] and items.kind is int)
+    # anything else unpacks them
+    eval_ast(put(get(x), numeric_literal(2), numeric_literal(1, 2)), None, name_space)
+    assert (items.kind is None and items == [0, 7, Fraction(1, 2), 0])
+    flags = initial_list(3, False)
+    flags[1] = True
+    assert (type(flags.items) is bytearray and flags[1] is True and flags[0] is False)
+    flags.append(1)
+    assert (flags.kind is None and flags == [False, True, False, 1])
+    big = initial_list(2, 0)
+    big[0] = 2**63
+    assert (big.kind is None and big[0] == 2**63)
+    assert (initial_list(2, "a") == ["a", "a"] and str(initial_list(2, True)) == "[True, True]")
+
+
+def test_numbers():
+    # integral values are ints, everything else an exact Fraction
+    def value(op, a, b):
+        return eval_ast(binary_operation(op, a, b))
+    half = numeric_literal(1, 2)
+    assert (type(numeric_literal(4).value) is int)
+    assert (type(value("+", half, half)) is int)
+    assert (value("/", numeric_literal(7), numeric_literal(2)) == Fraction(7, 2))
+    assert (type(value("/", numeric_literal(8), numeric_literal(2))) is int)
+    assert (value("^", numeric_literal(9), half) == 3)
+    assert (type(value("^", numeric_literal(9), half)) is int)
+    assert (value("^", numeric_literal(2), numeric_literal(-2)) == Fraction(1, 4))
+    # integral and square roots of squares stay exact, however large
+    assert (type(value("^", numeric_literal(2), numeric_literal(100))) is int)
+    big = (10**200 + 1) ** 2
+    assert (value("^", numeric_literal(big), half) == 10**200 + 1)
+    assert (value("^", numeric_literal(9, 4), half) == Fraction(3, 2))
+    assert (value("^", numeric_literal(2), half) == Fraction(2 ** 0.5))
+    assert (value("%", numeric_literal(7, 2), numeric_literal(1)) == Fraction(1, 2))
+    assert (value("//", numeric_literal(7, 2), numeric_literal(1)) == 3)
+    assert (str(value("*", half, numeric_literal(3))) == "3/2")
+
+
+def test_single_evaluation():
+    # every call to f bumps count, so count tells how often operands ran
+    name_space = environment()
+    count = identifier.make("count")
+    x = identifier.make("x")
+    f = identifier.make("f")
+    eval_ast(declare(count, numeric_literal(0)), None, name_space)
+    eval_ast(Function(f, [x], block([set(count, binary_operation(
+        "+", get(count), numeric_literal(1)))]), get(x)), None, name_space)
+
+    def call(value):
+        return FunctionCall(f, [value])
+
+    for op in ["+", "-", "*", "/", "^", "%", "//", "==", "!=", "<", ">"]:
+        eval_ast(set(count, numeric_literal(0)), None, name_space)
+        eval_ast(binary_operation(op, call(numeric_literal(6)),
+                 call(numeric_literal(2))), None, name_space)
+        assert (eval_ast(get(count), None, name_space) == 2)
+
+    eval_ast(set(count, numeric_literal(0)), None, name_space)
+    assert (eval_ast(put(call(Lists([numeric_literal(1), numeric_literal(2)])),
+            call(numeric_literal(1)), call(numeric_literal(5))), None, name_space) == [1, 5])
+    assert (eval_ast(get(count), None, name_space) == 3)
+
+
 def test19():
     name_space = environment()
 
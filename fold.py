@@ -0,0 +1,170 @@
+import builtins
+from typing import Set
+from eval import *
+
+
+# Constant folding over a resolved AST (see resolver.resolve), run before the
+# program is handed to any of the engines:
+#
+#   - binary and unary operations and string concatenations whose operands
+#     are all literals are computed once, with eval_ast so they mean exactly
+#     what they would have meant at run time; anything that fails (division
+#     by zero, adding a string to a number) is left for run time to report
+#   - variables declared with a literal value and never assigned again are
+#     replaced by that literal wherever they are read
+#   - ifs on a literal condition are replaced by the branch taken
+#
+# The declarations of propagated constants stay, so every engine still finds
+# the variable where the resolver put it.
+
+literals = numeric_literal | bool_literal | string_literal
+
+
+def literal(value) -> Optional[AST]:
+    match value:
+        case bool():
+            return bool_literal(value)
+        case int() | Fraction():
+            return numeric_literal(value)
+        case str():
+            return string_literal(value)
+    return None
+
+
+def evaluated(program: AST) -> AST:
+    # program, whose operands are all literals, as a literal if possible
+    try:
+        value = literal(eval_ast(program))
+    except Exception:
+        return program
+    return program if value is None else value
+
+
+def subtrees(program):
+    # program and every node below it
+    if isinstance(program, list | tuple):
+        for item in program:
+            yield from subtrees(item)
+    elif hasattr(program, "__dataclass_fields__"):
+        yield program
+        for name in program.__dataclass_fields__:
+            yield from subtrees(getattr(program, name))
+
+
+def id_set(ids=()) -> Set[int]:
+    # a set of variable ids, for the passes: eval's set, the assignment node,
+    # hides the builtin one
+    return builtins.set(ids)
+
+
+def assigned(program) -> Set[int]:
+    # the ids of the variables program changes after declaring them
+    ids = id_set()
+    for node in subtrees(program):
+        match node:
+            case set(variable, _):
+                ids.add(variable.id)
+            case put(get(variable), _, _):
+                # putting into a string stores a new string in the variable
+                ids.add(variable.id)
+            case b_list_operation("cons", _, get(variable) | (identifier() as variable)):
+                ids.add(variable.id)
+            case update_list(variable) | update_dict(variable):
+                ids.add(variable.id)
+            case update_string(get(variable)):
+                ids.add(variable.id)
+            case for_loop(iterator):
+                ids.add(iterator.id)
+    return ids
+
+
+def fold(program: AST) -> AST:
+    return do_fold(program, assigned(program), {})
+
+
+def do_fold(program: AST, changed: Set[int], constants: dict) -> AST:
+    # constants maps the ids of the variables found to be constant to their
+    # literal value
+    def fold_(program):
+        return do_fold(program, changed, constants)
+
+    match program:
+        case numeric_literal() | bool_literal() | string_literal() | Null():
+            return program
+        case input_statement() | dict_literal() | identifier() | let_var():
+            return program
+
+        case get(variable):
+            if variable.id in constants:
+                return constants[variable.id]
+            return program
+        case declare(variable, value):
+            value = fold_(value)
+            if isinstance(value, literals) and variable.id not in changed:
+                constants[variable.id] = value
+            return declare(variable, value)
+        case set(variable, value):
+            return set(variable, fold_(value))
+        case let(variable, e1, e2):
+            return let(variable, fold_(e1), fold_(e2))
+
+        case binary_operation(op, left, right):
+            program = binary_operation(op, fold_(left), fold_(right))
+            if isinstance(program.left, literals) and isinstance(program.right, literals):
+                return evaluated(program)
+            return program
+        case unary_operation(op, operand):
+            program = unary_operation(op, fold_(operand))
+            if isinstance(program.operand, literals):
+                return evaluated(program)
+            return program
+        case string_concat(operands):
+            program = string_concat([fold_(e) for e in operands])
+            if all(isinstance(e, literals) for e in program.operands):
+                return evaluated(program)
+            return program
+        case string_slice(string, start, stop, hop):
+            return string_slice(fold_(string), fold_(start), fold_(stop), fold_(hop))
+
+        case if_statement(condition, if_exp, else_exp):
+            condition = fold_(condition)
+            if isinstance(condition, literals):
+                return fold_(if_exp if condition.value else else_exp)
+            return if_statement(condition, fold_(if_exp), fold_(else_exp))
+        case while_loop(condition, body):
+            return while_loop(fold_(condition), fold_(body))
+        case for_loop(iterator, initial_value, condition, updation, body):
+            return for_loop(iterator, fold_(initial_value), fold_(condition),
+                            fold_(updation), fold_(body))
+        case block(exps):
+            return block([fold_(e) for e in exps])
+        case print_statement(exps):
+            return print_statement([fold_(e) for e in exps])
+
+        case Function(name, parameters, body, return_exp, _, frame_size):
+            return Function(name, parameters, fold_(body), fold_(return_exp),
+                            frame_size=frame_size)
+        case FunctionCall(fn, arguments):
+            return FunctionCall(fn, [fold_(e) for e in arguments])
+
+        case Lists(value):
+            return Lists([fold_(e) for e in value])
+        case list_initializer(size, value):
+            return list_initializer(fold_(size), fold_(value))
+        case u_list_operation(op, l):
+            return u_list_operation(op, fold_(l))
+        case b_list_operation(op, left, l):
+            # cons stores into l when it is a variable, so that stays as it is
+            return b_list_operation(op, fold_(left),
+                                    l if isinstance(l, identifier | get) else fold_(l))
+        case u_dict_operation(op, d):
+            return u_dict_operation(op, fold_(d))
+        case b_dict_operation(op, d, key):
+            return b_dict_operation(op, fold_(d), fold_(key))
+        case length(e):
+            return length(fold_(e))
+        case find(e, index):
+            return find(fold_(e), fold_(index))
+        case put(e, index, value):
+            return put(fold_(e), fold_(index), fold_(value))
+    return program
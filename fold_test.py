@@ -0,0 +1,53 @@
+from eval import (numeric_literal, string_literal, string_concat, block,
+                  print_statement, binary_operation, get)
+from fold import fold
+from testing import parse, run_all
+
+
+def test1_folding(capsys):
+    source = """{
+        var half = 1/2;
+        var x = half * 4 + 2 ^ 3;
+        var s = "ab";
+        if (x > 9) { print s, x; } else { print 1/0; }
+        var y = -x;
+        print y;
+    }"""
+    folded = fold(parse(source))
+    declarations = folded.exps[:3]
+    assert [d.value for d in declarations] == [
+        numeric_literal(1, 2), numeric_literal(10), string_literal("ab")]
+    # the if is gone, and its branch prints the constants themselves
+    assert folded.exps[3] == block([print_statement(
+        [string_literal("ab"), numeric_literal(10)])])
+    assert folded.exps[4].value == numeric_literal(-10)
+    assert run_all(folded, capsys) == run_all(parse(source), capsys)
+
+    assert fold(string_concat([string_literal("a"), string_literal("b")])) == \
+        string_literal("ab")
+
+
+def test2_notFolded(capsys):
+    source = """{
+        var n = 3;
+        var k = 2;
+        var s = "abc";
+        s[0] = "x";
+        var i = 0;
+        while (i < n) {
+            k = k * 2;
+            i = i + 1;
+        }
+        if (i > 100) { print 1/0, "a" + 1; }
+        print n, k, s;
+    }"""
+    folded = fold(parse(source))
+    # n is never changed, k and s are
+    loop = folded.exps[5]
+    assert loop.condition.right == numeric_literal(3)
+    assert isinstance(loop.body.exps[0].value.left, get)
+    assert folded.exps[3].operand == get(folded.exps[2].variable)
+    # failing operations are left to fail at run time
+    print_exps = folded.exps[6].if_exp.exps[0].exps
+    assert all(isinstance(e, binary_operation) for e in print_exps)
+    assert run_all(folded, capsys) == run_all(parse(source), capsys) == "3 16 xbc \n"
@@ -0,0 +1,257 @@
+import copy
+from typing import Set
+from eval import *
+from fold import subtrees, assigned, id_set
+
+
+# Loop-invariant code motion over a resolved AST (see resolver.resolve), run
+# after constant folding. Expressions in a while or for loop that compute
+# the same value on every iteration are computed once, into a new variable,
+# before the loop:
+#
+#   - from the condition, those it evaluates every time (not the right hand
+#     side of an and/or), just before the loop
+#   - from the body, those it evaluates on every iteration (not inside ifs,
+#     the right hand side of an and/or or the body of a nested loop), before
+#     the loop as well, but only if the condition holds on entry, so that a
+#     loop that never runs doesn't evaluate them either
+#
+# An expression is invariant when it is made of literals, arithmetic,
+# comparisons and variables the loop doesn't declare or change, nor any
+# function it calls: a loop that calls functions can only rely on variables
+# that no function changes outside its own locals. length and lookups also
+# need the loop to change no list or dict in place. The new variables get
+# slots after the ones the resolver gave out.
+#
+# Moving an expression that can fail (a division, remainder or power, a
+# lookup) ahead of the code that ran before it would raise its error before
+# that code had its effects. So none are hoisted from the body, and from the
+# condition only when nothing else the loop runs before it, the rest of the
+# condition and the initial value of a for loop's iterator, can fail or have
+# an effect either.
+
+arithmetic = ("+", "-", "*", "/", "^", "%", "//", "<", ">", "<=", ">=", "==", "!=")
+failing = ("/", "^", "%", "//")  # can fail on numbers: by zero, no exact root
+
+
+class Frame:
+    # where new variables go: the function being optimized, or the top level
+    def __init__(self, level: int, slots: int, shared: Set[int],
+                 function: Optional[Function] = None):
+        self.level = level
+        self.slots = slots
+        self.shared = shared
+        self.function = function
+
+    def variable(self) -> identifier:
+        v = identifier.make(f"_invariant{self.slots}")
+        v.level = self.level
+        v.slot = self.slots
+        self.slots += 1
+        if self.function is not None:
+            self.function.frame_size = self.slots
+        return v
+
+
+def hoist(program: AST) -> AST:
+    # hoists out of the loops of program, in place, and returns it
+    slots = max((v.slot + 1 for v in subtrees(program)
+                 if isinstance(v, identifier) and v.level == 0 and v.slot is not None),
+                default=0)
+    return do_hoist(program, Frame(0, slots, shared(program)))
+
+
+def shared(program: AST) -> Set[int]:
+    # the ids of the variables functions change outside their own locals
+    ids = id_set()
+    for node in subtrees(program):
+        if isinstance(node, Function):
+            level = 1 if node.name.level is None else node.name.level + 1
+            changed = assigned(node.body)
+            ids |= {v.id for v in subtrees(node.body) if isinstance(v, identifier)
+                    and v.id in changed and v.level != level}
+    return ids
+
+
+def do_hoist(program: AST, frame: Frame) -> AST:
+    match program:
+        case block(exps):
+            program.exps = [do_hoist(e, frame) for e in exps]
+        case if_statement(_, if_exp, else_exp):
+            program.if_exp = do_hoist(if_exp, frame)
+            program.else_exp = do_hoist(else_exp, frame)
+        case Function(name, _, body):
+            level = 1 if name.level is None else name.level + 1
+            program.body = do_hoist(body, Frame(level, program.frame_size,
+                                                frame.shared, program))
+        case while_loop(_, body) | for_loop(_, _, _, _, body):
+            # inner loops first, so what they hoist can move further out
+            program.body = do_hoist(body, frame)
+            return hoist_loop(program, frame)
+    return program
+
+
+def hoist_loop(loop, frame: Frame) -> AST:
+    nodes = list(subtrees(loop))
+    changed = assigned(loop) | {node.variable.id for node in nodes
+                                if isinstance(node, declare)}
+    calls = any(isinstance(node, FunctionCall | input_statement) for node in nodes)
+    mutates = calls or any(isinstance(node, put | update_list | update_dict)
+                           or (isinstance(node, b_list_operation) and node.operator == "append")
+                           or (isinstance(node, b_dict_operation) and node.operator == "delete")
+                           for node in nodes)
+
+    def invariant(e) -> bool:
+        match e:
+            case numeric_literal() | bool_literal() | string_literal():
+                return True
+            case get(v):
+                return (v.slot is not None and v.id not in changed
+                        and not (calls and v.id in frame.shared))
+            case binary_operation(op, left, right) if op in arithmetic:
+                return invariant(left) and invariant(right)
+            case unary_operation("-" | "!", operand):
+                return invariant(operand)
+            case length(x) if not mutates:
+                return invariant(x)
+            case find(x, key) if not mutates:
+                return invariant(x) and invariant(key)
+        return False
+
+    hoisted = []  # (expression, variable)
+    hoisting_failing = False  # whether what can fail may be hoisted
+
+    def quiet(e) -> bool:
+        # whether e can't fail or have an effect, but for its invariant
+        # subexpressions
+        if invariant(e):
+            return True
+        match e:
+            case binary_operation(op, left, right) if op in arithmetic:
+                return op not in failing and quiet(left) and quiet(right)
+            case binary_operation("and" | "&&" | "or" | "||", left, right):
+                return quiet(left) and quiet(right)
+            case unary_operation("-" | "!", operand) | length(operand):
+                return quiet(operand)
+        return not can_fail(e)
+
+    def replace(e):
+        # e with its invariant subexpressions read from new variables
+        if (invariant(e) and not isinstance(e, literals | get)
+                and (hoisting_failing or not can_fail(e))):
+            for expression, variable in hoisted:
+                if expression == e:
+                    return get(variable)
+            variable = frame.variable()
+            hoisted.append((e, variable))
+            return get(variable)
+        match e:
+            case binary_operation("and" | "&&" | "or" | "||", left, _):
+                # the right hand side isn't always evaluated
+                e.left = replace(left)
+            case binary_operation(_, left, right):
+                e.left = replace(left)
+                e.right = replace(right)
+            case unary_operation(_, operand):
+                e.operand = replace(operand)
+            case length(x):
+                e.operand = replace(x)
+            case find(x, key):
+                e.operand = replace(x)
+                e.key = replace(key)
+            case FunctionCall(_, arguments):
+                e.arguments = [replace(a) for a in arguments]
+            case print_statement(exps) | block(exps):
+                e.exps = [replace(x) for x in exps]
+            case declare(_, value) | set(_, value):
+                e.value = replace(value)
+            case if_statement(condition) | while_loop(condition):
+                e.condition = replace(condition)
+        return e
+
+    hoisting_failing = quiet(loop.condition) and not (
+        isinstance(loop, for_loop) and can_fail(loop.initial_value))
+    loop.condition = replace(loop.condition)
+    hoisting_failing = False
+    before = [declare(variable, e) for e, variable in hoisted]
+    # the body's invariants are only computed if the loop is entered: the
+    # condition, with the initial value for the iterator of a for loop, is
+    # tested once more before it
+    entry = copied(loop.condition)
+    if isinstance(loop, for_loop) and entry is not None:
+        if copied(loop.initial_value) is None:
+            entry = None
+        else:
+            entry = substituted(entry, loop.iterator, loop.initial_value)
+    if entry is not None and not any(isinstance(node, FunctionCall | input_statement)
+                                     for node in subtrees(entry)):
+        hoisted.clear()
+        loop.body = replace(loop.body)
+        if hoisted:
+            before.append(if_statement(entry, block(
+                [declare(variable, e) for e, variable in hoisted]), block([Null()])))
+    if not before:
+        return loop
+    return block(before + [loop])
+
+
+literals = numeric_literal | bool_literal | string_literal
+
+
+def can_fail(e) -> bool:
+    # whether evaluating e can raise an error or have an effect, given
+    # operands of the right types
+    match e:
+        case binary_operation(op, left, right) if op in arithmetic:
+            return op in failing or can_fail(left) or can_fail(right)
+        case binary_operation("and" | "&&" | "or" | "||", left, right):
+            return can_fail(left) or can_fail(right)
+        case unary_operation("-" | "!", operand) | length(operand):
+            return can_fail(operand)
+        case numeric_literal() | bool_literal() | string_literal() | get():
+            return False
+    return True
+
+
+def copied(e):
+    # a copy of the expression e, sharing no node with it, or None if it is
+    # more than literals, variables, operations, lengths and lookups
+    match e:
+        case binary_operation(op, left, right):
+            left, right = copied(left), copied(right)
+            if left is None or right is None:
+                return None
+            return binary_operation(op, left, right)
+        case unary_operation(op, operand):
+            operand = copied(operand)
+            return None if operand is None else unary_operation(op, operand)
+        case length(x):
+            x = copied(x)
+            return None if x is None else length(x)
+        case find(x, key):
+            x, key = copied(x), copied(key)
+            if x is None or key is None:
+                return None
+            return find(x, key)
+        case numeric_literal() | bool_literal() | string_literal():
+            return copy.copy(e)
+        case get(v):
+            return get(v)
+    return None
+
+
+def substituted(e, variable: identifier, value):
+    # e, a copy, with a copy of value, which copied must accept, in place of
+    # variable
+    match e:
+        case get(v) if v.id == variable.id:
+            return copied(value)
+        case binary_operation(_, left, right):
+            e.left = substituted(left, variable, value)
+            e.right = substituted(right, variable, value)
+        case unary_operation(_, operand) | length(operand):
+            e.operand = substituted(operand, variable, value)
+        case find(x, key):
+            e.operand = substituted(x, variable, value)
+            e.key = substituted(key, variable, value)
+    return e
@@ -0,0 +1,167 @@
+from eval import (eval_ast, frame_environment, block, declare, get, for_loop,
+                  while_loop, if_statement, binary_operation, numeric_literal)
+from fold import fold, subtrees
+from hoisting import hoist
+import bytecode
+import closures
+import registers
+from testing import parse, run_all
+
+
+def test1_hoisting(capsys):
+    source = """{
+        def isprime(n) {
+            var flag = 1;
+            var sqrt = 1/2;
+            for (i = 2; i < n^sqrt+1; i = i + 1) {
+                if (n % i == 0) { flag = 0; }
+            }
+            return flag;
+        }
+        var l = [3, 1, 4, 1, 5];
+        var k = l[2];
+        var total = 0;
+        var j = 0;
+        while (j < l.length) {
+            var square = k * k;
+            total = total + l[j] * square;
+            j = j + 1;
+        }
+        var count = 0;
+        for (p = 2; p < 30; p = p + 1) {
+            var y = isprime(p);
+            count = count + y;
+        }
+        print total, count;
+    }"""
+    program = hoist(fold(parse(source)))
+    isprime = program.exps[0]
+    loop = isprime.body.exps[2]
+    # n^(1/2)+1 is worked out once, into a slot after the function's own
+    match loop:
+        case block([declare(variable, binary_operation("+")),
+                    for_loop(condition=binary_operation("<", _, get(v)))]):
+            assert v.id == variable.id and v.slot == isprime.frame_size - 1
+        case _:
+            assert False, loop
+    # the length in the condition, and k * k from the body, under a test that
+    # the loop runs at all
+    match program.exps[5]:
+        case block([declare(_, length), if_statement(_, block([declare(_, square)])),
+                    while_loop()]):
+            assert length.operand.variable.name == "l"
+            assert square.operator == "*"
+        case other:
+            assert False, other
+    assert run_all(program, capsys).split() == ["224", "9"]
+
+    # the hoisted condition still compiles to a counted loop
+    code = bytecode.compile(program)
+    assert any(isinstance(insn, bytecode.I.INC_LOCAL) for insn in code.insns)
+
+
+def test2_notHoisted(capsys):
+    source = """{
+        var g = 2;
+        def bump(n) {
+            g = g + n;
+            return n;
+        }
+        var l = [1, 2, 3];
+        var i = 0;
+        while (i < l.length) {
+            if (i == 0) { l.append(4); }
+            i = i + 1;
+        }
+        var total = 0;
+        for (j = 0; j < 3; j = j + 1) {
+            var b = bump(1);
+            total = total + g * 10;
+        }
+        var n = 5;
+        var m = 0;
+        while (m < 3) {
+            var s = n * 2;
+            n = n + 1;
+            m = m + s;
+        }
+        var never = 0;
+        while (never > 0) {
+            print 1/never;
+        }
+        print i, total, m;
+    }"""
+    program = hoist(fold(parse(source)))
+    # not the length of a list the loop appends to, nor g, which the
+    # function the loop calls changes, nor n * 2, as n changes, nor 1/never,
+    # which can fail
+    hoisted = [node for node in subtrees(program)
+               if isinstance(node, declare) and node.variable.name.startswith("_invariant")]
+    assert hoisted == []
+    assert run_all(program, capsys).split() == ["4", "120", "10"]
+
+
+def test3_failsInOrder(capsys):
+    # an invariant that fails still fails only after what ran before it
+    sources = ["""{
+        var d = 0;
+        var i = 0;
+        while (i < 3) {
+            print i;
+            var q = 5 / d;
+            i = i + 1;
+        }
+    }""", """{
+        var l = [1, 2];
+        var k = 5;
+        for (i = 0; i < 3; i = i + 1) {
+            print i;
+            var x = l[k];
+        }
+    }"""]
+    for source in sources:
+        program = hoist(fold(parse(source)))
+        assert not any(isinstance(node, declare) and node.variable.name.startswith("_invariant")
+                       for node in subtrees(program))
+        vm = bytecode.VM()
+        vm.load(bytecode.compile(program))
+        register_vm = registers.RegisterVM()
+        register_vm.load(registers.compile(program))
+        for run in (lambda: eval_ast(program, None, frame_environment()),
+                    closures.compile(program).run, vm.execute, register_vm.execute):
+            try:
+                run()
+            except Exception:
+                pass
+            else:
+                assert False, source
+            assert capsys.readouterr().out.split() == ["0"]
+
+
+def test4_noSharedNodes(capsys):
+    # the test that the loop runs at all is made of copies, so a later pass
+    # changing the loop in place doesn't change it too
+    source = """{
+        def same(x) {
+            return x;
+        }
+        var k = 0;
+        k = 2;
+        var total = 0;
+        for (i = k + 1; i < 5; i = i + 1) {
+            total = total + k * 3;
+        }
+        for (j = same(1); j < 3; j = j + 1) {
+            total = total + k * 4;
+        }
+        print total;
+    }"""
+    program = hoist(fold(parse(source)))
+    nodes = [node for node in subtrees(program)
+             if isinstance(node, binary_operation | numeric_literal | get)]
+    assert len({id(node) for node in nodes}) == len(nodes)
+    # k * 3 is hoisted under a test that i = k + 1 is below 5; the initial
+    # value same(1) can't be copied into a test, so k * 4 stays in its loop
+    tests = [node for node in subtrees(program) if isinstance(node, if_statement)]
+    assert len(tests) == 1 and tests[0].condition.left.left.variable.name == "k"
+    assert run_all(program, capsys).split() == ["28"]
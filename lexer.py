@@ -1,5 +1,9 @@
 from dataclasses import dataclass
 from typing import Union
+from bisect import bisect_left
+from operator import attrgetter
+from sys import intern
+import re
 
 
 class EndOfTokens(Exception):
@@ -61,67 +65,113 @@ class Stream:
         else:
             self.column -= 1
 
+    def position(self, offset: int) -> tuple[int, int]:
+        # line and column of an offset, looked up in a table of newline
+        # offsets that is only built the first time a position is needed
+        newlines = self.__dict__.get("newlines")
+        if newlines is None:
+            newlines = [m.start() for m in re.finditer("\n", self.source)]
+            self.__dict__["newlines"] = newlines
+        line = bisect_left(newlines, offset)
+        line_start = newlines[line - 1] + 1 if line > 0 else 0
+        return line + 1, offset - line_start + 1
+
 # The different types of tokens
+#
+# Tokens are small __slots__ objects holding a single value and an integer
+# kind code. Each token class keeps the field name it had as a dataclass
+# (Num.n, Identifier.word, ...) so the parser can keep matching on them.
 
+NUM, KEYWORD, IDENTIFIER, STRING, OPERATOR, END_OF_LINE, FUNCTION_NAME, NULL, BOOL_VALUE = range(9)
 
-@dataclass
-class Num:
-    n: int
 
+class Token:
+    __slots__ = ("value",)
+    __match_args__ = ("value",)
+    kind = -1
+    field = "value"
 
-@dataclass
-class Keyword:
-    word: str
+    def __init__(self, value):
+        self.value = value
 
+    def __eq__(self, other):
+        return type(other) is type(self) and other.value == self.value
 
-@dataclass
-class Identifier:
-    word: str
+    def __hash__(self):
+        return hash((self.kind, self.value))
 
+    def __repr__(self):
+        return f"{type(self).__name__}({self.field}={self.value!r})"
 
-@dataclass
-class String:
-    s: str
 
+class Num(Token):
+    __slots__ = ()
+    kind = NUM
+    field = "n"
+    n = property(attrgetter("value"))
 
-@dataclass
-class Operator:
-    op: str
 
+class Keyword(Token):
+    __slots__ = ()
+    kind = KEYWORD
+    field = "word"
+    word = property(attrgetter("value"))
 
-@dataclass
-class EndOfLine:
-    EOL: str
 
+class Identifier(Token):
+    __slots__ = ()
+    kind = IDENTIFIER
+    field = "word"
+    word = property(attrgetter("value"))
 
-@dataclass
-class functionName:
-    name: str
 
+class String(Token):
+    __slots__ = ()
+    kind = STRING
+    field = "s"
+    s = property(attrgetter("value"))
 
-@dataclass
-class null:
-    name: str
 
+class Operator(Token):
+    __slots__ = ()
+    kind = OPERATOR
+    field = "op"
+    op = property(attrgetter("value"))
 
-@dataclass
-class boolValue:
-    name: str
 
+class EndOfLine(Token):
+    __slots__ = ()
+    kind = END_OF_LINE
+    field = "EOL"
+    EOL = property(attrgetter("value"))
 
-TokenType = Num | Keyword | Identifier | Operator | EndOfLine | String | functionName | null | boolValue
-keywords = "pass def print var True False if else then for while return end do let in pass def print var True False if else then for while return end do List let in head tail cons length delete keys values items list append iskey input".split()
 
+class functionName(Token):
+    __slots__ = ()
+    kind = FUNCTION_NAME
+    field = "name"
+    name = property(attrgetter("value"))
+
+
+class null(Token):
+    __slots__ = ()
+    kind = NULL
+    field = "name"
+    name = property(attrgetter("value"))
 
-@dataclass
-class boolValue:
-    name: str
+
+class boolValue(Token):
+    __slots__ = ()
+    kind = BOOL_VALUE
+    field = "name"
+    name = property(attrgetter("value"))
 
 
 TokenType = Num | Keyword | Identifier | Operator | EndOfLine | String | functionName | null | boolValue
-keywords = "pass def print var True False if else then for while return end do let in pass def print var True False if else then for while return end do List let in head tail cons length delete keys values items list append iskey input".split()
-operators = ", . ; + - * % > < / >= <= == ! != ** ^ ( ) [ ] = and or not } ;; { :".split(
-)
+keywords = frozenset(
+    "pass def print var True False if else then for while return end do List let in head tail cons length delete keys values items list append iskey input".split())
+operators = frozenset(
+    ", . ; + - * % > < / >= <= == ! != ** ^ ( ) [ ] = and or not } ;; { :".split())
 white_space = " \t\n"
 
 
@@ -160,7 +210,7 @@ class lexer:
                     self.stream.prev_char()
                     if word in keywords:
                         return Keyword(word)
-                    return functionName(word)
+                    return functionName(intern(word))
 
                 else:
                     self.stream.prev_char()
@@ -176,7 +226,7 @@ class lexer:
                     elif word in operators:
                         return Operator(word)
                     else:
-                        return Identifier(word)
+                        return Identifier(intern(word))
             except EndOfTokens:
                 if word in keywords:
                     if word == "pass":
@@ -190,7 +240,7 @@ class lexer:
                 elif word in operators:
                     return Operator(word)
                 else:
-                    return Identifier(word)
+                    return Identifier(intern(word))
 
     def string(self) -> String:
         s = ""
@@ -326,6 +376,141 @@ class lexer:
         except EndOfTokens:
             raise StopIteration
 
+
+# Scans the whole source in one forward pass. Lexemes are sliced out of the
+# source instead of being built one character at a time, and line/column
+# numbers are only worked out (from Stream.position) when an error needs them.
+token_pattern = re.compile(r"""
+    (?P<space>[ \t\n]+)
+  | (?P<number>\d+)
+  | (?P<word>[^\W\d]\w*)
+  | "(?P<string>[^"]*)"
+  | (?P<operator>==|!=|>=|<=|\^\^|//|[,.;+\-*%><!/^()\[\]=}{:])
+""", re.VERBOSE)
+
+# operators the character lexer may extend with a second character; if one of
+# these is the last character of the source, that lexer stops there
+two_char_starts = "=!<>^/"
+
+
+# Tokens are never mutated, so every occurrence of an operator shares one
+# Operator instance, and every occurrence of a word shares one token whose
+# string is interned.
+operator_tokens = {op: Operator(op) for op in operators | {"//"}}
+operator_tokens["^^"] = operator_tokens["**"]
+end_of_line = EndOfLine("EndOfLine")
+
+
+@dataclass
+class bufferedLexer:
+    stream: Stream = None
+    tokens: list = None
+    offsets: list = None
+    index: int = 0
+    error: int = -1
+
+    def lexerFromStream(s):
+        self = bufferedLexer(s)
+        self.tokenize()
+        return self
+
+    def word(self, word: str, call: bool) -> TokenType:
+        word = intern(word)
+        if call:
+            if word in keywords:
+                return Keyword(word)
+            return functionName(word)
+        if word in keywords:
+            if word == "pass":
+                return null(word)
+            elif word == "True" or word == "False":
+                return boolValue(word)
+            return Keyword(word)
+        elif word in operators:
+            return operator_tokens[word]
+        return Identifier(word)
+
+    def tokenize(self):
+        source = self.stream.source
+        end = len(source)
+        match_token = token_pattern.match
+        words = {}
+        calls = {}
+        tokens = []
+        offsets = []
+        pos = 0
+        while pos < end:
+            m = match_token(source, pos)
+            if m is None:
+                # an unterminated string runs to the end of the source,
+                # anything else is an invalid character
+                if source[pos] != '"':
+                    self.error = pos
+                break
+            kind = m.lastgroup
+            start = pos
+            pos = m.end()
+            if kind == "space":
+                continue
+            elif kind == "word":
+                word = m.group(kind)
+                if pos < end and source[pos] == "(":
+                    token = calls.get(word)
+                    if token is None:
+                        token = calls[word] = self.word(word, True)
+                else:
+                    token = words.get(word)
+                    if token is None:
+                        token = words[word] = self.word(word, False)
+            elif kind == "operator":
+                op = m.group(kind)
+                if pos == end and op in two_char_starts:
+                    break
+                token = operator_tokens[op]
+            elif kind == "number":
+                token = Num(int(m.group(kind)))
+            else:
+                token = String(m.group(kind))
+            tokens.append(token)
+            offsets.append(start)
+        tokens.append(end_of_line)
+        offsets.append(pos)
+        self.tokens = tokens
+        self.offsets = offsets
+        self.index = 0
+
+    def position(self) -> tuple[int, int]:
+        return self.stream.position(self.offsets[self.index])
+
+    def next_token(self) -> TokenType:
+        token = self.peek_token()
+        if self.index < len(self.tokens) - 1:
+            self.index += 1
+        return token
+
+    def peek_token(self) -> TokenType:
+        if self.index == len(self.tokens) - 1 and self.error >= 0:
+            line, column = self.stream.position(self.error)
+            raise TokenError("Invalid token", line, column)
+        return self.tokens[self.index]
+
+    def advance(self):
+        if self.index < len(self.tokens) - 1:
+            self.index += 1
+
+    def match(self, expected):
+        if self.peek_token() == expected:
+            return self.advance()
+        line, column = self.position()
+        raise TokenError(f"Expected {expected}", line, column)
+
+    def __iter__(self):
+        while True:
+            token = self.next_token()
+            yield token
+            if isinstance(token, EndOfLine):
+                return
+
 # ifelse
 
 
@@ -0,0 +1,59 @@
+from lexer import *
+
+
+def tokens_of(lexer_class, string):
+    l = lexer_class.lexerFromStream(Stream.streamFromString(string))
+    tokens = []
+    while True:
+        token = l.peek_token()
+        tokens.append(token)
+        if isinstance(token, EndOfLine):
+            return tokens
+        l.advance()
+
+
+def test1_bufferedLexer():
+    programs = [
+        "if 22 >= 33 then 5+3 else 8*3 end;",
+        "{var total = False; for( i = 1 ; i < 1001 ; i = i + 1; ) do {if i%3 == 0 or i%5==0 then {total = total + i;} else {pass;} end;;} end;}",
+        "def sumofsquares(n){val = n * (n + 1) * (2 * n + 1) / 6; return val;}",
+        'var s = "hello world"; s[0] = "j"; print s.length, a ^^ 2 // 3 != 4;',
+        "def 1dhairya_bhai_69(a, b){ return a + b; }",
+        "x =",
+    ]
+    for program in programs:
+        assert tokens_of(bufferedLexer, program) == tokens_of(lexer, program)
+
+
+def test2_bufferedLexer_positions():
+    s = Stream.streamFromString("var a = 1;\n\n  print a $ 2;")
+    assert s.position(0) == (1, 1)
+    assert s.position(4) == (1, 5)
+    assert s.position(11) == (2, 1)
+    assert s.position(14) == (3, 3)
+
+    l = bufferedLexer.lexerFromStream(s)
+    for i in range(6):
+        l.advance()
+    assert l.peek_token() == Identifier("a")
+    try:
+        l.advance()
+        l.peek_token()
+        assert False
+    except TokenError as e:
+        assert (e.line, e.column) == (3, 11)
+
+
+def test3_compact_tokens():
+    assert Identifier("a") == Identifier("a")
+    assert Identifier("a") != Keyword("a")
+    assert Num(3).n == 3 and Num(3).kind == NUM
+    assert repr(Operator("+")) == "Operator(op='+')"
+    match Keyword("let"):
+        case Keyword(word):
+            assert word == "let"
+
+    tokens = tokens_of(bufferedLexer, "var total = 0; total = total + 1;")
+    assert tokens[1] is tokens[5] and tokens[5] is tokens[7]
+    assert tokens[2] is tokens[6]
+    assert tokens[1].word is intern("total")
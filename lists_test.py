@@ -0,0 +1,79 @@
+from array import array
+from fractions import Fraction
+from eval import initial_list
+from testing import parse, run_all
+
+
+def test1_consTail(capsys):
+    source = """{
+        var s = "abc";
+        var t = s.tail;
+        var same = t == "bc";
+        var u = t + "x";
+        print t, same, u;
+        var l = [1, 2, 3];
+        l.cons(0);
+        print l;
+        var r = l.tail;
+        r[0] = 9;
+        print l, r;
+        r.append(7);
+        var q = r.tail;
+        q.append(8);
+        print l, r, q;
+    }"""
+    # the tail of a string is a string; cons stores the new list in the
+    # variable, and a tail is a list of its own, whatever is done to it
+    assert run_all(parse(source), capsys).split() == [
+        "bc", "True", "bcx",
+        "[0,", "1,", "2,", "3]",
+        "[0,", "1,", "2,", "3]", "[9,", "2,", "3]",
+        "[0,", "1,", "2,", "3]", "[9,", "2,", "3,", "7]", "[2,", "3,", "7,", "8]"]
+
+
+def test2_packedList(capsys):
+    # list(size, value) of an integer keeps its items in an array, of a
+    # boolean in a bytearray, until something else goes in
+    numbers, flags = initial_list(3, 0), initial_list(3, True)
+    assert type(numbers.items) is array and numbers.items.typecode == "q"
+    assert type(flags.items) is bytearray
+    numbers[0] = 2**63 - 1
+    numbers.append(-2**63)
+    flags[0] = False
+    flags.append(True)
+    assert type(numbers.items) is array and numbers == [2**63 - 1, 0, 0, -2**63]
+    assert type(flags.items) is bytearray and flags == [False, True, True, True]
+    assert flags[0] is False and flags[1] is True
+    for change in (lambda l: l.__setitem__(0, Fraction(1, 2)), lambda l: l.append(2**63),
+                   lambda l: l.__setitem__(1, "x"), lambda l: l.append(True)):
+        packed = initial_list(2, 0)
+        change(packed)
+        assert packed.kind is None and type(packed.items) is list
+    flags = initial_list(2, False)
+    flags.append(1)
+    assert flags.kind is None and flags == [False, False, 1] and flags[2] is not True
+    # and every engine prints what it would for a Python list
+    source = """{
+        var no = 1 < 0;
+        var yes = 0 < 1;
+        var a = list(3, 0);
+        a[0] = 1/2;
+        var b = list(3, 0);
+        b.append(9223372036854775808);
+        var c = list(2, 5);
+        c[1] = "x";
+        var d = list(2, 0);
+        d[0] = True;
+        var e = list(2, no);
+        e.append(1);
+        var f = list(2, True);
+        f[0] = no;
+        f.append(yes);
+        var g = list(2, 0);
+        g[1] = 9223372036854775807;
+        print a, b, c, d, e, f, g;
+    }"""
+    assert run_all(parse(source), capsys).split() == [
+        "[Fraction(1,", "2),", "0,", "0]", "[0,", "0,", "0,", "9223372036854775808]",
+        "[5,", "'x']", "[True,", "0]", "[False,", "False,", "1]",
+        "[False,", "True,", "True]", "[0,", "9223372036854775807]"]
@@ -5,33 +5,95 @@ import typechecking as t
 import resolver as r
 import os
 import bytecode as b
+import closures as c
+import cache
+import bytecodefile as bf
+import fold as f
+import hoisting as h
+import buffering as sb
+import tailcalls as tc
+import purity
+import registers as rg
 
 
-def main(filename):
-    with open(filename) as f:
-        code = f.read()
-    code = '{' + code + '}'
+def parse(code):
     stream = l.Stream.streamFromString(code)
-    tokens = l.lexer.lexerFromStream(stream)
+    tokens = l.bufferedLexer.lexerFromStream(stream)
     parse = p.Parser.call_parser(tokens)
-    ast = p.Parser.parse_expr(parse)
+    return p.Parser.parse_expr(parse)
+
+
+def main(filename, engine="eval", use_cache=True, optimize=True, memo=None,
+         profile=None):
+    # engine is one of "eval" (the tree-walking eval_ast), "vm" (the
+    # bytecode VM), "registers" (the register VM) or "closure" (the closure
+    # compiler). With use_cache the resolved AST or bytecode comes from
+    # __notpycache__ when the file hasn't changed since it was last compiled.
+    # optimize=False turns off constant folding, loop-invariant hoisting,
+    # string buffering, tail calls, purity analysis and the VM's peephole
+    # optimizer. With a purity.Memo, eval and the VM remember the results of
+    # calls of pure functions in it. With a profiler.Profiler, eval runs the
+    # program under it.
+    if filename.endswith(bf.extension):
+        # precompiled with bytecodefile.py, only runs on the VM
+        v = b.VM()
+        v.load_lowered(*bf.read(filename))
+        return v.execute()
+
+    # not f, which is the fold module
+    with open(filename) as source:
+        code = source.read()
+    code = '{' + code + '}'
+
+    def compiled(kind, build):
+        if not optimize:
+            kind += "-plain"
+        if use_cache:
+            return cache.cached(filename, code, kind, build)
+        return build()
+
+    def resolved():
+        resolvedast = r.resolve(parse(code))
+        if not optimize:
+            return resolvedast
+        return purity.mark_pure(tc.tail_calls(
+            sb.buffer_strings(h.hoist(f.fold(resolvedast)))))
 
-   # resolvedast = r.resolve(ast)
     # print(ast)
-    # print(resolvedast)
     # typedast = t.typecheck(resolvedast)
-    output = e.eval_ast(ast)
-#     v = b.VM()
-#     v.load(b.compile(resolvedast))
-#    # print(v.bytecode.insns)
-#     output = v.execute()
-# #     # print(output)
+    match engine:
+        case "eval":
+            resolvedast = compiled("ast", resolved)
+            if profile is not None:
+                output = profile.run(resolvedast, e.frame_environment(memo))
+            else:
+                output = e.eval_ast(resolvedast, None, e.frame_environment(memo))
+        case "vm":
+            bytecode = compiled(
+                "bytecode", lambda: b.compile(resolved(), optimize))
+            v = b.VM()
+            v.memo = memo
+            v.load(bytecode)
+            # print(v.bytecode.insns)
+            output = v.execute()
+        case "registers":
+            resolvedast = compiled("ast", resolved)
+            v = rg.RegisterVM()
+            v.load(rg.compile(resolvedast))
+            output = v.execute()
+        case "closure":
+            resolvedast = compiled("ast", resolved)
+            output = c.compile(resolvedast).run()
+        case _:
+            raise Exception(f"Unknown engine {engine}")
+    return output
 
 
-main("tester/q6.txt")
+if __name__ == "__main__":
+    main("tester/q6.txt")
 
-# call main on all the files in the tester folder
-for filename in os.listdir("tester"):
-    if filename.startswith("q"):
-        print(filename)
-        main("tester/" + filename)
+    # call main on all the files in the tester folder
+    for filename in os.listdir("tester"):
+        if filename.startswith("q"):
+            print(filename)
+            main("tester/" + filename)
@@ -0,0 +1,16 @@
+import os
+import loader
+
+tester = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tester")
+
+
+def test1_optimizedMain(capsys):
+    # every engine runs a tester program through the whole optimizing
+    # pipeline, printing what it prints unoptimized
+    program = os.path.join(tester, "q1.txt")
+    loader.main(program, engine="eval", use_cache=False, optimize=False)
+    expected = capsys.readouterr().out.split()
+    assert expected
+    for engine in ("eval", "vm", "registers", "closure"):
+        loader.main(program, engine=engine, use_cache=False)
+        assert capsys.readouterr().out.split() == expected
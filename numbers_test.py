@@ -0,0 +1,52 @@
+from fractions import Fraction
+from eval import power, square_root
+from testing import parse, run_all
+
+
+half = Fraction(1, 2)
+
+
+def test1_power():
+    assert power(7, 2) == 49 and type(power(7, 2)) is int
+    assert power(-2, 3) == -8 and power(-2, -3) == Fraction(-1, 8)
+    assert power(2, -3) == Fraction(1, 8) and power(4, -1) == Fraction(1, 4)
+    assert power(Fraction(-2, 3), 3) == Fraction(-8, 27)
+    assert type(power(Fraction(3, 2), 2)) is Fraction and power(Fraction(1, 2), -2) == 4
+
+
+def test2_squareRoot():
+    # the exact root of a square, int or Fraction, however large
+    assert power(49, half) == 7 and type(power(49, half)) is int
+    assert power(Fraction(9, 4), half) == Fraction(3, 2)
+    big = (10**200 + 1) ** 2
+    assert power(big, half) == 10**200 + 1
+    assert power(Fraction(big, 4), half) == Fraction(10**200 + 1, 2)
+    # the nearest float otherwise, as before
+    assert power(2, half) == Fraction(2 ** 0.5)
+    assert power(Fraction(1, 3), half) == Fraction((1 / 3) ** 0.5)
+    assert square_root(-4) is None and square_root(Fraction(-9, 4)) is None
+    # and past the floats, the root rounded down
+    huge = 10**401
+    for a in (huge, Fraction(huge + 1, 2)):
+        root = power(a, half)
+        assert type(root) is int and root ** 2 <= a < (root + 1) ** 2
+
+
+def test3_engines(capsys):
+    huge = "1" + "0" * 401
+    source = """{
+        var half = 1/2;
+        var n = 0 - 2;
+        var a = 7 ^ 2;
+        var b = n ^ 3;
+        var c = 2 ^ n;
+        var d = 9/4;
+        var e = d ^ half;
+        var f = 49 ^ half;
+        var g = 2 ^ half;
+        var h = %s ^ half;
+        var k = h * h < %s;
+        print a, b, c, e, f, g, k;
+    }""" % (huge, huge)
+    assert run_all(parse(source), capsys).split() == [
+        "49", "-8", "1/4", "3/2", "7", "6369051672525773/4503599627370496", "True"]
@@ -0,0 +1,143 @@
+import time
+from collections import defaultdict
+import eval as e
+
+
+# A profiler for eval_ast. eval_ast recurses through the module global
+# eval.eval_ast, so while Profiler.run runs a program that global is a wrapper
+# that times every node before handing it on, and the name space's
+# start_call/end_call are wrapped to follow the Notpy call stack. Outside
+# run nothing is wrapped: when it is off, profiling costs the evaluator
+# nothing at all.
+#
+# Times are wall clock, in seconds. A node's inclusive time is the time it
+# took, its exclusive time that less the time of the nodes it evaluated. A
+# function's inclusive time runs from the start of its body (its arguments
+# are evaluated by the caller) to its return, counted once for recursive
+# calls; its exclusive time is the exclusive time of the nodes it ran
+# itself. Calls answered by a memo never start, so they aren't counted.
+
+top = "<top>"  # the name of the top level of the program on the call stack
+
+
+class Stats:
+    __slots__ = ("count", "inclusive", "exclusive")
+
+    def __init__(self):
+        self.count = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+
+
+class Profiler:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.nodes = defaultdict(Stats)  # by node kind (class name)
+        self.functions = defaultdict(Stats)  # by the name called
+        self.stacks = defaultdict(float)  # exclusive time by call stack
+        self.stack = [top]  # the running Notpy functions, innermost last
+        self.paths = [top]  # the stack as ";"-joined prefixes
+        self.started = []  # when each running call started its body
+        self.calling = []  # names of calls whose arguments are being evaluated
+        self.children = [0.0]  # time of the nodes evaluated by each running node
+        self.total = 0.0
+
+    def run(self, program, name_space=None):
+        # evaluates program with eval_ast, recording where the time goes
+        if name_space is None:
+            name_space = e.environment()
+        evaluate = e.eval_ast
+        clock = self.clock
+        nodes, stacks, children = self.nodes, self.stacks, self.children
+        calling = self.calling
+
+        def profiled(subprogram, lexical_scope=None, name_space=None):
+            kind = type(subprogram).__name__
+            call = kind == "FunctionCall"
+            if call:
+                calling.append(subprogram.function.name)
+                pending = len(calling)
+            children.append(0.0)
+            start = clock()
+            try:
+                return evaluate(subprogram, lexical_scope, name_space)
+            finally:
+                elapsed = clock() - start
+                own = elapsed - children.pop()
+                children[-1] += elapsed
+                stats = nodes[kind]
+                stats.count += 1
+                stats.inclusive += elapsed
+                stats.exclusive += own
+                stacks[self.paths[-1]] += own
+                if call and len(calling) == pending:
+                    # the call never started: a memo had its result
+                    calling.pop()
+
+        start_call, end_call = name_space.start_call, name_space.end_call
+
+        def profiled_start(function):
+            name = calling.pop()
+            self.functions[name].count += 1
+            self.stack.append(name)
+            self.paths.append(self.paths[-1] + ";" + name)
+            self.started.append(clock())
+            return start_call(function)
+
+        def profiled_end(function, saved):
+            elapsed = clock() - self.started.pop()
+            name = self.stack.pop()
+            self.paths.pop()
+            if name not in self.stack:
+                self.functions[name].inclusive += elapsed
+            return end_call(function, saved)
+
+        name_space.start_call, name_space.end_call = profiled_start, profiled_end
+        e.eval_ast = profiled
+        start = clock()
+        try:
+            return profiled(program, None, name_space)
+        finally:
+            self.total += clock() - start
+            e.eval_ast = evaluate
+            del name_space.start_call, name_space.end_call
+            # an error leaves the calls it unwound on the stacks
+            del self.stack[1:], self.paths[1:], self.started[:], calling[:]
+            self.children[:] = [0.0]
+            self.collect()
+
+    def collect(self):
+        # the exclusive time of each function: that of the stacks it is the
+        # innermost function of
+        for stats in self.functions.values():
+            stats.exclusive = 0.0
+        for path, elapsed in self.stacks.items():
+            name = path.rsplit(";", 1)[-1]
+            if name != top:
+                self.functions[name].exclusive += elapsed
+
+    def report(self, limit: int = 20) -> str:
+        # the functions and node kinds that took the most time, by exclusive
+        # time
+        lines = [f"total {self.total * 1000:.3f} ms", ""]
+        for title, table in (("function", self.functions), ("node", self.nodes)):
+            lines.append(f"{title:<24}{'count':>12}{'inclusive ms':>15}{'exclusive ms':>15}")
+            ranked = sorted(table.items(), key=lambda item: item[1].exclusive,
+                            reverse=True)
+            for name, stats in ranked[:limit]:
+                lines.append(f"{name:<24}{stats.count:>12}"
+                             f"{stats.inclusive * 1000:>15.3f}"
+                             f"{stats.exclusive * 1000:>15.3f}")
+            lines.append("")
+        return "\n".join(lines)
+
+    def collapsed(self) -> str:
+        # one "<top>;f;g microseconds" line per call stack, the input
+        # flamegraph.pl and speedscope take
+        return "".join(f"{path} {round(elapsed * 1e6)}\n"
+                       for path, elapsed in sorted(self.stacks.items())
+                       if round(elapsed * 1e6) > 0)
+
+    def write_collapsed(self, filename):
+        with open(filename, "w") as f:
+            f.write(self.collapsed())
@@ -0,0 +1,100 @@
+from purity import mark_pure, Memo
+import eval
+from profiler import Profiler
+from testing import parse
+
+
+def ticking():
+    # a clock that moves on by one each time it is read, so that every time
+    # is a whole number of ticks
+    count = 0
+
+    def clock():
+        nonlocal count
+        count += 1
+        return count
+    return clock
+
+
+def test1_profile(capsys):
+    program = parse("""{
+        def fib(n) {
+            var ans = n;
+            if (n > 1) {
+                var a = fib(n - 1);
+                var b = fib(n - 2);
+                ans = a + b;
+            }
+            return ans;
+        }
+        def square(n) {
+            return n * n;
+        }
+        var x = fib(6);
+        var y = square(x);
+        print x, y;
+    }""")
+    evaluate = eval.eval_ast
+    profiler = Profiler(ticking())
+    profiler.run(program, eval.frame_environment())
+    assert capsys.readouterr().out == "8 64 \n"
+    assert eval.eval_ast is evaluate
+
+    assert {name: stats.count for name, stats in profiler.functions.items()} == {
+        "fib": 25, "square": 1}
+    assert profiler.nodes["FunctionCall"].count == 26
+    # every tick is some node's own time, on some stack, and the recursion
+    # is counted once in fib's inclusive time
+    ticked = sum(stats.exclusive for stats in profiler.nodes.values())
+    assert ticked == sum(profiler.stacks.values()) == profiler.total - 2
+    fib = profiler.functions["fib"]
+    assert fib.exclusive < fib.inclusive < profiler.total
+
+    lines = profiler.collapsed().splitlines()
+    paths = [line.rsplit(" ", 1)[0] for line in lines]
+    assert paths[:3] == ["<top>", "<top>;fib", "<top>;fib;fib"]
+    assert "<top>;square" in paths and max(path.count(";") for path in paths) == 6
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == ticked * 1e6
+    report = profiler.report()
+    assert report.splitlines()[2].split() == [
+        "function", "count", "inclusive", "ms", "exclusive", "ms"]
+    assert report.splitlines()[3].split()[:2] == ["fib", "25"]
+
+
+def test2_memoAndErrors(capsys):
+    program = mark_pure(parse("""{
+        def fib(n) {
+            var ans = n;
+            if (n > 1) {
+                var a = fib(n - 1);
+                var b = fib(n - 2);
+                ans = a + b;
+            }
+            return ans;
+        }
+        var x = fib(10);
+        print x;
+    }"""))
+    profiler = Profiler()
+    profiler.run(program, eval.frame_environment(Memo()))
+    assert capsys.readouterr().out == "55 \n"
+    # calls answered by the memo never ran fib's body
+    assert profiler.functions["fib"].count == 11
+    assert profiler.nodes["FunctionCall"].count == 11 + 8
+
+    failing = parse("""{
+        def f(n) {
+            var x = 1 / n;
+            return x;
+        }
+        var y = f(0);
+    }""")
+    message = None
+    try:
+        profiler.run(failing, eval.frame_environment())
+    except Exception as error:
+        message = str(error)
+    assert message == "Division by zero"
+    assert profiler.stack == ["<top>"] and profiler.calling == []
+    assert eval.eval_ast is not None and eval.eval_ast.__name__ == "eval_ast"
+    assert profiler.functions["f"].count == 1
@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from fractions import Fraction
+from typing import Set
+from eval import *
+from fold import subtrees, assigned, id_set
+
+
+# Purity analysis over a resolved AST (see resolver.resolve). A function is
+# pure when its result depends only on its arguments and calling it changes
+# nothing the caller can see:
+#
+#   - it reads and writes only its own parameters and locals
+#   - it doesn't print or read input
+#   - it doesn't change lists or dicts in place (put, append, delete), as
+#     they may be its arguments'
+#   - it calls only pure functions, by the name they were declared with, and
+#     declares no functions of its own
+#
+# mark_pure sets Function.pure on those; with a Memo the tree-walker and the
+# VM then remember what calls of pure functions returned.
+
+
+def pure_functions(program: AST) -> Set[int]:
+    # the ids of the names of the pure functions declared in program
+    changed = assigned(program)
+    functions = {node.name.id: node for node in subtrees(program)
+                 if isinstance(node, Function) and node.name.id not in changed}
+    calls = {}
+    for name, function in list(functions.items()):
+        callees = self_contained(function)
+        if callees is None:
+            del functions[name]
+        else:
+            calls[name] = callees
+    # a function calling one that isn't pure isn't either
+    while True:
+        impure = [name for name in functions if not calls[name] <= functions.keys()]
+        if not impure:
+            return id_set(functions)
+        for name in impure:
+            del functions[name]
+
+
+def self_contained(function: Function) -> Optional[Set[int]]:
+    # the ids of the functions function calls, or None if it does anything
+    # else that isn't pure
+    level = 1 if function.name.level is None else function.name.level + 1
+    body = [function.body, function.return_exp]
+    callees = {id(node.function) for node in subtrees(body)
+               if isinstance(node, FunctionCall)}
+    called = id_set()
+    for node in subtrees(body):
+        match node:
+            case FunctionCall(fn, _):
+                if fn.slot is None:
+                    return None
+                called.add(fn.id)
+            case identifier() as v if id(v) not in callees:
+                if v.slot is None or v.level != level:
+                    return None
+            case print_statement() | input_statement() | Function():
+                return None
+            case put() | update_list() | update_dict():
+                return None
+            case b_list_operation("append", _, _) | b_dict_operation("delete", _, _):
+                return None
+    return called
+
+
+def mark_pure(program: AST) -> AST:
+    # sets Function.pure on the pure functions of program, in place, and
+    # returns it
+    pure = pure_functions(program)
+    for node in subtrees(program):
+        if isinstance(node, Function):
+            node.pure = node.name.id in pure
+    return program
+
+
+class Memo:
+    # a bounded LRU cache of what calls of pure functions returned, keyed on
+    # the function and its arguments. Calls with arguments that can't be
+    # hashed (lists, dicts) are never found, and results that could be
+    # changed after they are returned (lists, dicts) are never stored.
+
+    missing = object()
+
+    def key(self, function, arguments) -> tuple:
+        # function is the object that stands for the function in the program
+        # that calls it. It is kept alive with the memo, so no other function,
+        # of this program or the next one to share the memo, can take its id.
+        # The types tell True from 1, which are equal as dict keys
+        self.functions.setdefault(id(function), function)
+        return (id(function), *arguments, *map(type, arguments))
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.results = OrderedDict()
+        self.functions = {}  # by id, the functions keys were made for
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        try:
+            value = self.results[key]
+        except (KeyError, TypeError):
+            self.misses += 1
+            return Memo.missing
+        self.results.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if not isinstance(value, int | Fraction | str):
+            return
+        try:
+            self.results[key] = value
+        except TypeError:
+            return
+        if len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "size": len(self.results),
+                "maxsize": self.maxsize}
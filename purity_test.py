@@ -0,0 +1,116 @@
+from eval import eval_ast, frame_environment, Function
+from fold import subtrees
+from purity import pure_functions, mark_pure, Memo
+import bytecode
+from testing import parse
+
+
+def test1_analysis():
+    program = parse("""{
+        var count = 0;
+        def square(n) {
+            var s = n * n;
+            return s;
+        }
+        def sumsquares(n) {
+            var total = 0;
+            for (i = 1; i < n; i = i + 1) {
+                var s = square(i);
+                total = total + s;
+            }
+            return total;
+        }
+        def counted(n) {
+            count = count + 1;
+            return n;
+        }
+        def shout(n) {
+            print n;
+            return n;
+        }
+        def calls_shout(n) {
+            var x = shout(n);
+            return x;
+        }
+        def push(l) {
+            l.append(1);
+            return l;
+        }
+        var a = sumsquares(4);
+    }""")
+    functions = {node.name.name: node for node in subtrees(program)
+                 if isinstance(node, Function)}
+    pure = {name for name, f in functions.items() if f.name.id in pure_functions(program)}
+    assert pure == {"square", "sumsquares"}
+    mark_pure(program)
+    assert [f.pure for f in functions.values()] == [True, True, False, False, False, False]
+
+
+def test2_memo(capsys):
+    program = mark_pure(parse("""{
+        def fib(n) {
+            var ans = n;
+            if (n > 1) {
+                var a = fib(n - 1);
+                var b = fib(n - 2);
+                ans = a + b;
+            }
+            return ans;
+        }
+        var x = fib(20);
+        print x;
+    }"""))
+    memo = Memo(100)
+    eval_ast(program, None, frame_environment(memo))
+    assert capsys.readouterr().out == "6765 \n"
+    # fib(n) is worked out once for each n, and found for its second caller
+    assert (memo.hits, memo.misses, memo.evictions) == (18, 21, 0)
+
+    vm = bytecode.VM()
+    vm.memo = Memo(5)
+    vm.load(bytecode.compile(program))
+    vm.execute()
+    assert capsys.readouterr().out == "6765\n"
+    assert (vm.memo.hits, vm.memo.misses) == (18, 21)
+    assert vm.memo.evictions == 21 - 5 and len(vm.memo.results) == 5
+    assert len(vm.frames) == 1 and vm.data == []
+
+
+def test3_memoKeys():
+    memo = Memo(2)
+    memo.put(memo.key(0, [1]), "one")
+    memo.put(memo.key(0, [True]), "true")
+    assert memo.get(memo.key(0, [1])) == "one"
+    assert memo.get(memo.key(0, [True])) == "true"
+    # lists are neither keys nor stored results
+    assert memo.get(memo.key(0, [[1]])) is Memo.missing
+    memo.put(memo.key(0, [2]), [2])
+    assert memo.get(memo.key(0, [2])) is Memo.missing
+    # the least recently used entry goes first
+    memo.put(memo.key(0, [3]), 3)
+    assert memo.get(memo.key(0, [1])) is Memo.missing
+    assert memo.stats() == {"hits": 2, "misses": 3, "evictions": 1,
+                            "size": 2, "maxsize": 2}
+
+
+def test4_memoShared(capsys):
+    # programs sharing a memo don't find each other's results, though their
+    # functions are declared at the same place
+    sources = [f"""{{
+        def f(n) {{
+            return n {op} n;
+        }}
+        var x = f(3);
+        print x;
+    }}""" for op in ("*", "+")]
+    memo = Memo(100)
+    for source, expected in zip(sources, ["9", "6"]):
+        eval_ast(mark_pure(parse(source)), None, frame_environment(memo))
+        assert capsys.readouterr().out.split() == [expected]
+    vm = bytecode.VM()
+    vm.memo = Memo(100)
+    for source, expected in zip(sources, ["9", "6"]):
+        vm.load(bytecode.compile(mark_pure(parse(source))))
+        vm.execute()
+        assert capsys.readouterr().out.split() == [expected]
+    assert memo.hits == vm.memo.hits == 0
@@ -0,0 +1,670 @@
+from dataclasses import dataclass
+from typing import List, Optional
+import bytecode as b
+from bytecode import Label, binary_functions, counted, quotient, remainder
+from eval import *
+
+
+# Register VM: a second backend for the resolved AST, next to the stack VM in
+# bytecode.py. Every function call gets a register file laid out as
+#
+#   the resolver's slots (parameters first) | temporaries | constants
+#
+# copied from a template that already holds the constants, so no instruction
+# needs a constant operand. Top level variables live in the root register
+# file, and functions reach them with GETGLOBAL and SETGLOBAL. Instructions
+# are (opcode, a, b, c) tuples, three-address where that makes sense:
+#
+#   MOVE a b            r[a] = r[b]
+#   GETGLOBAL a slot    r[a] = root[slot]
+#   SETGLOBAL slot b    root[slot] = r[b]
+#   ADD .. GE a b c     r[a] = r[b] op r[c], as the stack VM computes it
+#   NOT, NEG a b        r[a] = not r[b], -r[b]
+#   JMP a               jump to a
+#   JMPF a b, JMPT a b  jump to b if r[a] is false, true
+#   JNLT .. JNGE a b c  jump to a unless r[b] op r[c]
+#   FORNEXT a b c       r[a] += r[b + 1], jump to c if r[a] < r[b] (the
+#                       bound of a counted loop, bytecode.counted)
+#   CALL a b c          r[a] = r[b](r[c], r[c + 1], ...)
+#   RETURN a            return r[a]
+#   STACK a b c         runs b = (handler, operand), one of the stack VM's
+#                       handlers, on the values of the registers in c, and
+#                       puts what it leaves on the stack in r[a]
+#   HALT a              stops, with r[a] as the value of the program
+
+names = ["MOVE", "GETGLOBAL", "SETGLOBAL",
+         "ADD", "SUB", "MUL", "DIV", "EXP", "QUOT", "REM",
+         "EQ", "NEQ", "LT", "GT", "LE", "GE",
+         "NOT", "NEG",
+         "JMP", "JMPF", "JMPT",
+         "JNEQ", "JNNEQ", "JNLT", "JNGT", "JNLE", "JNGE",
+         "FORNEXT", "CALL", "RETURN", "STACK", "HALT"]
+(MOVE, GETGLOBAL, SETGLOBAL,
+ ADD, SUB, MUL, DIV, EXP, QUOT, REM,
+ EQ, NEQ, LT, GT, LE, GE,
+ NOT, NEG,
+ JMP, JMPF, JMPT,
+ JNEQ, JNNEQ, JNLT, JNGT, JNLE, JNGE,
+ FORNEXT, CALL, RETURN, STACK, HALT) = range(len(names))
+
+binary = {"+": ADD, "-": SUB, "*": MUL, "/": DIV, "^": EXP, "//": QUOT,
+          "%": REM, "==": EQ, "!=": NEQ, "<": LT, ">": GT, "<=": LE, ">=": GE}
+# the jump taken when a comparison fails
+branch = {EQ: JNEQ, NEQ: JNNEQ, LT: JNLT, GT: JNGT, LE: JNLE, GE: JNGE}
+functions = {op: binary_functions[names[op]] for op in binary.values()}
+
+
+def stack_op(kind, operand=None):
+    return (b.handlers[b.opcodes[kind]], operand)
+
+
+@dataclass
+class RegisterFunction:
+    entry: int
+    template: List[Value]
+    nparams: int
+
+
+@dataclass
+class Program:
+    code: List[tuple]
+    template: List[Value]  # the root register file
+
+
+class FunctionCompiler:
+    # compiles the code of one function (or the top level) into code, the
+    # instructions shared by the whole program
+
+    def __init__(self, program: 'Compiler', level: int, nslots: int):
+        self.program = program
+        self.code = program.code
+        self.level = level
+        self.nslots = nslots
+        self.next_temp = nslots
+        self.ntemps = nslots
+        self.constants = []
+        self.constant_registers = {}
+        self.start = len(self.code)
+        self.function = None  # the RegisterFunction being compiled
+
+    def emit(self, *insn):
+        self.code.append(insn)
+
+    def label(self) -> Label:
+        return Label(-1)
+
+    def emit_label(self, label: Label):
+        label.target = len(self.code)
+
+    def temp(self) -> int:
+        register = self.next_temp
+        self.next_temp += 1
+        self.ntemps = max(self.ntemps, self.next_temp)
+        return register
+
+    def constant(self, value) -> int:
+        # constants are numbered from -1 down until the number of temporaries
+        # is known, see finish
+        key = (type(value), value) if not isinstance(
+            value, RegisterFunction) else id(value)
+        if key not in self.constant_registers:
+            self.constants.append(value)
+            self.constant_registers[key] = -len(self.constants)
+        return self.constant_registers[key]
+
+    def finish(self) -> List[Value]:
+        # gives the constants their registers, after the temporaries, and
+        # returns the template register file
+        def register(r):
+            if type(r) is int and r < 0:
+                return self.ntemps - 1 - r
+            return r
+        for n in range(self.start, len(self.code)):
+            op, *operands = self.code[n] + (None,) * (4 - len(self.code[n]))
+            if op == STACK:
+                operands[2] = tuple(register(r) for r in operands[2])
+                operands[0] = register(operands[0])
+            elif op == JMP:
+                pass
+            elif op in (JMPF, JMPT):
+                operands[0] = register(operands[0])
+            elif op in branch.values():
+                operands[1:] = [register(r) for r in operands[1:]]
+            elif op == SETGLOBAL:
+                operands[1] = register(operands[1])
+            elif op == GETGLOBAL:
+                operands[0] = register(operands[0])
+            else:
+                operands = [register(r) for r in operands]
+            self.code[n] = (op, *operands)
+        return [None] * self.ntemps + self.constants
+
+    # variables
+
+    def load(self, v, target=None) -> int:
+        if v.slot is None:
+            ProgramNotSupported()
+        if v.level == self.level:
+            return v.slot
+        if v.level == 0:
+            target = self.temp() if target is None else target
+            self.emit(GETGLOBAL, target, v.slot)
+            return target
+        ProgramNotSupported()
+
+    def store(self, v, value):
+        # compiles value into the variable v
+        if v.slot is None:
+            ProgramNotSupported()
+        if v.level == self.level:
+            self.expr(value, v.slot)
+        elif v.level == 0:
+            self.emit(SETGLOBAL, v.slot, self.expr(value))
+        else:
+            ProgramNotSupported()
+
+    def store_register(self, v, register):
+        if v.level == self.level:
+            if register != v.slot:
+                self.emit(MOVE, v.slot, register)
+        else:
+            self.emit(SETGLOBAL, v.slot, register)
+
+    # expressions
+
+    def expr(self, program: AST, target: Optional[int] = None) -> int:
+        # compiles program and returns the register holding its value, which
+        # is target if one is given
+        register = self.value(program, target)
+        if target is not None and register != target:
+            self.emit(MOVE, target, register)
+            return target
+        return register
+
+    def value(self, program: AST, target) -> int:
+        def into():
+            return self.temp() if target is None else target
+
+        match program:
+            case numeric_literal(value) | bool_literal(value) | string_literal(value):
+                return self.constant(value)
+            case get(v):
+                return self.load(v, target)
+            case binary_operation(op, left, right) if op in binary:
+                l = self.expr(left)
+                r = self.expr(right)
+                t = into()
+                self.emit(binary[op], t, l, r)
+                return t
+            case binary_operation("and" | "&&" | "or" | "||" as op, left, right):
+                E = self.label()
+                t = self.temp()
+                self.expr(left, t)
+                self.emit(JMPF if op in ("and", "&&") else JMPT, t, E)
+                self.expr(right, t)
+                self.emit_label(E)
+                return t
+            case unary_operation("-", operand):
+                t = into()
+                self.emit(NEG, t, self.expr(operand))
+                return t
+            case unary_operation("!", operand):
+                t = into()
+                self.emit(NOT, t, self.expr(operand))
+                return t
+            case FunctionCall(fn, arguments):
+                function = self.load(fn)
+                first = self.next_temp
+                for argument in arguments:
+                    self.temp()
+                for n, argument in enumerate(arguments):
+                    self.expr(argument, first + n)
+                t = into()
+                self.emit(CALL, t, function, first)
+                return t
+            case _ if self.stack_value(program) is not None:
+                return self.stack(program, target)
+            case (declare() | set() | print_statement() | block() | if_statement()
+                  | while_loop() | for_loop() | Function() | TailCall()
+                  | update_string() | Null() | None):
+                # statements have the value 0
+                self.statement(program)
+                return self.constant(0)
+        # statement() compiles anything else as an expression
+        ProgramNotSupported()
+
+    def stack_value(self, program):
+        # (operation, argument expressions in the order the stack VM pushes
+        # them) for what the register VM leaves to the stack VM's handlers
+        I = b.I
+        match program:
+            case input_statement(string):
+                return stack_op(I.INPUT, string), []
+            case Lists(items):
+                return stack_op(I.BUILD_LIST), items + [numeric_literal(len(items))]
+            case dict_literal(pairs):
+                return stack_op(I.BUILD_DICT), [e for pair in pairs for e in pair] + [numeric_literal(len(pairs))]
+            case string_concat(strings):
+                return stack_op(I.STRCAT, len(strings)), strings[::-1]
+            case string_slice(string, start, stop, hop):
+                return stack_op(I.STRSLICE), [string, start, stop, hop]
+            case u_string_operation("buffer", string):
+                return stack_op(I.STRBUFFER), [string]
+            case u_string_operation("text", string):
+                return stack_op(I.STRTEXT), [string]
+            case list_initializer(size, value):
+                return stack_op(I.INIT_LIST), [size, value]
+            case u_list_operation("head", l):
+                return stack_op(I.LIST_HEAD), [l]
+            case u_list_operation("tail", l):
+                return stack_op(I.LIST_TAIL), [l]
+            case u_list_operation("is_empty", l):
+                return stack_op(I.LIST_EMPTY), [l]
+            case b_list_operation("cons", e, l):
+                return stack_op(I.LIST_CONS), [e, l]
+            case b_list_operation("append", e, l):
+                return stack_op(I.LIST_APPEND), [e, l]
+            case u_dict_operation("keys" | "values" | "items" as op, d):
+                kinds = {"keys": I.DICT_KEYS, "values": I.DICT_VALUES, "items": I.DICT_ITEMS}
+                return stack_op(kinds[op]), [d if isinstance(d, get) else get(d)]
+            case b_dict_operation("delete", d, key):
+                return stack_op(I.DICT_DELETE), [d if isinstance(d, get) else get(d), key]
+            case b_dict_operation("check", d, key):
+                return stack_op(I.DICT_CHECK), [d if isinstance(d, get) else get(d), key]
+            case length(x):
+                return stack_op(I.LENGTH), [x]
+            case find(x, index):
+                return stack_op(I.FIND), [index, x]
+            case put(x, index, value):
+                return stack_op(I.PUT), [value, index, x]
+        return None
+
+    def stack(self, program, target) -> int:
+        operation, arguments = self.stack_value(program)
+        registers = tuple(self.expr(argument) for argument in arguments)
+        t = self.temp() if target is None else target
+        self.emit(STACK, t, operation, registers)
+        # like the stack VM, string puts, deletes and cons store their result
+        # back
+        match program:
+            case put(get(v), _, _) | b_dict_operation("delete", get(v), _):
+                self.store_register(v, t)
+            case b_dict_operation("delete", identifier() as v, _):
+                self.store_register(v, t)
+            case b_list_operation("cons", _, get(v) | (identifier() as v)):
+                # the variable holding the list now holds the longer one
+                self.store_register(v, t)
+        return t
+
+    # statements
+
+    def condition(self, program: AST, false: Label):
+        # jumps to false unless program holds
+        match program:
+            case binary_operation(op, left, right) if op in binary and binary[op] in branch:
+                l = self.expr(left)
+                r = self.expr(right)
+                self.emit(branch[binary[op]], false, l, r)
+            case binary_operation("and" | "&&", left, right):
+                self.condition(left, false)
+                self.condition(right, false)
+            case binary_operation("or" | "||", left, right):
+                other = self.label()
+                true = self.label()
+                self.condition(left, other)
+                self.emit(JMP, true)
+                self.emit_label(other)
+                self.condition(right, false)
+                self.emit_label(true)
+            case _:
+                self.emit(JMPF, self.expr(program), false)
+
+    def statement(self, program: AST):
+        mark = self.next_temp
+        match program:
+            case declare(v, value) | set(v, value):
+                self.store(v, value)
+            case print_statement(exps):
+                for e in exps:
+                    self.emit(STACK, None, stack_op(b.I.PRINT), (self.expr(e),))
+            case block(exps):
+                for e in exps:
+                    self.statement(e)
+            case if_statement(condition, if_exp, else_exp):
+                E = self.label()
+                F = self.label()
+                self.condition(condition, F)
+                self.statement(if_exp)
+                jump = len(self.code)
+                self.emit(JMP, E)
+                self.emit_label(F)
+                self.statement(else_exp)
+                if len(self.code) == F.target:
+                    # no else, so no jump over it
+                    del self.code[jump]
+                    F.target = jump
+                self.emit_label(E)
+            case while_loop(condition, body):
+                B = self.label()
+                E = self.label()
+                self.emit_label(B)
+                self.condition(condition, E)
+                self.statement(body)
+                self.emit(JMP, B)
+                self.emit_label(E)
+            case for_loop(i, initial_value, condition, updation, body) if counted(program) and i.level == self.level:
+                # the bound and then the step in two temporaries
+                B = self.label()
+                E = self.label()
+                self.store(i, initial_value)
+                bound = self.temp()
+                step = self.temp()
+                self.expr(condition.right, bound)
+                self.emit(MOVE, step, self.constant(updation.value.right.value))
+                self.emit(JNLT, E, i.slot, bound)
+                self.emit_label(B)
+                self.statement(body)
+                self.emit(FORNEXT, i.slot, bound, B)
+                self.emit_label(E)
+            case for_loop(i, initial_value, condition, updation, body):
+                B = self.label()
+                E = self.label()
+                self.store(i, initial_value)
+                self.emit_label(B)
+                self.condition(condition, E)
+                self.statement(body)
+                self.statement(updation)
+                self.emit(JMP, B)
+                self.emit_label(E)
+            case Function(name, parameters, body, return_exp, _, frame_size):
+                if [p.slot for p in parameters] != list(range(len(parameters))):
+                    ProgramNotSupported()
+                function = RegisterFunction(-1, [], len(parameters))
+                self.program.functions.append(
+                    (function, self.level + 1, frame_size, body, return_exp))
+                self.store_register(name, self.constant(function))
+            case TailCall(FunctionCall(_, arguments)):
+                # the new arguments replace the parameters and the code
+                # starts over in the same registers
+                first = self.next_temp
+                for argument in arguments:
+                    self.temp()
+                for n, argument in enumerate(arguments):
+                    self.expr(argument, first + n)
+                for n in range(len(arguments)):
+                    self.emit(MOVE, n, first + n)
+                self.emit(JMP, self.function.entry)
+            case update_string(get(v), value):
+                self.store_register(v, self.constant(value))
+            case Null() | None:
+                pass
+            case let() | let_var() | identifier():
+                ProgramNotSupported()
+            case _:
+                self.expr(program)
+        self.next_temp = mark
+
+
+class Compiler:
+    def __init__(self):
+        self.code = []
+        self.functions = []
+
+
+def resolved_slots(program: AST) -> int:
+    # registers needed by the top level variables
+    return max((v.slot + 1 for v in b.subtrees(program)
+                if isinstance(v, identifier) and v.level == 0 and v.slot is not None),
+               default=0)
+
+
+def compile(program: AST) -> Program:
+    compiler = Compiler()
+    main = FunctionCompiler(compiler, 0, resolved_slots(program))
+    if b.leaves_value(program):
+        main.emit(HALT, main.expr(program))
+    else:
+        main.statement(program)
+        main.emit(HALT)
+    template = main.finish()
+    # function bodies go after the top level code, each one compiled after
+    # the function it is declared in
+    while compiler.functions:
+        function, level, frame_size, body, return_exp = compiler.functions.pop(0)
+        f = FunctionCompiler(compiler, level, frame_size)
+        f.function = function
+        function.entry = len(compiler.code)
+        f.statement(body)
+        f.emit(RETURN, f.expr(return_exp))
+        function.template[:] = f.finish()
+    code = [tuple(operand.target if isinstance(operand, Label) else operand
+                  for operand in insn) + (None,) * (4 - len(insn))
+            for insn in compiler.code]
+    return Program(code, template)
+
+
+class Operands:
+    # what the stack VM's handlers see of a VM: just its data stack
+    data: list
+
+
+class RegisterVM:
+    def load(self, program: Program):
+        self.program = program
+        self.code = program.code
+        self.restart()
+
+    def restart(self):
+        self.pc = 0
+        self.root = self.program.template[:]
+        self.registers = self.root
+        self.calls = []
+
+    def execute(self):
+        code = self.code
+        root = self.root
+        r = self.registers
+        calls = self.calls
+        pc = self.pc
+        while True:
+            op, a, b_, c = code[pc]
+            pc += 1
+            if op == ADD:
+                value = r[b_] + r[c]
+                r[a] = value if type(value) is int else number(value)
+            elif op == MOVE:
+                r[a] = r[b_]
+            elif op == JMP:
+                pc = a
+            elif op == JNEQ:
+                if not r[b_] == r[c]:
+                    pc = a
+            elif op == JNLT:
+                if not r[b_] < r[c]:
+                    pc = a
+            elif op == JNGT:
+                if not r[b_] > r[c]:
+                    pc = a
+            elif op == REM:
+                x = r[b_]
+                y = r[c]
+                r[a] = x % y if type(x) is int and type(y) is int else remainder(x, y)
+            elif op == MUL:
+                value = r[b_] * r[c]
+                r[a] = value if type(value) is int else number(value)
+            elif op == QUOT:
+                x = r[b_]
+                y = r[c]
+                r[a] = x // y if type(x) is int and type(y) is int else quotient(x, y)
+            elif op == FORNEXT:
+                value = r[a] + r[b_ + 1]
+                r[a] = value
+                if value < r[b_]:
+                    pc = c
+            elif op == SUB:
+                value = r[b_] - r[c]
+                r[a] = value if type(value) is int else number(value)
+            elif op == EQ:
+                r[a] = r[b_] == r[c]
+            elif op == LT:
+                r[a] = r[b_] < r[c]
+            elif op == JMPF:
+                if not r[a]:
+                    pc = b_
+            elif op == JMPT:
+                if r[a]:
+                    pc = b_
+            elif op == JNNEQ:
+                if not r[b_] != r[c]:
+                    pc = a
+            elif op == JNLE:
+                if not r[b_] <= r[c]:
+                    pc = a
+            elif op == GETGLOBAL:
+                r[a] = root[b_]
+            elif op == SETGLOBAL:
+                root[a] = r[b_]
+            elif op == CALL:
+                function = r[b_]
+                registers = function.template[:]
+                n = function.nparams
+                registers[:n] = r[c:c + n]
+                calls.append((pc, a, r))
+                r = registers
+                pc = function.entry
+            elif op == RETURN:
+                value = r[a]
+                pc, target, r = calls.pop()
+                r[target] = value
+            elif op == HALT:
+                self.pc = pc
+                return None if a is None else r[a]
+            else:
+                self.pc = pc
+                self.registers = r
+                handlers[op](self, a, b_, c)
+                pc = self.pc
+                r = self.registers
+
+    def execute_traced(self, counts):
+        # one instruction at a time through the handlers, counting how many
+        # times each opcode runs
+        while True:
+            op, a, b_, c = self.code[self.pc]
+            counts[op] += 1
+            self.pc += 1
+            if op == HALT:
+                return None if a is None else self.registers[a]
+            handlers[op](self, a, b_, c)
+
+
+def do_move(vm, a, b_, c):
+    vm.registers[a] = vm.registers[b_]
+
+
+def do_getglobal(vm, a, slot, c):
+    vm.registers[a] = vm.root[slot]
+
+
+def do_setglobal(vm, slot, b_, c):
+    vm.root[slot] = vm.registers[b_]
+
+
+def do_binary(op):
+    function = functions[op]
+
+    def do(vm, a, b_, c):
+        r = vm.registers
+        r[a] = number(function(r[b_], r[c]))
+    return do
+
+
+def do_not(vm, a, b_, c):
+    vm.registers[a] = not vm.registers[b_]
+
+
+def do_neg(vm, a, b_, c):
+    vm.registers[a] = -vm.registers[b_]
+
+
+def do_jmp(vm, a, b_, c):
+    vm.pc = a
+
+
+def do_jmpf(vm, a, b_, c):
+    if not vm.registers[a]:
+        vm.pc = b_
+
+
+def do_jmpt(vm, a, b_, c):
+    if vm.registers[a]:
+        vm.pc = b_
+
+
+def do_branch(op):
+    function = functions[{v: k for k, v in branch.items()}[op]]
+
+    def do(vm, a, b_, c):
+        if not function(vm.registers[b_], vm.registers[c]):
+            vm.pc = a
+    return do
+
+
+def do_fornext(vm, a, b_, c):
+    r = vm.registers
+    r[a] += r[b_ + 1]
+    if r[a] < r[b_]:
+        vm.pc = c
+
+
+def do_call(vm, a, b_, c):
+    function = vm.registers[b_]
+    registers = function.template[:]
+    n = function.nparams
+    registers[:n] = vm.registers[c:c + n]
+    vm.calls.append((vm.pc, a, vm.registers))
+    vm.registers = registers
+    vm.pc = function.entry
+
+
+def do_return(vm, a, b_, c):
+    value = vm.registers[a]
+    vm.pc, target, vm.registers = vm.calls.pop()
+    vm.registers[target] = value
+
+
+def do_stack(vm, a, operation, arguments):
+    handler, operand = operation
+    operands = Operands()
+    operands.data = [vm.registers[r] for r in arguments]
+    handler(operands, operand)
+    if a is not None and operands.data:
+        vm.registers[a] = operands.data.pop()
+
+
+handlers = [None] * len(names)
+for op, handler in {
+    MOVE: do_move,
+    GETGLOBAL: do_getglobal,
+    SETGLOBAL: do_setglobal,
+    NOT: do_not,
+    NEG: do_neg,
+    JMP: do_jmp,
+    JMPF: do_jmpf,
+    JMPT: do_jmpt,
+    FORNEXT: do_fornext,
+    CALL: do_call,
+    RETURN: do_return,
+    STACK: do_stack,
+}.items():
+    handlers[op] = handler
+for op in functions:
+    handlers[op] = do_binary(op)
+for op in branch.values():
+    handlers[op] = do_branch(op)
+
+
+def print_program(program: Program):
+    for i, (op, a, b_, c) in enumerate(program.code):
+        operands = " ".join(str(x) for x in (a, b_, c) if x is not None)
+        print(f"{i:=4} {names[op]:<10} {operands}")
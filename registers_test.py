@@ -0,0 +1,118 @@
+from collections import Counter
+import pytest
+from eval import print_statement, b_dict_operation, update_dict, get, numeric_literal
+import bytecode
+import registers
+from testing import parse, run_all
+
+
+def run_both(source, capsys):
+    # output of the program on the stack VM and the register VM, which must
+    # agree
+    program = parse(source)
+    vm = bytecode.VM()
+    vm.load(bytecode.compile(program))
+    vm.execute()
+    expected = capsys.readouterr().out
+    vm = registers.RegisterVM()
+    vm.load(registers.compile(program))
+    vm.execute()
+    assert capsys.readouterr().out == expected
+    return expected
+
+
+def test1_arithmetic(capsys):
+    source = """{
+        var total = 0;
+        for (i = 1; i < 100; i = i + 1) {
+            if (i % 3 == 0 or i % 5 == 0) { total = total + i; }
+        }
+        var x = 7;
+        var y = x / 2 - x % 4 * 3 ^ 2;
+        var j = 10;
+        while (j > 0 and total > 0) { j = j - 3; }
+        print total, y, j, -y, x != 7;
+    }"""
+    assert run_both(source, capsys) == "2318\n-7/2\n-2\n7/2\nFalse\n"
+
+    # temporaries stay in registers: only the loop and the print leave the
+    # register file
+    code = registers.compile(parse(source)).code
+    assert [insn[0] for insn in code].count(registers.STACK) == 5
+
+
+def test2_functions(capsys):
+    source = """{
+        var calls = 0;
+        def fib(n) {
+            var result = n;
+            if (n > 1) {
+                var a = fib(n - 1);
+                var b = fib(n - 2);
+                result = a + b;
+            }
+            calls = calls + 1;
+            return result;
+        }
+        def add(a, b) {
+            return a + b;
+        }
+        var f = fib(15);
+        var g = fib(5);
+        var h = add(1, 2);
+        print f, calls, add(g, h);
+    }"""
+    assert run_both(source, capsys) == "610\n1988\n8\n"
+
+
+def test3_dataStructures(capsys):
+    source = """{
+        var l = [1, 2, 3];
+        l[0] = 7;
+        var d = {"a": 1, "b": 2};
+        d["c"] = l[0] + d["b"];
+        l.append(4);
+        var n = l.length;
+        var s = "abc";
+        s[1] = "x";
+        print l, n, d["c"], s, d.keys;
+    }"""
+    run_both(source, capsys)
+
+
+def test4_instructions(capsys):
+    program = parse("""{
+        var n = 0;
+        for (i = 0; i < 1000; i = i + 1) { n = n + i * 2; }
+        print n;
+    }""")
+    stack = bytecode.VM()
+    stack.load(bytecode.compile(program))
+    stack_counts = Counter()
+    stack.execute_traced(stack_counts)
+    vm = registers.RegisterVM()
+    vm.load(registers.compile(program))
+    counts = Counter()
+    vm.execute_traced(counts)
+    assert capsys.readouterr().out == "999000\n999000\n"
+    # a MUL, an ADD and a FORNEXT per iteration
+    assert sum(counts.values()) < 3010
+    assert sum(counts.values()) < sum(stack_counts.values())
+
+
+def test5_dictCheck(capsys):
+    # check has no syntax, so it is added to a parsed program
+    program = parse("""{
+        var d = {1: 2};
+        print 0;
+    }""")
+    d = program.exps[0].variable
+    program.exps[1] = print_statement([
+        b_dict_operation("check", get(d), numeric_literal(1)),
+        b_dict_operation("check", get(d), numeric_literal(2))])
+    assert run_all(program, capsys).split() == ["True", "False"]
+    # what the register VM doesn't know is rejected, not compiled as a
+    # statement
+    program.exps[1] = print_statement([update_dict(d, {})])
+    with pytest.raises(Exception, match="not supported"):
+        registers.compile(program)
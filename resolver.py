@@ -7,10 +7,32 @@ from eval import *
 
 # resolver
 
+class resolver_environment(environment):
+    # besides the usual scopes, keeps one slot counter per function being
+    # resolved so every declared variable gets a (level, slot) address in the
+    # frame of the function that declares it
+
+    def __init__(self):
+        super().__init__()
+        self.frames = [0]
+
+    def declare(self, v: identifier):
+        self.add_to_scope(v.name, v)
+        v.level = len(self.frames) - 1
+        v.slot = self.frames[-1]
+        self.frames[-1] += 1
+
+    def start_function(self):
+        self.frames.append(0)
+
+    def end_function(self) -> int:
+        return self.frames.pop()
+
+
 def resolve(subprogram: AST, lexical_scope=None, name_space=None) -> AST:
 
     if name_space is None:
-        name_space = environment()
+        name_space = resolver_environment()
     if lexical_scope is None:
         lexical_scope = {}
 
@@ -45,7 +67,7 @@ def resolve(subprogram: AST, lexical_scope=None, name_space=None) -> AST:
             return let(v, re1, re2)
         case declare(identifier(name) as v, e):
             re = resolve_(e)
-            name_space.add_to_scope(name, v)
+            name_space.declare(v)
             return declare(v, re)
         case get(identifier(name)):
 
@@ -85,7 +107,7 @@ def resolve(subprogram: AST, lexical_scope=None, name_space=None) -> AST:
             return while_loop(rcondition, rbody)
         case for_loop(iterator, initial_value, condition, updation, body):
             name_space.start_scope()
-            name_space.add_to_scope(iterator.name, iterator)
+            name_space.declare(iterator)
             ri = resolve_(iterator)
             rinitial_value = resolve_(initial_value)
             rcondition = resolve_(condition)
@@ -96,14 +118,17 @@ def resolve(subprogram: AST, lexical_scope=None, name_space=None) -> AST:
         case print_statement(lst):
             return print_statement([resolve_(e) for e in lst])
         case Function(identifier(name) as v, parameters, body, return_exp):
-            name_space.add_to_scope(name, v)
+            name_space.declare(v)
             name_space.start_scope()
+            name_space.start_function()
             for p in parameters:
-                name_space.add_to_scope(p.name, p)
+                name_space.declare(p)
             rbody = block([resolve_(e) for e in body.exps])
             rreturn_exp = resolve_(return_exp)
+            frame_size = name_space.end_function()
             name_space.end_scope()
-            return Function(v, parameters, rbody, rreturn_exp)
+            return Function(v, parameters, rbody, rreturn_exp,
+                            frame_size=frame_size)
         case FunctionCall(fn, args):
             rfn = resolve_(fn)
             rargs = [resolve_(e) for e in args]
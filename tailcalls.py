@@ -0,0 +1,59 @@
+from eval import *
+from fold import subtrees, assigned
+
+
+# Self tail calls in a resolved AST (see resolver.resolve). A function's
+# return expression is the last thing it evaluates, so a call of the function
+# itself there, or a call whose result is stored in the variable that is then
+# returned, as in
+#
+#   def f(n, acc) {            def f(n, acc) {
+#       ...                        var ans = acc;
+#       return f(n - 1, x);        if (n > 0) { ans = f(n - 1, x); }
+#   }                              return ans;
+#                              }
+#
+# needs nothing of the running call once it returns. Such calls become
+# TailCall nodes, which the engines run as a jump back to the start of the
+# function in the frame they are already in, so the recursion runs in
+# constant stack space.
+
+
+def tail_calls(program: AST) -> AST:
+    # rewrites the functions of program in place, and returns it
+    changed = assigned(program)
+    for node in subtrees(program):
+        if isinstance(node, Function) and node.name.id not in changed:
+            rewrite(node)
+    return program
+
+
+def rewrite(function: Function):
+    level = 1 if function.name.level is None else function.name.level + 1
+
+    def self_call(program) -> bool:
+        match program:
+            case FunctionCall(fn, arguments):
+                return (fn.id == function.name.id
+                        and len(arguments) == len(function.parameters))
+        return False
+
+    def tail(program, result: identifier):
+        # program, the last statement of the function, with its calls that
+        # store their result in result made tail calls
+        match program:
+            case block(exps) if exps:
+                exps[-1] = tail(exps[-1], result)
+            case if_statement(_, if_exp, else_exp):
+                program.if_exp = tail(if_exp, result)
+                program.else_exp = tail(else_exp, result)
+            case set(variable, call) | declare(variable, call) if (
+                    variable.id == result.id and self_call(call)):
+                return TailCall(call, variable)
+        return program
+
+    match function.return_exp:
+        case call if self_call(call):
+            function.return_exp = TailCall(call)
+        case get(variable) if variable.level == level and variable.slot is not None:
+            function.body = tail(function.body, variable)
@@ -0,0 +1,65 @@
+from eval import TailCall
+from fold import subtrees
+from tailcalls import tail_calls
+import bytecode
+from testing import parse, run_all
+
+
+def test1_tailCalls(capsys):
+    # far deeper than Python's recursion limit
+    source = """{
+        def total(n, acc) {
+            var ans = acc;
+            if (n > 0) {
+                var m = n - 1;
+                var s = acc + n;
+                ans = total(m, s);
+            }
+            return ans;
+        }
+        def count(n) {
+            var m = n;
+            if (n > 0) { m = n - 1; }
+            return count(m);
+        }
+        var t = total(5000, 0);
+        print t;
+    }"""
+    program = tail_calls(parse(source))
+    calls = [node for node in subtrees(program) if isinstance(node, TailCall)]
+    assert len(calls) == 2
+    assert calls[0].variable.name == "ans" and calls[1].variable is None
+    assert run_all(program, capsys).split() == ["12502500"]
+
+    # the only call left in the VM's code is the one at the top level
+    code = bytecode.compile(program)
+    assert sum(isinstance(insn, bytecode.I.CALL) for insn in code.insns) == 1
+
+
+def test2_notTailCalls(capsys):
+    source = """{
+        def fib(n) {
+            var ans = n;
+            if (n > 1) {
+                var a = fib(n - 1);
+                var b = fib(n - 2);
+                ans = a + b;
+            }
+            return ans;
+        }
+        def twice(n) {
+            var ans = n;
+            if (n > 0) {
+                var m = n - 1;
+                ans = twice(m);
+                ans = ans + 2;
+            }
+            return ans;
+        }
+        var x = fib(10);
+        var y = twice(10);
+        print x, y;
+    }"""
+    program = tail_calls(parse(source))
+    assert not any(isinstance(node, TailCall) for node in subtrees(program))
+    assert run_all(program, capsys).split() == ["55", "20"]
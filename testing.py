@@ -0,0 +1,34 @@
+from lexer import bufferedLexer, Stream
+from Parser import Parser
+from resolver import resolve
+from eval import eval_ast, frame_environment
+import bytecode
+import closures
+import registers
+
+
+# Helpers the tests share.
+
+
+def parse(source, resolved=True):
+    # the AST of source, resolved unless resolved is False
+    tokens = bufferedLexer.lexerFromStream(Stream.streamFromString(source))
+    program = Parser.parse_expr(Parser.call_parser(tokens))
+    return resolve(program) if resolved else program
+
+
+def run_all(program, capsys):
+    # output of the program on each engine, which must all agree
+    eval_ast(program, None, frame_environment())
+    expected = capsys.readouterr().out
+    closures.compile(program).run()
+    assert capsys.readouterr().out == expected
+    vm = bytecode.VM()
+    vm.load(bytecode.compile(program))
+    vm.execute()
+    assert capsys.readouterr().out.split() == expected.split()
+    vm = registers.RegisterVM()
+    vm.load(registers.compile(program))
+    vm.execute()
+    assert capsys.readouterr().out.split() == expected.split()
+    return expected